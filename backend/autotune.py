@@ -0,0 +1,178 @@
+import functools
+import json
+import os
+import platform
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional
+
+import database
+
+# Calibrate before the first load of a model on this host, when no tuning is stored for it yet
+AUTOTUNE_ON_FIRST_LOAD = os.environ.get("CHAT_AUTOTUNE", "").lower() in ("1", "true", "yes")
+TUNED_KEYS = ("n_threads", "n_threads_batch", "n_batch")
+# Candidates above the prompt length measure nothing; llama.cpp's own default is 512
+BATCH_CANDIDATES = (128, 256, 512)
+DEFAULT_N_BATCH = 512
+# Small context: the KV cache size doesn't change the per-token compute being compared
+TUNE_N_CTX = 1024
+PROMPT_TOKENS = 512
+DECODE_TOKENS = 32
+REPEATS = 2
+_PROMPT_TEXT = "The quick brown fox jumps over the lazy dog while the band plays a slow waltz in the old town square. "
+
+
+class TrialInterrupted(Exception):
+    """A trial gave up the model to more urgent work; its measurements are discarded and it runs again."""
+
+
+def usable_cpus() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+@functools.lru_cache(maxsize=None)
+def host_signature() -> str:
+    """CPU model and usable core count: a tuning only carries over to hosts where both match."""
+    cpu = ""
+    try:
+        with open("/proc/cpuinfo") as f:
+            cpu = next((line.split(":", 1)[1].strip() for line in f if line.startswith("model name")), "")
+    except OSError:
+        pass
+    return f"{platform.system()}-{platform.machine()} {cpu or platform.processor() or 'unknown'} x{usable_cpus()}"
+
+
+def thread_candidates(cpus: Optional[int] = None) -> List[int]:
+    cpus = cpus or usable_cpus()
+    return sorted({max(cpus // 4, 1), max(cpus // 2, 1), max(cpus * 3 // 4, 1), cpus})
+
+
+def stored_options(models_dir, name: str, host: Optional[str] = None) -> Dict[str, Any]:
+    """The tuned load options for `name` on this host, or {} when it was never tuned or the file changed since. Blocking."""
+    row = database.get_load_tuning(name, host or host_signature())
+    try:
+        stat = os.stat(os.path.join(models_dir, name))
+    except OSError:
+        return {}
+    if row is None or row["size"] != stat.st_size or row["mtime_ns"] != stat.st_mtime_ns:
+        return {}
+    return json.loads(row["options"])
+
+
+def stored_tuning(models_dir, name: str) -> Optional[Dict[str, Any]]:
+    host = host_signature()
+    options = stored_options(models_dir, name, host)
+    if not options:
+        return None
+    row = database.get_load_tuning(name, host)
+    return {"model_name": name, "host": host, "options": options, "trials": json.loads(row["trials"]), "tuned_at": row["tuned_at"]}
+
+
+def _benchmark_prompt(llm, run: int) -> str:
+    # A different opening per run, so llama_cpp can't reuse the previous run's evaluated prefix
+    words = (_PROMPT_TEXT * (PROMPT_TOKENS // 8)).split()
+    text = f"Run {run}: " + " ".join(words)
+    tokens = llm.tokenize(text.encode("utf-8"), add_bos=False)[:PROMPT_TOKENS]
+    return llm.detokenize(tokens).decode("utf-8", errors="ignore")
+
+
+def _measure(llm, run: int, interrupted: Callable[[], bool]) -> Dict[str, Optional[float]]:
+    prompt = _benchmark_prompt(llm, run)
+    n_prompt = len(llm.tokenize(prompt.encode("utf-8")))
+    started = time.monotonic()
+    first = last = None
+    n = 0
+    for _ in llm(prompt, max_tokens=DECODE_TOKENS, temperature=0.0, stream=True):
+        if interrupted():
+            raise TrialInterrupted()
+        last = time.monotonic()
+        first = first or last
+        n += 1
+    return {
+        "prompt_tokens_per_second": n_prompt / (first - started) if first and first > started else None,
+        "decode_tokens_per_second": (n - 1) / (last - first) if n > 1 and last > first else None,
+    }
+
+
+def _trial(llama_factory: Callable, path: str, options: Dict[str, int], interrupted: Callable[[], bool]) -> Dict[str, Any]:
+    started = time.monotonic()
+    llm = llama_factory(model_path=path, n_ctx=TUNE_N_CTX, n_gpu_layers=0, verbose=False, **options)
+    try:
+        load_seconds = time.monotonic() - started
+        # Warm-up: the first evaluation after a load pages in the weights
+        for _ in llm(f"Warm up {time.monotonic_ns()}", max_tokens=1, stream=True):
+            pass
+        runs = [_measure(llm, run, interrupted) for run in range(REPEATS)]
+    finally:
+        if hasattr(llm, "close"):
+            llm.close()
+
+    def best(key: str) -> Optional[float]:
+        rates = [r[key] for r in runs if r[key] is not None]
+        return round(max(rates), 2) if rates else None
+
+    return {
+        **options,
+        "load_seconds": round(load_seconds, 2),
+        "prompt_tokens_per_second": best("prompt_tokens_per_second"),
+        "decode_tokens_per_second": best("decode_tokens_per_second"),
+    }
+
+
+@contextmanager
+def _hold_nothing() -> Iterator[Callable[[], bool]]:
+    yield lambda: False
+
+
+def calibrate(models_dir, name: str, llama_factory: Optional[Callable] = None, on_trial: Optional[Callable[[Dict[str, Any], int], None]] = None,
+              cancel: Optional[threading.Event] = None, hold: Callable[[], ContextManager[Callable[[], bool]]] = _hold_nothing) -> Dict[str, Any]:
+    """
+    Find the fastest `n_threads`, `n_threads_batch` and `n_batch` for `name` on this host, one at a time:
+    decode speed picks `n_threads`, then prompt evaluation speed picks `n_threads_batch`, then `n_batch`.
+    Each candidate is a fresh load with a small context. Stores and returns the winner. Blocking, and slow:
+    about ten loads of the model. `on_trial` is called with each trial and how many are planned in total.
+    Each trial runs inside `hold()`, which waits until the machine is free for it and gives a callable that
+    turns true when the trial must give way; the trial is then dropped and run again under a new `hold()`.
+    """
+    if llama_factory is None:
+        from llama_cpp import Llama as llama_factory
+    path = os.path.join(models_dir, name)
+    stat = os.stat(path)
+    threads = thread_candidates()
+    planned = len(threads) + (len(threads) - 1) + (len(BATCH_CANDIDATES) - 1)
+    trials: List[Dict[str, Any]] = []
+
+    def run(options: Dict[str, int]) -> Dict[str, Any]:
+        for trial in trials:
+            if all(trial[k] == v for k, v in options.items()):
+                return trial
+        while True:
+            if cancel is not None and cancel.is_set():
+                raise InterruptedError("Calibration was cancelled.")
+            with hold() as interrupted:
+                try:
+                    trials.append(_trial(llama_factory, path, options, lambda: interrupted() or (cancel is not None and cancel.is_set())))
+                    break
+                except TrialInterrupted:
+                    pass
+        if on_trial is not None:
+            on_trial(trials[-1], planned)
+        return trials[-1]
+
+    def fastest(candidates: List[Dict[str, Any]], key: str) -> Dict[str, Any]:
+        return max(candidates, key=lambda t: t[key] or 0)
+
+    best = fastest([run({"n_threads": t, "n_threads_batch": t, "n_batch": DEFAULT_N_BATCH}) for t in threads], "decode_tokens_per_second")
+    n_threads = best["n_threads"]
+    best = fastest([run({"n_threads": n_threads, "n_threads_batch": t, "n_batch": DEFAULT_N_BATCH}) for t in threads], "prompt_tokens_per_second")
+    n_threads_batch = best["n_threads_batch"]
+    best = fastest([run({"n_threads": n_threads, "n_threads_batch": n_threads_batch, "n_batch": b}) for b in BATCH_CANDIDATES], "prompt_tokens_per_second")
+    options = {k: best[k] for k in TUNED_KEYS}
+
+    host = host_signature()
+    tuned_at = int(time.time())
+    database.save_load_tuning(name, host, stat.st_size, stat.st_mtime_ns, json.dumps(options), json.dumps(trials), tuned_at)
+    return {"model_name": name, "host": host, "options": options, "trials": trials, "tuned_at": tuned_at}
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+# A minimal in-process ASGI client. Unlike httpx's ASGITransport it hands out response body chunks as the
+# app sends them, so time to first byte and per-line timings are measured, not just the time to the last byte.
+
+
+class ASGIResponse:
+    def __init__(self):
+        self.status: Optional[int] = None
+        self.headers: List[Tuple[bytes, bytes]] = []
+        self.started = time.perf_counter()
+        self.first_byte: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self._chunks: asyncio.Queue = asyncio.Queue()
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        while True:
+            chunk = await self._chunks.get()
+            if chunk is None:
+                return
+            yield chunk
+
+    async def lines(self) -> AsyncIterator[Tuple[float, Dict[str, Any]]]:
+        """NDJSON lines with the time each one arrived, in seconds since the request was sent."""
+        buffer = b""
+        async for chunk in self.chunks():
+            arrived = time.perf_counter() - self.started
+            buffer += chunk
+            *complete, buffer = buffer.split(b"\n")
+            for line in complete:
+                if line.strip():
+                    yield arrived, json.loads(line)
+
+    async def body(self) -> bytes:
+        return b"".join([chunk async for chunk in self.chunks()])
+
+    async def json(self) -> Any:
+        return json.loads(await self.body())
+
+
+class ASGIClient:
+    def __init__(self, app):
+        self.app = app
+
+    async def startup(self):
+        await self.app.router.startup()
+
+    async def shutdown(self):
+        await self.app.router.shutdown()
+
+    async def request(self, method: str, path: str, json_body: Any = None, params: Optional[Dict[str, Any]] = None) -> ASGIResponse:
+        """Send a request and return once the response has started; read its body from the returned response."""
+        body = b"" if json_body is None else json.dumps(json_body).encode("utf-8")
+        headers = [(b"host", b"bench"), (b"content-length", str(len(body)).encode())]
+        if json_body is not None:
+            headers.append((b"content-type", b"application/json"))
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+            "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+            "query_string": urlencode(params or {}).encode(), "headers": headers,
+            "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+        }
+        response = ASGIResponse()
+        started = asyncio.get_running_loop().create_future()
+        finished = asyncio.Event()
+        sent_body = False
+
+        async def receive():
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # The client stays connected until the response is complete
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response.status = message["status"]
+                response.headers = message.get("headers", [])
+                started.set_result(None)
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                if chunk:
+                    if response.first_byte is None:
+                        response.first_byte = time.perf_counter() - response.started
+                    response._chunks.put_nowait(chunk)
+                if not message.get("more_body", False):
+                    finished.set()
+                    response._chunks.put_nowait(None)
+
+        async def run():
+            try:
+                await self.app(scope, receive, send)
+            except BaseException as e:
+                if not started.done():
+                    started.set_exception(e)
+                raise
+            finally:
+                if not finished.is_set():
+                    finished.set()
+                    response._chunks.put_nowait(None)
+
+        task = asyncio.create_task(run())
+        await started
+        response.task = task
+        return response
+
+    async def get_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        response = await self.request("GET", path, params=params)
+        return await response.json()
+
+    async def post_json(self, path: str, json_body: Any = None) -> Any:
+        response = await self.request("POST", path, json_body)
+        return await response.json()
+
+    async def put_json(self, path: str, json_body: Any = None) -> Any:
+        response = await self.request("PUT", path, json_body)
+        return await response.json()
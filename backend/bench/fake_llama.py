@@ -0,0 +1,201 @@
+import struct
+import sys
+import threading
+import time
+import types
+import zlib
+from typing import Dict, Iterator, List
+
+import numpy as np
+
+# A deterministic stand-in for llama_cpp's `Llama`: the same prompt always gets the same reply, paced at a fixed
+# rate, so timings measure the server around the model rather than the model.
+
+REPLY_WORDS = (
+    "The quick brown fox jumps over the lazy dog while the server streams every token to the client "
+    "and the database keeps the history of each session in order"
+).split()
+EMBEDDING_DIM = 64
+
+
+class FakeLlamaState:
+    """Picklable like `LlamaState`, so the KV cache can spill it to disk."""
+
+    def __init__(self, ids: List[int], state_bytes: int):
+        self.input_ids = np.array(ids, dtype=np.intc)
+        self.scores = np.zeros((1, 1), dtype=np.single)
+        self.llama_state = bytes(state_bytes)
+        self.llama_state_size = state_bytes
+        self.n_tokens = len(ids)
+
+
+class FakeLlama:
+    """
+    Emits `tokens_per_second` reply tokens and evaluates prompts at `prompt_tokens_per_second`.
+    Like llama.cpp, only the part of a prompt past the prefix already in the context is evaluated,
+    so session-state reuse shows up in the timings. Words are tokens.
+    """
+
+    tokens_per_second = 50.0
+    prompt_tokens_per_second = 2000.0
+    # Bytes of fake KV state per token in a saved state
+    state_bytes_per_token = 64
+    # Shared by every instance, like one tokenizer across loads of the same model
+    _vocab: Dict[str, int] = {}
+    _words: List[str] = []
+    _vocab_lock = threading.Lock()
+
+    def __init__(self, model_path: str = None, n_ctx: int = 512, **kwargs):
+        self.model_path = model_path
+        self._n_ctx = n_ctx
+        self.options = kwargs
+        self.metadata = {
+            "general.architecture": "llama",
+            "llama.context_length": "8192",
+            "llama.block_count": "4",
+            "llama.embedding_length": "256",
+            "llama.attention.head_count": "4",
+            "llama.attention.head_count_kv": "4",
+        }
+        self._ids: List[int] = []
+
+    @property
+    def n_tokens(self) -> int:
+        return len(self._ids)
+
+    def n_ctx(self) -> int:
+        return self._n_ctx
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        ids = [self._token_id(w) for w in text.decode("utf-8", errors="ignore").split()]
+        return [0] + ids if add_bos else ids
+
+    def detokenize(self, tokens: List[int]) -> bytes:
+        return " ".join(self._words[t - 1] for t in tokens if t > 0).encode("utf-8")
+
+    def save_state(self) -> FakeLlamaState:
+        return FakeLlamaState(self._ids, len(self._ids) * self.state_bytes_per_token)
+
+    def load_state(self, state: FakeLlamaState):
+        self._ids = [int(t) for t in state.input_ids]
+
+    def create_chat_completion(self, messages, max_tokens: int = 16, stream: bool = False, **kwargs):
+        prompt = "\n".join(f"{m['role']}: {m['content']}" for m in messages) + "\nassistant:"
+        chunks = self._generate(prompt, max_tokens)
+        if stream:
+            return ({"choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]} for text in chunks)
+        return {"choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(chunks)}, "finish_reason": "length"}]}
+
+    def __call__(self, prompt: str, max_tokens: int = 16, stream: bool = False, **kwargs):
+        chunks = self._generate(prompt, max_tokens)
+        if stream:
+            return ({"choices": [{"index": 0, "text": text, "finish_reason": None}]} for text in chunks)
+        return {"choices": [{"index": 0, "text": "".join(chunks), "finish_reason": "length"}]}
+
+    def embed(self, inputs, normalize: bool = True, truncate: bool = True):
+        """Hashed bag of words, so texts sharing words land close together."""
+        texts = inputs if isinstance(inputs, list) else [inputs]
+        vectors = np.zeros((len(texts), EMBEDDING_DIM), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[row, zlib.crc32(word.encode()) % EMBEDDING_DIM] += 1.0
+        if normalize:
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors.tolist() if isinstance(inputs, list) else vectors[0].tolist()
+
+    def close(self):
+        self._ids = []
+
+    def _token_id(self, word: str) -> int:
+        token = self._vocab.get(word)
+        if token is None:
+            with self._vocab_lock:
+                token = self._vocab.get(word)
+                if token is None:
+                    self._words.append(word)
+                    token = self._vocab[word] = len(self._words)
+        return token
+
+    def _generate(self, prompt: str, max_tokens: int):
+        # Prompt evaluation happens on the first `next()`, as in llama_cpp's streaming generators
+        prompt_ids = self.tokenize(prompt.encode("utf-8"))
+        common = 0
+        for a, b in zip(self._ids, prompt_ids):
+            if a != b:
+                break
+            common += 1
+        self._ids = prompt_ids
+        time.sleep((len(prompt_ids) - common) / self.prompt_tokens_per_second)
+        start = zlib.crc32(prompt.encode("utf-8")) % len(REPLY_WORDS)
+        n = min(max_tokens, max(self._n_ctx - len(self._ids), 0))
+        return _Paced(self, [REPLY_WORDS[(start + i) % len(REPLY_WORDS)] + " " for i in range(n)])
+
+
+class _Paced:
+    """Yields reply chunks on a fixed schedule; deadlines are absolute, so sleep overshoot doesn't accumulate."""
+
+    def __init__(self, llm: FakeLlama, chunks: List[str]):
+        self.llm = llm
+        self.chunks = chunks
+        self.started = None
+        self.i = 0
+
+    def __iter__(self) -> Iterator[str]:
+        return self
+
+    def __next__(self) -> str:
+        if self.i >= len(self.chunks):
+            raise StopIteration
+        if self.started is None:
+            self.started = time.monotonic()
+        delay = self.started + (self.i + 1) / self.llm.tokens_per_second - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        chunk = self.chunks[self.i]
+        self.i += 1
+        self.llm._ids.append(self.llm._token_id(chunk.strip()))
+        return chunk
+
+    def close(self):
+        self.i = len(self.chunks)
+
+
+def install(tokens_per_second: float = FakeLlama.tokens_per_second, prompt_tokens_per_second: float = FakeLlama.prompt_tokens_per_second):
+    """Make `import llama_cpp` resolve to the fake. Call before importing anything that imports llama_cpp."""
+    FakeLlama.tokens_per_second = tokens_per_second
+    FakeLlama.prompt_tokens_per_second = prompt_tokens_per_second
+    module = types.ModuleType("llama_cpp")
+    module.Llama = FakeLlama
+    module.LlamaState = FakeLlamaState
+    sys.modules["llama_cpp"] = module
+
+
+def make(tokens_per_second: float, prompt_tokens_per_second: float, **kwargs) -> FakeLlama:
+    """Picklable `Llama` factory for model worker processes, which don't see `install` from the parent."""
+    FakeLlama.tokens_per_second = tokens_per_second
+    FakeLlama.prompt_tokens_per_second = prompt_tokens_per_second
+    return FakeLlama(**kwargs)
+
+
+def write_model(path: str, context_length: int = 8192):
+    """A GGUF file with just a header, so the model catalog can describe it and the pool can budget for it."""
+
+    def string(value: str) -> bytes:
+        data = value.encode("utf-8")
+        return struct.pack("<Q", len(data)) + data
+
+    def u32(key: str, value: int) -> bytes:
+        return string(key) + struct.pack("<II", 4, value)
+
+    kvs = [
+        string("general.architecture") + struct.pack("<I", 8) + string("llama"),
+        string("general.name") + struct.pack("<I", 8) + string("Bench Fake"),
+        u32("general.file_type", 15),
+        u32("llama.context_length", context_length),
+        u32("llama.block_count", 4),
+        u32("llama.embedding_length", 256),
+        u32("llama.attention.head_count", 4),
+        u32("llama.attention.head_count_kv", 4),
+    ]
+    with open(path, "wb") as f:
+        f.write(b"GGUF" + struct.pack("<IQQ", 3, 0, len(kvs)) + b"".join(kvs))
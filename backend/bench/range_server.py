@@ -0,0 +1,115 @@
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+
+# A local stand-in for a model host: serves one in-memory file over HTTP with `Range` support, and can
+# misbehave on purpose (drop connections mid-body, answer with fewer bytes than asked, ignore `Range`),
+# so the downloader's retry, resume and verification paths can be exercised offline.
+
+_RANGE_RE = re.compile(r"^bytes=(\d+)-(\d*)$")
+
+
+class RangeServer:
+    """
+    Serves `data` at `url` on 127.0.0.1. Fault knobs, changeable between downloads:
+    `drop_requests` GETs send `drop_after` bytes of their body, then close the connection;
+    `short_requests` GETs answer a well-formed 206 for only `short_bytes` of the asked range;
+    `ranges=False` ignores `Range` and doesn't advertise it.
+    """
+
+    def __init__(self, data: bytes, path: str = "/model.gguf"):
+        self.data = data
+        self.path = path
+        self.ranges = True
+        self.drop_requests = 0
+        self.drop_after = 0
+        self.short_requests = 0
+        self.short_bytes = 0
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(self))
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}{self.path}"
+
+    def start(self) -> "RangeServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="range-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_sent = 0
+
+    def _fault(self) -> Tuple[bool, bool]:
+        """Whether this GET drops its connection or comes back short; each one uses up a knob."""
+        with self._lock:
+            self.requests += 1
+            if self.drop_requests > 0:
+                self.drop_requests -= 1
+                return True, False
+            if self.short_requests > 0:
+                self.short_requests -= 1
+                return False, True
+            return False, False
+
+    def _sent(self, n: int):
+        with self._lock:
+            self.bytes_sent += n
+
+
+def _handler(server: RangeServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_HEAD(self):
+            if self.path != server.path:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(server.data)))
+            if server.ranges:
+                self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+
+        def do_GET(self):
+            if self.path != server.path:
+                self.send_error(404)
+                return
+            drop, short = server._fault()
+            size = len(server.data)
+            match = _RANGE_RE.match(self.headers.get("Range", "")) if server.ranges else None
+            if match:
+                start = int(match.group(1))
+                end = min(int(match.group(2)) + 1 if match.group(2) else size, size)
+                if short:
+                    end = min(end, start + server.short_bytes)
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+            else:
+                start, end = 0, size
+                self.send_response(200)
+            body = server.data[start:end]
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if drop:
+                # Promised the whole body, sends part of it and hangs up: the client sees a broken transfer
+                body = body[:server.drop_after]
+                self.close_connection = True
+            self.wfile.write(body)
+            server._sent(len(body))
+
+    return Handler
@@ -0,0 +1,549 @@
+"""
+Offline benchmarks for the chat server, driven in-process against a fake model.
+
+    cd backend && python -m bench.run [--quick] [--output results.json]
+
+Each scenario runs in a fresh interpreter with its own empty data directory, so results don't depend on
+the local chat history, downloaded models, or one scenario's leftovers. Results are one JSON document.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+MODEL_NAME = "bench-fake.gguf"
+SEED = 1234
+MESSAGES_PER_SESSION = 100
+PROBE_ENDPOINTS = (
+    ("sessions", "/api/v1/sessions", {"limit": 50, "summary": "true"}),
+    ("queue", "/api/v1/chat/queue", None),
+    ("metrics", "/metrics", None),
+)
+LOOP_LAG_INTERVAL = 0.01
+
+
+def summarize(samples: List[float], scale: float = 1000.0) -> Dict[str, Any]:
+    """Percentiles of `samples` (seconds), in milliseconds by default."""
+    if not samples:
+        return {"n": 0}
+    ordered = sorted(samples)
+
+    def pct(p: float) -> float:
+        return round(ordered[min(int(p / 100 * len(ordered)), len(ordered) - 1)] * scale, 3)
+
+    return {
+        "n": len(ordered),
+        "mean": round(sum(ordered) / len(ordered) * scale, 3),
+        "p50": pct(50), "p95": pct(95), "p99": pct(99), "max": round(ordered[-1] * scale, 3),
+    }
+
+
+def _prepare_process(data_dir: str, tokens_per_second: float, prompt_tokens_per_second: float, workers: int = 0):
+    """Point the app at an empty data directory and at the fake model; must run before `database` is imported."""
+    os.environ["XDG_DATA_HOME"] = data_dir
+    os.environ["CHAT_MODEL_WORKERS"] = str(workers)
+    from bench import fake_llama
+
+    fake_llama.install(tokens_per_second, prompt_tokens_per_second)
+
+
+# --- Chat streaming and responsiveness ---
+async def _probe_loop(client, stop: asyncio.Event, latencies: Dict[str, List[float]], interval: float):
+    while not stop.is_set():
+        for name, path, params in PROBE_ENDPOINTS:
+            started = time.perf_counter()
+            await (await client.request("GET", path, params=params)).body()
+            latencies[name].append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+
+
+async def _loop_lag(stop: asyncio.Event, lags: List[float]):
+    """How late the event loop wakes up from a short sleep; anything blocking the loop shows up here."""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lags.append(max(time.perf_counter() - started - LOOP_LAG_INTERVAL, 0.0))
+
+
+async def _measure_responsiveness(client, workload: Optional[Callable], probe_interval: float, idle_seconds: float) -> Dict[str, Any]:
+    stop = asyncio.Event()
+    latencies: Dict[str, List[float]] = {name: [] for name, _, _ in PROBE_ENDPOINTS}
+    lags: List[float] = []
+    probes = [asyncio.create_task(_probe_loop(client, stop, latencies, probe_interval)), asyncio.create_task(_loop_lag(stop, lags))]
+    try:
+        result = await workload() if workload is not None else await asyncio.sleep(idle_seconds)
+    finally:
+        stop.set()
+        await asyncio.gather(*probes)
+    return {
+        "result": result,
+        "endpoint_latency_ms": {name: summarize(samples) for name, samples in latencies.items()},
+        "loop_lag_ms": summarize(lags),
+    }
+
+
+async def _chat_turn(client, session_id: str, prompt: str, coalesce_ms: float) -> Dict[str, Any]:
+    response = await client.request("POST", "/api/v1/chat/stream", {"session_id": session_id, "prompt": prompt, "coalesce_ms": coalesce_ms})
+    first_token, tokens, stats, error = None, 0, None, None
+    async for arrived, line in response.lines():
+        if "token" in line or "thought_token" in line:
+            tokens += 1
+            if first_token is None:
+                first_token = arrived
+        elif "stats" in line:
+            stats = line["stats"]
+        elif line.get("status") == "error":
+            error = line.get("message")
+    return {
+        "status": response.status, "error": error, "ttfb": response.first_byte, "ttft": first_token,
+        "total": time.perf_counter() - response.started, "token_lines": tokens, "stats": stats,
+    }
+
+
+async def _chat_round(client, concurrency: int, turns: int, max_tokens: int, coalesce_ms: float) -> Dict[str, Any]:
+    sessions = []
+    for i in range(concurrency):
+        session = await client.post_json("/api/v1/sessions", {"title": f"bench {i}"})
+        await client.put_json(f"/api/v1/sessions/{session['id']}/parameters", {
+            "temperature": 0.7, "top_p": 0.95, "max_tokens": max_tokens, "repeat_penalty": 1.1, "n_ctx": 4096,
+        })
+        sessions.append(session["id"])
+
+    async def converse(index: int, session_id: str) -> List[Dict[str, Any]]:
+        return [await _chat_turn(client, session_id, f"Question {turn} from session {index}: how does streaming work?", coalesce_ms) for turn in range(turns)]
+
+    started = time.perf_counter()
+    results = [r for rs in await asyncio.gather(*(converse(i, s) for i, s in enumerate(sessions))) for r in rs]
+    wall = time.perf_counter() - started
+    completion_tokens = sum((r["stats"] or {}).get("completion_tokens", 0) for r in results)
+    decode_rates = [r["stats"]["decode_tokens_per_second"] for r in results if r["stats"] and r["stats"].get("decode_tokens_per_second")]
+    return {
+        "concurrency": concurrency,
+        "turns": len(results),
+        "errors": sum(1 for r in results if r["status"] != 200 or r["error"] or r["stats"] is None),
+        "wall_seconds": round(wall, 3),
+        "completion_tokens": completion_tokens,
+        # Fewer than completion_tokens when the stream coalesces tokens
+        "token_lines": sum(r["token_lines"] for r in results),
+        "throughput_tokens_per_second": round(completion_tokens / wall, 2) if wall else None,
+        "ttfb_ms": summarize([r["ttfb"] for r in results if r["ttfb"] is not None]),
+        "ttft_ms": summarize([r["ttft"] for r in results if r["ttft"] is not None]),
+        "turn_latency_ms": summarize([r["total"] for r in results]),
+        "queue_wait_ms": summarize([r["stats"]["queue_wait_seconds"] for r in results if r["stats"] and r["stats"]["queue_wait_seconds"] is not None]),
+        "server_db_ms": summarize([r["stats"]["db_seconds"] for r in results if r["stats"]]),
+        "decode_tokens_per_second": summarize(decode_rates, scale=1.0),
+    }
+
+
+async def _chat_scenario(args: Dict[str, Any]) -> Dict[str, Any]:
+    import main
+    from bench.asgi_client import ASGIClient
+    from bench import fake_llama
+    from bench.fake_llama import write_model
+
+    if main.model_workers is not None:
+        main.model_workers.llama_factory = functools.partial(fake_llama.make, args["tokens_per_second"], args["prompt_tokens_per_second"])
+    client = ASGIClient(main.app)
+    await client.startup()
+    try:
+        write_model(os.path.join(main.MODELS_DIR, MODEL_NAME))
+        load = await client.request("POST", "/api/v1/models/load", {"model_name": MODEL_NAME})
+        statuses = [line async for _, line in load.lines()]
+        if statuses[-1].get("status") != "complete":
+            raise RuntimeError(f"Fake model failed to load: {statuses[-1]}")
+
+        idle = await _measure_responsiveness(client, None, args["probe_interval"], args["idle_seconds"])
+        rounds = []
+        for concurrency in args["concurrency"]:
+            measured = await _measure_responsiveness(
+                client, lambda: _chat_round(client, concurrency, args["turns"], args["max_tokens"], args["coalesce_ms"]), args["probe_interval"], 0,
+            )
+            rounds.append({**measured.pop("result"), "responsiveness": measured})
+            print(f"  chat x{concurrency}: {rounds[-1]['throughput_tokens_per_second']} tok/s, ttft p50 {rounds[-1]['ttft_ms'].get('p50')} ms", file=sys.stderr)
+        return {"idle_responsiveness": {k: v for k, v in idle.items() if k != "result"}, "rounds": rounds}
+    finally:
+        await client.shutdown()
+
+
+def chat_scenario(data_dir: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    _prepare_process(data_dir, args["tokens_per_second"], args["prompt_tokens_per_second"], args["workers"])
+    return asyncio.run(_chat_scenario(args))
+
+
+# --- Database latency ---
+def _seed(database, n_messages: int, rng: random.Random, vocabulary: List[str]) -> List[str]:
+    """`n_messages` messages in sessions of MESSAGES_PER_SESSION, written straight through SQL in large commits."""
+    n_sessions = max(n_messages // MESSAGES_PER_SESSION, 1)
+    session_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(n_sessions)]
+    now = int(time.time())
+    with database.transaction() as conn:
+        conn.executemany("INSERT INTO sessions (id, title, timestamp) VALUES (?, ?, ?)", [
+            (sid, f"Session {i}", now - n_sessions + i) for i, sid in enumerate(session_ids)
+        ])
+    batch = []
+    for i in range(n_messages):
+        words = rng.choices(vocabulary, k=rng.randint(8, 60))
+        batch.append((session_ids[i % n_sessions], "user" if (i // n_sessions) % 2 == 0 else "assistant", " ".join(words), len(words), MODEL_NAME))
+        if len(batch) == 10000 or i == n_messages - 1:
+            with database.transaction() as conn:
+                conn.executemany("INSERT INTO messages (session_id, role, content, token_count, token_model) VALUES (?, ?, ?, ?, ?)", batch)
+            batch = []
+    with database.transaction() as conn:
+        conn.execute("""
+            UPDATE sessions SET message_count = (SELECT COUNT(*) FROM messages WHERE session_id = sessions.id),
+            last_message = (SELECT substr(content, 1, ?) FROM messages WHERE session_id = sessions.id ORDER BY id DESC LIMIT 1)
+        """, (database.PREVIEW_CHARS,))
+    return session_ids
+
+
+def db_scenario(data_dir: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    _prepare_process(data_dir, args["tokens_per_second"], args["prompt_tokens_per_second"])
+    import database
+
+    database.initialize_database()
+    rng = random.Random(SEED)
+    # Zipf-like word frequencies, so searches for common and rare words both have realistic hit counts
+    vocabulary = [f"w{i}" for i in range(5000)]
+    weighted = [w for i, w in enumerate(vocabulary) for _ in range(max(5000 // (i + 1), 1))]
+    started = time.perf_counter()
+    session_ids = _seed(database, args["messages"], rng, weighted)
+    seed_seconds = time.perf_counter() - started
+    max_id = database._connection().execute("SELECT MAX(id) FROM messages").fetchone()[0]
+    sessions_page = database.get_sessions(limit=50, summary=True)
+    repeat = args["repeat"]
+
+    operations = {
+        "add_message": lambda: database.add_message(rng.choice(session_ids), "user", " ".join(rng.choices(weighted, k=30)), 30, MODEL_NAME),
+        "get_session_details": lambda: database.get_session_details(rng.choice(session_ids)),
+        "get_sessions_page": lambda: database.get_sessions(limit=50, summary=True),
+        "get_sessions_next_page": lambda: database.get_sessions(sessions_page[-1]["id"], 50, True),
+        "get_messages_page": lambda: database.get_messages(rng.choice(session_ids), None, 50),
+        "get_recent_messages_within": lambda: database.get_recent_messages_within(rng.choice(session_ids), 4096, 8),
+        "get_first_messages": lambda: database.get_first_messages(rng.choice(session_ids), 6),
+        "get_messages_after": lambda: database.get_messages_after(rng.randint(1, max_id), 16),
+        "get_messages_by_ids": lambda: database.get_messages_by_ids(rng.sample(range(1, max_id + 1), min(20, max_id))),
+        "search_common_word": lambda: database.search_messages(vocabulary[0], None, 20, 0),
+        "search_rare_word": lambda: database.search_messages(rng.choice(vocabulary[2500:]), None, 20, 0),
+        "search_in_session": lambda: database.search_messages(rng.choice(vocabulary[:100]), rng.choice(session_ids), 20, 0),
+    }
+    results = {}
+    for name, operation in operations.items():
+        operation()  # warm the statement cache and pages
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            operation()
+            samples.append(time.perf_counter() - started)
+        results[name] = summarize(samples)
+    database.close_all()
+    size = os.path.getsize(database.DATABASE_NAME)
+    print(f"  db {args['messages']} messages: seeded in {seed_seconds:.1f}s", file=sys.stderr)
+    return {
+        "messages": args["messages"], "sessions": len(session_ids), "seed_seconds": round(seed_seconds, 2),
+        "database_bytes": size, "latency_ms": results,
+    }
+
+
+# --- Model pool ---
+POOL_MODEL_MB = 4
+POOL_BUDGET_MB = 10
+POOL_N_CTX = 512
+SLOW_LOAD_SECONDS = 1.0
+
+
+async def _pool_scenario() -> Dict[str, Any]:
+    import main
+    from bench import fake_llama
+    from bench.asgi_client import ASGIClient
+
+    # Two models that each fit the budget but not together (weights plus a 2 MB KV cache at POOL_N_CTX)
+    names = ("pool-a.gguf", "pool-b.gguf", "pool-slow.gguf")
+    for name in names:
+        path = os.path.join(main.MODELS_DIR, name)
+        fake_llama.write_model(path)
+        with open(path, "r+b") as f:
+            f.truncate(POOL_MODEL_MB << 20)
+    original_init = fake_llama.FakeLlama.__init__
+
+    def init(self, model_path=None, **kwargs):
+        if model_path and model_path.endswith("pool-slow.gguf"):
+            time.sleep(SLOW_LOAD_SECONDS)
+        original_init(self, model_path=model_path, **kwargs)
+
+    fake_llama.FakeLlama.__init__ = init
+    client = ASGIClient(main.app)
+    await client.startup()
+
+    async def load(name: str) -> str:
+        response = await client.request("POST", "/api/v1/models/load", {"model_name": name, "n_ctx": POOL_N_CTX})
+        return [line async for _, line in response.lines()][-1]["status"]
+
+    def resident() -> List[str]:
+        return [m["model_name"] for m in main.model_pool.stats()["models"]]
+
+    async def swap_default_under_tight_budget():
+        # Only one model fits: each swap must keep the model just loaded and evict the previous default
+        statuses = [await load("pool-a.gguf"), await load("pool-b.gguf")]
+        after_first_swap = resident()
+        statuses.append(await load("pool-a.gguf"))
+        after_second_swap = resident()
+        return {
+            "ok": statuses == ["complete"] * 3 and after_first_swap == ["pool-b.gguf"] and after_second_swap == ["pool-a.gguf"],
+            "resident_after_swaps": [after_first_swap, after_second_swap],
+        }
+
+    async def serve_resident_during_load():
+        # The current default keeps answering while another model takes SLOW_LOAD_SECONDS to load
+        main.model_pool.budget_bytes = (POOL_BUDGET_MB * 2) << 20
+        await load("pool-a.gguf")
+        session = await client.post_json("/api/v1/sessions", {"title": "pool"})
+        # The resident instance's context, so the chat needs no load of its own
+        await client.put_json(f"/api/v1/sessions/{session['id']}/parameters", {
+            "temperature": 0.7, "top_p": 0.95, "max_tokens": 16, "repeat_penalty": 1.1, "n_ctx": POOL_N_CTX,
+        })
+        loading = asyncio.ensure_future(load("pool-slow.gguf"))
+        await asyncio.sleep(SLOW_LOAD_SECONDS / 10)
+        turn = await _chat_turn(client, session["id"], "Are you still there?", 0)
+        status = await loading
+        first_token_seconds = turn["stats"]["time_to_first_token_seconds"] if turn["stats"] else None
+        return {
+            "ok": status == "complete" and first_token_seconds is not None and first_token_seconds < SLOW_LOAD_SECONDS / 2,
+            "time_to_first_token_seconds": first_token_seconds,
+        }
+
+    checks = {}
+    try:
+        for check in (swap_default_under_tight_budget, serve_resident_during_load):
+            started = time.perf_counter()
+            checks[check.__name__] = {**await check(), "seconds": round(time.perf_counter() - started, 2)}
+    finally:
+        await client.shutdown()
+    return checks
+
+
+def pool_scenario(data_dir: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    """Model loads and swaps in the in-process pool under a tight RAM budget."""
+    os.environ["CHAT_MODEL_POOL_BUDGET_MB"] = str(POOL_BUDGET_MB)
+    _prepare_process(data_dir, args["tokens_per_second"], args["prompt_tokens_per_second"])
+    checks = asyncio.run(_pool_scenario())
+    failed = [name for name, result in checks.items() if not result["ok"]]
+    print(f"  models: {len(checks) - len(failed)}/{len(checks)} checks passed", file=sys.stderr)
+    if failed:
+        raise RuntimeError(f"model pool checks failed: {json.dumps({name: checks[name] for name in failed})}")
+    return {"checks": checks}
+
+
+# --- Model downloads ---
+def download_scenario(data_dir: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    """The download engine against a local Range server: fault recovery checks, then throughput by part count."""
+    import hashlib
+
+    import downloader
+    from bench.range_server import RangeServer
+
+    # Small parts and buffers, so a few MB exercise several ranges and resume points; fewer retries, so giving up is quick
+    downloader.DOWNLOAD_MIN_PART_BYTES = 1 << 20
+    downloader.DOWNLOAD_BUFFER_BYTES = 256 << 10
+    downloader.DOWNLOAD_RETRIES = 2
+    size = args["download_mb"] << 20
+    data = random.Random(SEED).randbytes(size)
+    sha256 = hashlib.sha256(data).hexdigest()
+    server = RangeServer(data).start()
+
+    def fetch(name: str, **kwargs) -> str:
+        dest = os.path.join(data_dir, name)
+        downloader.download_file(server.url, dest, **kwargs)
+        return dest
+
+    def intact(dest: str) -> bool:
+        with open(dest, "rb") as f:
+            return f.read() == data and not os.path.exists(dest + downloader.PART_SUFFIX)
+
+    def retry_after_drop():
+        server.drop_requests, server.drop_after = downloader.DOWNLOAD_PARTS, 100 << 10
+        return {"ok": intact(fetch("drop.gguf", sha256=sha256)), "requests": server.requests}
+
+    def retry_after_short():
+        server.short_requests, server.short_bytes = 2, 64 << 10
+        return {"ok": intact(fetch("short.gguf", sha256=sha256)), "requests": server.requests}
+
+    def short_until_retries_run_out():
+        server.short_requests, server.short_bytes = 1 << 30, 64 << 10
+        try:
+            fetch("exhausted.gguf")
+            return {"ok": False, "error": None}
+        except downloader.DownloadError as e:
+            return {"ok": not os.path.exists(os.path.join(data_dir, "exhausted.gguf")), "error": str(e)}
+        finally:
+            server.short_requests = 0
+
+    def resume_after_cancel():
+        cancel = threading.Event()
+
+        def progress(done: int, total: Optional[int]):
+            if done >= size // 2:
+                cancel.set()
+
+        try:
+            fetch("resume.gguf", sha256=sha256, progress=progress, cancel=cancel)
+            return {"ok": False, "cancelled": False}
+        except downloader.DownloadCancelled:
+            pass
+        kept = downloader.partial_size(os.path.join(data_dir, "resume.gguf"))
+        server.reset_counters()
+        dest = fetch("resume.gguf", sha256=sha256)
+        # Only the missing bytes are fetched again
+        return {"ok": intact(dest) and kept > 0 and server.bytes_sent == size - kept, "kept_bytes": kept, "refetched_bytes": server.bytes_sent}
+
+    def bad_sha256():
+        dest = os.path.join(data_dir, "corrupt.gguf")
+        try:
+            fetch("corrupt.gguf", sha256="0" * 64)
+            return {"ok": False, "error": None}
+        except downloader.DownloadError as e:
+            leftovers = [p for p in (dest, dest + downloader.PART_SUFFIX, dest + downloader.STATE_SUFFIX) if os.path.exists(p)]
+            return {"ok": not leftovers, "error": str(e)}
+
+    def without_range_support():
+        server.ranges = False
+        try:
+            return {"ok": intact(fetch("stream.gguf", sha256=sha256)), "requests": server.requests}
+        finally:
+            server.ranges = True
+
+    checks = {}
+    try:
+        for check in (retry_after_drop, retry_after_short, short_until_retries_run_out, resume_after_cancel, bad_sha256, without_range_support):
+            server.reset_counters()
+            started = time.perf_counter()
+            checks[check.__name__] = {**check(), "seconds": round(time.perf_counter() - started, 2)}
+        throughput = {}
+        for parts in (1, downloader.DOWNLOAD_PARTS):
+            started = time.perf_counter()
+            os.remove(fetch(f"throughput-{parts}.gguf", sha256=sha256, parts=parts))
+            throughput[parts] = round(size / (1 << 20) / (time.perf_counter() - started), 1)
+    finally:
+        server.stop()
+    failed = [name for name, result in checks.items() if not result["ok"]]
+    print(f"  download {args['download_mb']} MB: {len(checks) - len(failed)}/{len(checks)} checks passed, {throughput} MB/s by parts", file=sys.stderr)
+    if failed:
+        raise RuntimeError(f"download checks failed: {json.dumps({name: checks[name] for name in failed})}")
+    return {"size_bytes": size, "checks": checks, "throughput_mb_per_second": throughput}
+
+
+# --- Runner ---
+def _run_child(conn, scenario: Callable[[str, Dict[str, Any]], Dict[str, Any]], data_dir: str, args: Dict[str, Any]):
+    try:
+        conn.send((True, scenario(data_dir, args)))
+    except BaseException as e:
+        conn.send((False, f"{type(e).__name__}: {e}"))
+        raise
+
+
+def run_isolated(scenario: Callable[[str, Dict[str, Any]], Dict[str, Any]], args: Dict[str, Any]) -> Dict[str, Any]:
+    """Run a scenario in a fresh spawned interpreter with its own temporary data directory."""
+    with tempfile.TemporaryDirectory(prefix="chat-bench-") as data_dir:
+        context = multiprocessing.get_context("spawn")
+        conn, child_conn = context.Pipe(duplex=False)
+        # A plain process rather than a Pool: a Pool's processes are daemonic and can't start model workers
+        process = context.Process(target=_run_child, args=(child_conn, scenario, data_dir, args))
+        process.start()
+        child_conn.close()
+        try:
+            ok, result = conn.recv()
+        except EOFError:
+            ok, result = False, f"exited with code {process.exitcode}"
+        process.join()
+        if not ok:
+            raise RuntimeError(f"Scenario {scenario.__name__} failed: {result}")
+        return result
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the chat server in-process against a fake model.")
+    parser.add_argument("--scenarios", default="chat,db,models,download", help="Comma-separated: chat, db, models, download")
+    parser.add_argument("--concurrency", default="1,4,16", help="Concurrent chat sessions per round")
+    parser.add_argument("--turns", type=int, default=2, help="Chat turns per session; later turns reuse the session's prompt state")
+    parser.add_argument("--max-tokens", type=int, default=64, help="Reply length in tokens")
+    parser.add_argument("--coalesce-ms", type=float, default=0, help="Ask the chat stream to batch tokens over this many ms")
+    parser.add_argument("--workers", type=int, default=0, help="Model worker processes (CHAT_MODEL_WORKERS); 0 generates in the server process")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0, help="Decode rate of the fake model")
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=2000.0, help="Prompt evaluation rate of the fake model")
+    parser.add_argument("--probe-interval", type=float, default=0.05, help="Pause between responsiveness probes, in seconds")
+    parser.add_argument("--db-sizes", default="1000,100000,1000000", help="Message counts to benchmark the database at")
+    parser.add_argument("--repeat", type=int, default=200, help="Samples per database operation")
+    parser.add_argument("--download-mb", type=int, default=64, help="Size of the file served to the download benchmark")
+    parser.add_argument("--quick", action="store_true", help="Small sizes for a smoke run")
+    parser.add_argument("--output", help="Write the JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.concurrency, args.turns, args.max_tokens, args.db_sizes, args.repeat, args.download_mb = "1,4", 1, 16, "1000,10000", 50, 8
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = {s.strip() for s in args.scenarios.split(",") if s.strip()}
+    settings = {
+        "tokens_per_second": args.tokens_per_second,
+        "prompt_tokens_per_second": args.prompt_tokens_per_second,
+        "concurrency": [int(c) for c in args.concurrency.split(",")],
+        "turns": args.turns,
+        "max_tokens": args.max_tokens,
+        "coalesce_ms": args.coalesce_ms,
+        "workers": args.workers,
+        "probe_interval": args.probe_interval,
+        "idle_seconds": 1.0,
+        "repeat": args.repeat,
+        "download_mb": args.download_mb,
+    }
+    report: Dict[str, Any] = {"environment": environment(), "settings": {**settings, "db_sizes": args.db_sizes}, "results": {}}
+    if "chat" in scenarios:
+        print("Running chat streaming benchmark...", file=sys.stderr)
+        report["results"]["chat"] = run_isolated(chat_scenario, settings)
+    if "db" in scenarios:
+        print("Running database benchmark...", file=sys.stderr)
+        report["results"]["db"] = [run_isolated(db_scenario, {**settings, "messages": int(n)}) for n in args.db_sizes.split(",")]
+    if "models" in scenarios:
+        print("Running model pool checks...", file=sys.stderr)
+        report["results"]["models"] = run_isolated(pool_scenario, settings)
+    if "download" in scenarios:
+        print("Running download benchmark...", file=sys.stderr)
+        report["results"]["download"] = run_isolated(download_scenario, settings)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import asyncio
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+# Finished turns stay replayable this long, so a client that lost its connection can pick up where it left off
+RESUME_SECONDS = 120.0
+TOKEN_KEYS = ("token", "thought_token")
+
+Frame = Dict[str, Any]
+
+
+def is_token(frame: Frame) -> bool:
+    return len(frame) == 1 and next(iter(frame)) in TOKEN_KEYS
+
+
+def merge_frames(frames: List[Frame]) -> List[Tuple[int, Frame]]:
+    """
+    Join runs of adjacent token frames of the same kind into one frame; other frames pass through.
+    Each merged frame comes with how many of `frames` it and the ones before it cover.
+    """
+    merged: List[Tuple[int, Frame]] = []
+    for n, frame in enumerate(frames, 1):
+        if merged and is_token(frame) and merged[-1][1].keys() == frame.keys():
+            key = next(iter(frame))
+            merged[-1] = (n, {key: merged[-1][1][key] + frame[key]})
+        else:
+            merged.append((n, frame))
+    return merged
+
+
+class TurnStream:
+    """
+    Every frame of one chat turn (status lines, tokens, the final stats), in order.
+    Frames are kept until the turn expires, so any number of followers can read it from any offset,
+    and a follower that reconnects resumes at the offset it last saw.
+    """
+
+    def __init__(self, session_id: str):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.frames: List[Frame] = []
+        self.done = False
+        self._changed = asyncio.Event()
+
+    def emit(self, frame: Frame):
+        self.frames.append(frame)
+        self._notify()
+
+    def close(self):
+        self.done = True
+        self._notify()
+
+    def _notify(self):
+        # Each waiter holds the event current when it started waiting; replace it so the next wait blocks again
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self, offset: int = 0, flush_ms: float = 0, flush_tokens: int = 1) -> AsyncIterator[List[Frame]]:
+        """
+        Yield batches of consecutive frames from frame `offset` on, until the turn is done.
+        Without coalescing every frame is its own batch. With it, token frames are held back until
+        `flush_tokens` of them are pending or the oldest has waited `flush_ms` (whichever are set);
+        any other frame flushes at once.
+        """
+        coalesce = flush_ms > 0 or flush_tokens > 1
+        max_pending = flush_tokens if flush_tokens > 1 else float("inf")
+        loop = asyncio.get_running_loop()
+        while True:
+            while offset >= len(self.frames) and not self.done:
+                await self._changed.wait()
+            if offset >= len(self.frames):
+                return
+            if not coalesce:
+                offset += 1
+                yield [self.frames[offset - 1]]
+                continue
+            deadline = loop.time() + flush_ms / 1000 if flush_ms > 0 else None
+            while not self.done and len(self.frames) - offset < max_pending and all(map(is_token, self.frames[offset:])):
+                remaining = None if deadline is None else deadline - loop.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            batch = self.frames[offset:]
+            offset += len(batch)
+            yield batch
+
+
+class TurnRegistry:
+    """The live and recently finished turns, by id and by session."""
+
+    def __init__(self, keep_seconds: float = RESUME_SECONDS):
+        self.keep_seconds = keep_seconds
+        self._turns: Dict[str, TurnStream] = {}
+        self._latest: Dict[str, TurnStream] = {}
+        self._changed = asyncio.Event()
+
+    def start(self, session_id: str) -> TurnStream:
+        turn = TurnStream(session_id)
+        self._turns[turn.id] = turn
+        self._latest[session_id] = turn
+        self._changed.set()
+        self._changed = asyncio.Event()
+        return turn
+
+    def finish(self, turn: TurnStream):
+        turn.close()
+        asyncio.get_running_loop().call_later(self.keep_seconds, self._expire, turn)
+
+    def get(self, turn_id: str) -> Optional[TurnStream]:
+        return self._turns.get(turn_id)
+
+    def live(self, session_id: str) -> Optional[TurnStream]:
+        turn = self._latest.get(session_id)
+        return turn if turn is not None and not turn.done else None
+
+    def _expire(self, turn: TurnStream):
+        self._turns.pop(turn.id, None)
+        if self._latest.get(turn.session_id) is turn:
+            del self._latest[turn.session_id]
+
+    async def follow_session(self, session_id: str, turn_id: Optional[str] = None, offset: int = 0,
+                             flush_ms: float = 0, flush_tokens: int = 1) -> AsyncIterator[Frame]:
+        """
+        Frames of the session's turns, each tagged with its `turn_id` and the `offset` to resume after it.
+        Starts at `offset` in `turn_id` when that turn is still kept, else at the start of the live turn,
+        then follows every turn the session starts until the caller stops iterating.
+        """
+        turn = self.get(turn_id) if turn_id else None
+        if turn is None or turn.session_id != session_id:
+            if turn_id:
+                # Its frames are gone; the client should reload the stored messages instead
+                yield {"turn_id": turn_id, "status": "expired"}
+            turn, offset = self.live(session_id), 0
+        followed = self._latest.get(session_id) if turn is None else None
+        while True:
+            if turn is not None:
+                async for batch in turn.follow(offset, flush_ms, flush_tokens):
+                    for n, frame in merge_frames(batch):
+                        yield {"turn_id": turn.id, "offset": offset + n, **frame}
+                    offset += len(batch)
+                followed, turn, offset = turn, None, 0
+            while turn is None:
+                latest = self._latest.get(session_id)
+                if latest is not None and latest is not followed:
+                    turn = latest
+                else:
+                    await self._changed.wait()
@@ -0,0 +1,48 @@
+from typing import Any, Dict, List, Optional
+
+import database
+
+# Role markers and separators a chat template adds around each message
+MESSAGE_OVERHEAD_TOKENS = 8
+# Head room for the assistant prefix and special tokens of the rendered prompt
+PROMPT_OVERHEAD_TOKENS = 32
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+
+def count_tokens(llm, text: str) -> int:
+    return len(llm.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+
+
+def fill_token_counts(llm, token_model: str, session_id: str):
+    """Tokenize only the messages of a session that have no count for this model yet, and store the counts."""
+    missing = database.get_messages_without_token_count(session_id, token_model)
+    if missing:
+        database.set_token_counts([(m["id"], count_tokens(llm, m["content"])) for m in missing], token_model)
+
+
+def history_budget(n_ctx: int, max_tokens: int) -> int:
+    return n_ctx - max_tokens - PROMPT_OVERHEAD_TOKENS
+
+
+def build_history_window(llm, token_model: str, session_id: str, n_ctx: int, max_tokens: int, system_prompt: Optional[str] = None, use_summary: bool = False) -> List[Dict[str, Any]]:
+    """
+    The largest recent suffix of the session's history that fits in `n_ctx - max_tokens` next to the system prompt.
+    With `use_summary`, the session's latest rolling summary stands in for the messages it covers.
+    Token counts are cached per message, so each turn only tokenizes the messages added since the last one.
+    Blocking; run it off the event loop.
+    """
+    fill_token_counts(llm, token_model, session_id)
+    budget = history_budget(n_ctx, max_tokens)
+    if system_prompt:
+        budget -= count_tokens(llm, system_prompt)
+    prefix, after_id = [], 0
+    summary = database.get_latest_summary(session_id) if use_summary else None
+    if summary:
+        content = SUMMARY_PREFIX + summary["content"]
+        budget -= count_tokens(llm, content) + MESSAGE_OVERHEAD_TOKENS
+        prefix, after_id = [{"role": "system", "content": content}], summary["end_message_id"]
+    window = database.get_recent_messages_within(session_id, max(budget, 0), MESSAGE_OVERHEAD_TOKENS, after_id)
+    # Chat templates expect the conversation to open with a user turn
+    while window and window[0]["role"] != "user":
+        window.pop(0)
+    return prefix + window
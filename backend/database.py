@@ -1,6 +1,11 @@
 import sqlite3
 import json
-from typing import List, Dict, Any, Optional
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Dict, Any, Optional, TypeVar
 import sys
 from pathlib import Path
 from platformdirs import user_data_dir
@@ -14,160 +19,529 @@ APP_DIR.mkdir(parents=True, exist_ok=True)
 
 DATABASE_NAME = APP_DIR / "chat_history.db"
 
+# --- Connection handling ---
+# Every thread keeps one long-lived connection, so sqlite3's per-connection statement cache is reused
+# across calls. WAL lets readers run alongside the single writer; synchronous=NORMAL is durable in WAL
+# mode except for the last commits before a power loss, and makes each commit an append to the log.
+_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 268435456",
+)
+DB_THREADS = 4
+# Length of the last-message preview kept on each session row for the sidebar
+PREVIEW_CHARS = 120
+# Shortest last word that search-as-you-type matches as a prefix
+PREFIX_MIN_CHARS = 3
+
+SESSION_COLUMNS = "id, title, timestamp, system_prompt_id, temperature, top_p, max_tokens, repeat_penalty, n_ctx, model_name"
+SESSION_SUMMARY_COLUMNS = "id, title, timestamp, model_name, message_count, last_message"
+
+_local = threading.local()
+_write_lock = threading.RLock()
+_connections: List[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="db")
+
+T = TypeVar("T")
+
+def _connection() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DATABASE_NAME, cached_statements=256, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in _PRAGMAS:
+            conn.execute(pragma)
+        _local.conn = conn
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Connection]:
+    """
+    Run several writes under one commit. Writers are serialized in-process so they never hit SQLITE_BUSY;
+    a nested `transaction()` joins the outer one.
+    """
+    conn = _connection()
+    if getattr(_local, "in_transaction", False):
+        yield conn
+        return
+    with _write_lock:
+        _local.in_transaction = True
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            _local.in_transaction = False
+
+async def run(fn: Callable[..., T], *args, **kwargs) -> T:
+    """Async facade: run a blocking database function on the DB thread pool instead of the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+def close_all():
+    with _connections_lock:
+        for conn in _connections:
+            conn.close()
+        _connections.clear()
+
+def _add_missing_column(cursor: sqlite3.Cursor, table: str, column: str, definition: str) -> bool:
+    columns = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
+    return False
+
 def initialize_database():
     """Creates the database and tables if they don't exist."""
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
+    with transaction() as conn:
+        cursor = conn.cursor()
     
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS sessions (
-        id TEXT PRIMARY KEY,
-        title TEXT NOT NULL,
-        timestamp INTEGER NOT NULL,
-        system_prompt_id INTEGER,
-        temperature REAL DEFAULT 0.7,
-        top_p REAL DEFAULT 0.95,
-        max_tokens INTEGER DEFAULT 1024,
-        repeat_penalty REAL DEFAULT 1.1,
-        n_ctx INTEGER DEFAULT 4096,
-        FOREIGN KEY (system_prompt_id) REFERENCES prompts (id) ON DELETE SET NULL
-    )
-    """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            timestamp INTEGER NOT NULL,
+            system_prompt_id INTEGER,
+            temperature REAL DEFAULT 0.7,
+            top_p REAL DEFAULT 0.95,
+            max_tokens INTEGER DEFAULT 1024,
+            repeat_penalty REAL DEFAULT 1.1,
+            n_ctx INTEGER DEFAULT 4096,
+            model_name TEXT,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            last_message TEXT,
+            summarize_history INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (system_prompt_id) REFERENCES prompts (id) ON DELETE SET NULL
+        )
+        """)
     
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS messages (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        session_id TEXT NOT NULL,
-        role TEXT NOT NULL,
-        content TEXT NOT NULL,
-        FOREIGN KEY (session_id) REFERENCES sessions (id) ON DELETE CASCADE
-    )
-    """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            token_count INTEGER,
+            token_model TEXT,
+            reasoning TEXT,
+            FOREIGN KEY (session_id) REFERENCES sessions (id) ON DELETE CASCADE
+        )
+        """)
+        # Serves per-session history reads in id order and the ON DELETE CASCADE lookup
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id)")
 
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS prompts (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT NOT NULL,
-        content TEXT NOT NULL
-    )
-    """)
-    
-    conn.commit()
-    conn.close()
+        # Columns added after the first release; CREATE TABLE IF NOT EXISTS won't add them to old databases
+        _add_missing_column(cursor, "sessions", "model_name", "TEXT")
+        if _add_missing_column(cursor, "sessions", "message_count", "INTEGER NOT NULL DEFAULT 0"):
+            _add_missing_column(cursor, "sessions", "last_message", "TEXT")
+            cursor.execute(f"""
+            UPDATE sessions SET
+                message_count = (SELECT COUNT(*) FROM messages WHERE session_id = sessions.id),
+                last_message = (SELECT substr(content, 1, {PREVIEW_CHARS}) FROM messages WHERE session_id = sessions.id ORDER BY id DESC LIMIT 1)
+            """)
+        _add_missing_column(cursor, "messages", "token_count", "INTEGER")
+        _add_missing_column(cursor, "messages", "token_model", "TEXT")
+        _add_missing_column(cursor, "messages", "reasoning", "TEXT")
+        _add_missing_column(cursor, "sessions", "summarize_history", "INTEGER NOT NULL DEFAULT 0")
+
+        # Full-text index over message content. External content: the text lives only in `messages`,
+        # and triggers keep the index in step, including rows removed by the sessions ON DELETE CASCADE.
+        # The session id is indexed too, so a search within a session intersects its few rows inside FTS
+        # instead of matching (and joining) every hit in the database first
+        backfill = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone() is None
+        cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            content, session_id, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )
+        """)
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, content, session_id) VALUES (new.id, new.content, new.session_id);
+        END
+        """)
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content, session_id) VALUES ('delete', old.id, old.content, old.session_id);
+        END
+        """)
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content, session_id) VALUES ('delete', old.id, old.content, old.session_id);
+            INSERT INTO messages_fts (rowid, content, session_id) VALUES (new.id, new.content, new.session_id);
+        END
+        """)
+        if backfill:
+            # Only the content counts towards bm25 ranking
+            cursor.execute("INSERT INTO messages_fts (messages_fts, rank) VALUES ('rank', 'bm25(1.0, 0.0)')")
+            cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+        # Rolling summaries of a session's older turns; each row covers messages start_message_id..end_message_id
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS summaries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            start_message_id INTEGER NOT NULL,
+            end_message_id INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            timestamp INTEGER NOT NULL DEFAULT (strftime('%s', 'now')),
+            FOREIGN KEY (session_id) REFERENCES sessions (id) ON DELETE CASCADE
+        )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_summaries_session ON summaries (session_id, end_message_id)")
+
+        # Keyset pagination of the session list walks this index
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_recent ON sessions (timestamp, id)")
+
+        # Registry of model downloads, so unfinished ones resume after a restart
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS downloads (
+            id TEXT PRIMARY KEY,
+            repo_id TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            status TEXT NOT NULL,
+            downloaded INTEGER NOT NULL DEFAULT 0,
+            total INTEGER,
+            error TEXT,
+            created_at INTEGER NOT NULL
+        )
+        """)
+
+        # Parsed GGUF headers of local models; a row is valid while the file's size and mtime match
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS model_catalog (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            info TEXT NOT NULL
+        )
+        """)
+
+        # Best thread/batch load options measured per model file and host CPU; a row is valid while the file's size and mtime match
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS load_tuning (
+            model_name TEXT NOT NULL,
+            host TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            options TEXT NOT NULL,
+            trials TEXT NOT NULL,
+            tuned_at INTEGER NOT NULL,
+            PRIMARY KEY (model_name, host)
+        )
+        """)
+
+        # Server-wide preferences, e.g. the last loaded model for loading it again on the next start
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        """)
+
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS prompts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL
+        )
+        """)
 
 # Session Management
 def add_session(session_id: str, title: str, timestamp: int):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO sessions (id, title, timestamp) VALUES (?, ?, ?)", (session_id, title, timestamp))
-    conn.commit()
-    conn.close()
-
-def get_sessions() -> List[Dict[str, Any]]:
-    conn = sqlite3.connect(DATABASE_NAME)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, title, timestamp, system_prompt_id, temperature, top_p, max_tokens, repeat_penalty, n_ctx FROM sessions ORDER BY timestamp DESC")
-    sessions = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return sessions
+    with transaction() as conn:
+        conn.execute("INSERT INTO sessions (id, title, timestamp) VALUES (?, ?, ?)", (session_id, title, timestamp))
+
+def get_sessions(before_id: Optional[str] = None, limit: Optional[int] = None, summary: bool = False) -> List[Dict[str, Any]]:
+    """
+    Sessions, most recent first. Pass the id of the last session of a page as `before_id` to get the next one.
+    With `summary`, only the sidebar fields plus the denormalized message count and preview are returned.
+    """
+    sql = f"SELECT {SESSION_SUMMARY_COLUMNS if summary else SESSION_COLUMNS} FROM sessions"
+    params: List[Any] = []
+    if before_id is not None:
+        sql += " WHERE (timestamp, id) < (SELECT timestamp, id FROM sessions WHERE id = ?)"
+        params.append(before_id)
+    sql += " ORDER BY timestamp DESC, id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return [dict(row) for row in _connection().execute(sql, params).fetchall()]
 
 def get_session_details(session_id: str) -> Optional[Dict[str, Any]]:
-    conn = sqlite3.connect(DATABASE_NAME)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM sessions WHERE id = ?", (session_id,))
-    session = cursor.fetchone()
-    conn.close()
+    session = _connection().execute("SELECT * FROM sessions WHERE id = ?", (session_id,)).fetchone()
     return dict(session) if session else None
 
-def get_messages(session_id: str) -> List[Dict[str, Any]]:
-    conn = sqlite3.connect(DATABASE_NAME)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT role, content FROM messages WHERE session_id = ?", (session_id,))
-    messages = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return messages
+def get_messages(session_id: str, before_id: Optional[int] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Messages of a session in chronological order. With `limit`, only the newest `limit` messages
+    older than `before_id` are returned; the first message's id is the cursor for the previous page.
+    """
+    sql = "SELECT id, role, content, reasoning FROM messages WHERE session_id = ?"
+    params: List[Any] = [session_id]
+    if before_id is not None:
+        sql += " AND id < ?"
+        params.append(before_id)
+    if limit is None:
+        return [dict(row) for row in _connection().execute(sql + " ORDER BY id", params).fetchall()]
+    rows = _connection().execute(sql + " ORDER BY id DESC LIMIT ?", params + [limit]).fetchall()
+    return [dict(row) for row in reversed(rows)]
+
+def get_first_messages(session_id: str, limit: int) -> List[Dict[str, Any]]:
+    rows = _connection().execute(
+        "SELECT id, role, content FROM messages WHERE session_id = ? ORDER BY id LIMIT ?", (session_id, limit)
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+def add_message(session_id: str, role: str, content: str, token_count: Optional[int] = None, token_model: Optional[str] = None, reasoning: Optional[str] = None) -> int:
+    with transaction() as conn:
+        message_id = conn.execute(
+            "INSERT INTO messages (session_id, role, content, token_count, token_model, reasoning) VALUES (?, ?, ?, ?, ?, ?)",
+            (session_id, role, content, token_count, token_model, reasoning),
+        ).lastrowid
+        conn.execute("""
+            UPDATE sessions
+            SET timestamp = strftime('%s', 'now'), message_count = message_count + 1, last_message = substr(?, 1, ?)
+            WHERE id = ?
+        """, (content, PREVIEW_CHARS, session_id))
+    return message_id
 
-def add_message(session_id: str, role: str, content: str):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)", (session_id, role, content))
-    cursor.execute("UPDATE sessions SET timestamp = strftime('%s', 'now') WHERE id = ?", (session_id,))
-    conn.commit()
-    conn.close()
+def get_messages_without_token_count(session_id: str, token_model: str) -> List[Dict[str, Any]]:
+    """Messages whose token count is missing or was computed with another model's tokenizer."""
+    cursor = _connection().execute(
+        "SELECT id, content FROM messages WHERE session_id = ? AND (token_count IS NULL OR token_model IS NOT ?)",
+        (session_id, token_model),
+    )
+    return [dict(row) for row in cursor.fetchall()]
+
+def set_token_counts(counts: List[tuple], token_model: str):
+    """`counts` is a list of (message_id, token_count) pairs, written in one commit."""
+    with transaction() as conn:
+        conn.executemany(
+            "UPDATE messages SET token_count = ?, token_model = ? WHERE id = ?",
+            [(count, token_model, message_id) for message_id, count in counts],
+        )
+
+def get_recent_messages_within(session_id: str, token_budget: int, per_message_overhead: int = 0, after_id: int = 0) -> List[Dict[str, Any]]:
+    """
+    The longest suffix of a session's history (messages after `after_id`) whose token counts
+    (plus `per_message_overhead` each) fit in `token_budget`, in chronological order.
+    Token counts must be filled in first.
+    """
+    cursor = _connection().execute(
+        "SELECT id, role, content, token_count FROM messages WHERE session_id = ? AND id > ? ORDER BY id DESC",
+        (session_id, after_id),
+    )
+    # Rows are stepped lazily, so only the messages that end up in the window are read
+    window, used = [], 0
+    for row in cursor:
+        used += row["token_count"] + per_message_overhead
+        if used > token_budget:
+            break
+        window.append(dict(row))
+    cursor.close()
+    window.reverse()
+    return window
 
 def update_session_title(session_id: str, new_title: str):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE sessions SET title = ? WHERE id = ?", (new_title, session_id))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("UPDATE sessions SET title = ? WHERE id = ?", (new_title, session_id))
 
 def delete_session(session_id: str):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
 
 def update_session_parameters(session_id: str, temperature: float, top_p: float, max_tokens: int, repeat_penalty: float, n_ctx: int):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("""
-        UPDATE sessions 
-        SET temperature = ?, top_p = ?, max_tokens = ?, repeat_penalty = ?, n_ctx = ?
-        WHERE id = ?
-    """, (temperature, top_p, max_tokens, repeat_penalty, n_ctx, session_id))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("""
+            UPDATE sessions 
+            SET temperature = ?, top_p = ?, max_tokens = ?, repeat_penalty = ?, n_ctx = ?
+            WHERE id = ?
+        """, (temperature, top_p, max_tokens, repeat_penalty, n_ctx, session_id))
+
+def set_session_model(session_id: str, model_name: Optional[str]):
+    with transaction() as conn:
+        conn.execute("UPDATE sessions SET model_name = ? WHERE id = ?", (model_name, session_id))
+
+def set_session_summarization(session_id: str, enabled: bool):
+    with transaction() as conn:
+        conn.execute("UPDATE sessions SET summarize_history = ? WHERE id = ?", (int(enabled), session_id))
+
+# Summaries
+def get_latest_summary(session_id: str) -> Optional[Dict[str, Any]]:
+    summary = _connection().execute(
+        "SELECT * FROM summaries WHERE session_id = ? ORDER BY end_message_id DESC LIMIT 1", (session_id,)
+    ).fetchone()
+    return dict(summary) if summary else None
+
+def add_summary(session_id: str, start_message_id: int, end_message_id: int, content: str) -> int:
+    with transaction() as conn:
+        return conn.execute(
+            "INSERT INTO summaries (session_id, start_message_id, end_message_id, content) VALUES (?, ?, ?, ?)",
+            (session_id, start_message_id, end_message_id, content),
+        ).lastrowid
+
+def get_messages_between(session_id: str, after_id: int, before_id: int, token_budget: int) -> List[Dict[str, Any]]:
+    """
+    Oldest messages with after_id < id < before_id, in order, until their token counts exceed `token_budget`.
+    The first one is returned even when it alone is over the budget; callers clip it.
+    """
+    cursor = _connection().execute(
+        "SELECT id, role, content, token_count FROM messages WHERE session_id = ? AND id > ? AND id < ? ORDER BY id",
+        (session_id, after_id, before_id),
+    )
+    messages, used = [], 0
+    for row in cursor:
+        used += row["token_count"] or 0
+        if messages and used > token_budget:
+            break
+        messages.append(dict(row))
+    cursor.close()
+    return messages
+
+# Search
+def _fts_query(text: str) -> str:
+    """
+    User input as an FTS5 query on message content: every word must match. The last word also matches as a
+    prefix (search-as-you-type) while it is still being typed, i.e. without trailing whitespace, and once it
+    has PREFIX_MIN_CHARS characters; shorter prefixes expand to a large part of the vocabulary.
+    """
+    words = text.split()
+    terms = ['"' + term.replace('"', '""') + '"' for term in words]
+    if terms and not text[-1].isspace() and len(words[-1]) >= PREFIX_MIN_CHARS:
+        terms[-1] += "*"
+    return "content : (" + " ".join(terms) + ")" if terms else ""
+
+def search_messages(query: str, session_id: Optional[str] = None, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+    """Best bm25 matches first, with a highlighted snippet; `[` and `]` mark the matched terms."""
+    match = _fts_query(query)
+    if not match:
+        return []
+    if session_id is not None:
+        # Intersected inside FTS with the session's short doclist, before anything is ranked or joined
+        match += ' AND session_id : "' + session_id.replace('"', '""') + '"'
+    sql = """
+        SELECT m.id AS message_id, m.session_id, s.title AS session_title, m.role,
+               snippet(messages_fts, 0, '[', ']', '...', 16) AS snippet, messages_fts.rank AS rank
+        FROM messages_fts
+        JOIN messages m ON m.id = messages_fts.rowid
+        JOIN sessions s ON s.id = m.session_id
+        WHERE messages_fts MATCH ?
+        ORDER BY messages_fts.rank LIMIT ? OFFSET ?"""
+    return [dict(row) for row in _connection().execute(sql, (match, limit, offset))]
+
+def get_messages_after(after_id: int, limit: int) -> List[Dict[str, Any]]:
+    """Messages of all sessions with id > after_id, oldest first."""
+    rows = _connection().execute("SELECT id, content FROM messages WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit)).fetchall()
+    return [dict(row) for row in rows]
+
+def get_messages_by_ids(message_ids: List[int]) -> List[Dict[str, Any]]:
+    """The messages that still exist among `message_ids`, with their session title and a content preview."""
+    if not message_ids:
+        return []
+    placeholders = ", ".join("?" * len(message_ids))
+    rows = _connection().execute(
+        f"""SELECT m.id AS message_id, m.session_id, s.title AS session_title, m.role,
+                   substr(m.content, 1, {PREVIEW_CHARS * 2}) AS preview
+            FROM messages m JOIN sessions s ON s.id = m.session_id
+            WHERE m.id IN ({placeholders})""",
+        message_ids,
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+# Downloads
+def save_download(download_id: str, repo_id: str, filename: str, status: str, downloaded: int, total: Optional[int], error: Optional[str], created_at: int):
+    with transaction() as conn:
+        conn.execute(
+            """INSERT INTO downloads (id, repo_id, filename, status, downloaded, total, error, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET status = excluded.status, downloaded = excluded.downloaded,
+                total = excluded.total, error = excluded.error""",
+            (download_id, repo_id, filename, status, downloaded, total, error, created_at),
+        )
+
+def get_downloads() -> List[Dict[str, Any]]:
+    return [dict(row) for row in _connection().execute("SELECT * FROM downloads ORDER BY created_at")]
+
+# Model Catalog
+def get_model_catalog(path: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    if path is None:
+        rows = _connection().execute("SELECT * FROM model_catalog")
+    else:
+        rows = _connection().execute("SELECT * FROM model_catalog WHERE path = ?", (path,))
+    return {row["path"]: dict(row) for row in rows}
+
+def save_model_catalog(rows: List[tuple]):
+    """`rows` is a list of (path, size, mtime_ns, info JSON) tuples, written in one commit."""
+    with transaction() as conn:
+        conn.executemany("INSERT OR REPLACE INTO model_catalog (path, size, mtime_ns, info) VALUES (?, ?, ?, ?)", rows)
+
+def delete_model_catalog(paths: List[str]):
+    with transaction() as conn:
+        conn.executemany("DELETE FROM model_catalog WHERE path = ?", [(p,) for p in paths])
+
+# Load Tuning
+def get_load_tuning(model_name: str, host: str) -> Optional[Dict[str, Any]]:
+    row = _connection().execute("SELECT * FROM load_tuning WHERE model_name = ? AND host = ?", (model_name, host)).fetchone()
+    return dict(row) if row else None
+
+def save_load_tuning(model_name: str, host: str, size: int, mtime_ns: int, options: str, trials: str, tuned_at: int):
+    """`options` and `trials` are JSON."""
+    with transaction() as conn:
+        conn.execute(
+            """INSERT OR REPLACE INTO load_tuning (model_name, host, size, mtime_ns, options, trials, tuned_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (model_name, host, size, mtime_ns, options, trials, tuned_at),
+        )
+
+def delete_load_tuning(model_name: str):
+    with transaction() as conn:
+        conn.execute("DELETE FROM load_tuning WHERE model_name = ?", (model_name,))
+
+# Settings
+def get_setting(key: str) -> Optional[str]:
+    row = _connection().execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else None
+
+def set_setting(key: str, value: str):
+    with transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
 
 # Prompt Management
 def create_prompt(title: str, content: str) -> Dict[str, Any]:
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO prompts (title, content) VALUES (?, ?)", (title, content))
-    prompt_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        prompt_id = conn.execute("INSERT INTO prompts (title, content) VALUES (?, ?)", (title, content)).lastrowid
     return {"id": prompt_id, "title": title, "content": content}
 
 def get_prompts() -> List[Dict[str, Any]]:
-    conn = sqlite3.connect(DATABASE_NAME)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM prompts ORDER BY title")
-    prompts = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return prompts
+    cursor = _connection().execute("SELECT * FROM prompts ORDER BY title")
+    return [dict(row) for row in cursor.fetchall()]
 
 def update_prompt(prompt_id: int, title: str, content: str):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE prompts SET title = ?, content = ? WHERE id = ?", (title, content, prompt_id))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("UPDATE prompts SET title = ?, content = ? WHERE id = ?", (title, content, prompt_id))
 
 def delete_prompt(prompt_id: int):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM prompts WHERE id = ?", (prompt_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("DELETE FROM prompts WHERE id = ?", (prompt_id,))
 
 def get_prompt_by_id(prompt_id: int) -> Optional[Dict[str, Any]]:
-    conn = sqlite3.connect(DATABASE_NAME)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM prompts WHERE id = ?", (prompt_id,))
-    prompt = cursor.fetchone()
-    conn.close()
+    prompt = _connection().execute("SELECT * FROM prompts WHERE id = ?", (prompt_id,)).fetchone()
     return dict(prompt) if prompt else None
 
-def set_session_prompt(session_id: str, prompt_id: Optional[int]):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE sessions SET system_prompt_id = ? WHERE id = ?", (prompt_id, session_id))
-    conn.commit()
-    conn.close()
+def set_session_prompt(session_id: str, prompt_id: Optional[int]) -> bool:
+    """False when `prompt_id` names no prompt (the foreign key rejects it)."""
+    with transaction() as conn:
+        try:
+            conn.execute("UPDATE sessions SET system_prompt_id = ? WHERE id = ?", (prompt_id, session_id))
+        except sqlite3.IntegrityError:
+            return False
+    return True
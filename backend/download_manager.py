@@ -0,0 +1,221 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+import database
+import downloader
+
+# How many files are fetched at once; further jobs wait in the queue
+DOWNLOAD_CONCURRENCY = int(os.environ.get("CHAT_DOWNLOAD_CONCURRENCY", 2))
+# Minimum seconds between progress events of one job
+PROGRESS_INTERVAL = 0.5
+
+QUEUED = "queued"
+DOWNLOADING = "downloading"
+PAUSED = "paused"
+COMPLETE = "complete"
+CANCELLED = "cancelled"
+ERROR = "error"
+FINISHED = (COMPLETE, CANCELLED, ERROR)
+
+
+class DownloadJob:
+    def __init__(self, id: str, repo_id: str, filename: str, status: str = QUEUED, downloaded: int = 0,
+                 total: Optional[int] = None, error: Optional[str] = None, created_at: Optional[int] = None):
+        self.id = id
+        self.repo_id = repo_id
+        self.filename = filename
+        self.status = status
+        self.downloaded = downloaded
+        self.total = total
+        self.error = error
+        self.created_at = created_at or int(time.time())
+        self.cancel_event = threading.Event()
+        # PAUSED or CANCELLED while a running worker winds down after `cancel_event`
+        self.stop_reason: Optional[str] = None
+        # Set and replaced on every change, so followers wake up once per event
+        self.changed = asyncio.Event()
+        self.last_report = 0.0
+        # Bytes fetched and seconds spent by the most recent run, for throughput
+        self.run_bytes = 0
+        self.run_seconds = 0.0
+
+    @property
+    def local_name(self) -> str:
+        # Files in repo subfolders land flat in MODELS_DIR, which is all the local model list looks at
+        return os.path.basename(self.filename)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "repo_id": self.repo_id,
+            "filename": self.filename,
+            "status": self.status,
+            "downloaded": self.downloaded,
+            "total": self.total,
+            "progress": (self.downloaded / self.total) * 100 if self.total else 0,
+            "message": self.error,
+            "created_at": self.created_at,
+        }
+
+
+class DownloadManager:
+    """
+    Runs model downloads as jobs with IDs, at most `concurrency` at a time, in FIFO order.
+    Jobs are recorded in the `downloads` table, so a restart resumes unfinished ones from their `.part` files.
+    Progress is sampled from the worker threads at most every PROGRESS_INTERVAL seconds per job and
+    handed to the event loop, where any number of clients can follow a job.
+    """
+
+    def __init__(self, models_dir, concurrency: int = DOWNLOAD_CONCURRENCY, on_complete: Optional[Callable[[DownloadJob], None]] = None):
+        self.models_dir = models_dir
+        self.concurrency = concurrency
+        self.on_complete = on_complete
+        self._jobs: Dict[str, DownloadJob] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closing = False
+
+    async def restore(self):
+        """Load the registry and re-queue the jobs that were running or queued when the app stopped."""
+        self._loop = asyncio.get_running_loop()
+        for row in await database.run(database.get_downloads):
+            job = DownloadJob(row["id"], row["repo_id"], row["filename"], row["status"], row["downloaded"], row["total"], row["error"], row["created_at"])
+            if job.status not in FINISHED:
+                job.downloaded = downloader.partial_size(self._path(job))
+            if job.status == DOWNLOADING:
+                job.status = QUEUED
+            self._jobs[job.id] = job
+        self._dispatch()
+
+    async def submit(self, repo_id: str, filename: str) -> DownloadJob:
+        """Queue a download. An unfinished job for the same file is reused (and resumed if paused)."""
+        self._loop = asyncio.get_running_loop()
+        for job in self._jobs.values():
+            if job.local_name == os.path.basename(filename) and job.status not in FINISHED:
+                if job.status == PAUSED:
+                    await self.resume(job.id)
+                return job
+        job = DownloadJob(str(uuid.uuid4()), repo_id, filename)
+        self._jobs[job.id] = job
+        await self._save(job)
+        self._dispatch()
+        return job
+
+    def get(self, job_id: str) -> Optional[DownloadJob]:
+        return self._jobs.get(job_id)
+
+    def jobs(self) -> List[DownloadJob]:
+        return sorted(self._jobs.values(), key=lambda j: j.created_at, reverse=True)
+
+    async def pause(self, job_id: str) -> DownloadJob:
+        return await self._stop(job_id, PAUSED)
+
+    async def cancel(self, job_id: str) -> DownloadJob:
+        """Stop a job for good and delete its partial data."""
+        return await self._stop(job_id, CANCELLED)
+
+    async def resume(self, job_id: str) -> DownloadJob:
+        job = self._jobs[job_id]
+        if job.status in (PAUSED, ERROR):
+            job.status, job.error = QUEUED, None
+            await self._save(job)
+            self._notify(job)
+            self._dispatch()
+        return job
+
+    async def follow(self, job_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """Yield the job's state now and after every change, until it is finished."""
+        job = self._jobs[job_id]
+        while True:
+            changed = job.changed
+            yield job.info()
+            if job.status in FINISHED:
+                return
+            await changed.wait()
+
+    def shutdown(self):
+        """Stop the workers, leaving their jobs recorded as running so the next start resumes them."""
+        self._closing = True
+        for job_id in self._tasks:
+            self._jobs[job_id].cancel_event.set()
+
+    def _path(self, job: DownloadJob) -> str:
+        return os.path.join(self.models_dir, job.local_name)
+
+    async def _stop(self, job_id: str, status: str) -> DownloadJob:
+        job = self._jobs[job_id]
+        if job.status in FINISHED:
+            return job
+        if job.id in self._tasks:
+            # The worker notices within one chunk; _run records the final status
+            job.stop_reason = status
+            job.cancel_event.set()
+            return job
+        job.status = status
+        if status == CANCELLED:
+            await asyncio.to_thread(downloader.discard_partial, self._path(job))
+            job.downloaded = 0
+        await self._save(job)
+        self._notify(job)
+        return job
+
+    def _dispatch(self):
+        if self._closing:
+            return
+        waiting = sorted((j for j in self._jobs.values() if j.status == QUEUED), key=lambda j: j.created_at)
+        for job in waiting[:max(self.concurrency - len(self._tasks), 0)]:
+            job.status = DOWNLOADING
+            job.cancel_event.clear()
+            job.stop_reason = None
+            self._tasks[job.id] = asyncio.create_task(self._run(job))
+
+    async def _run(self, job: DownloadJob):
+        await self._save(job)
+        self._notify(job)
+        started, start_bytes = time.monotonic(), job.downloaded
+        try:
+            await asyncio.to_thread(self._download, job)
+            job.status = COMPLETE
+            job.run_bytes, job.run_seconds = job.downloaded - start_bytes, time.monotonic() - started
+        except downloader.DownloadCancelled:
+            if self._closing:
+                return
+            job.status = job.stop_reason or PAUSED
+            if job.status == CANCELLED:
+                await asyncio.to_thread(downloader.discard_partial, self._path(job))
+                job.downloaded = 0
+        except Exception as e:
+            print(f"Download of {job.repo_id}/{job.filename} failed: {e}")
+            job.status, job.error = ERROR, str(e)
+        finally:
+            del self._tasks[job.id]
+        await self._save(job)
+        self._notify(job)
+        if job.status == COMPLETE and self.on_complete is not None:
+            self.on_complete(job)
+        self._dispatch()
+
+    def _download(self, job: DownloadJob):
+        """Worker thread body. Blocking."""
+        remote = downloader.resolve_hf_file(job.repo_id, job.filename)
+        job.total = remote["size"]
+
+        def report(downloaded: int, total: Optional[int]):
+            job.downloaded, job.total = downloaded, total
+            now = time.monotonic()
+            if now - job.last_report >= PROGRESS_INTERVAL:
+                job.last_report = now
+                self._loop.call_soon_threadsafe(self._notify, job)
+
+        downloader.download_file(remote["url"], self._path(job), size=remote["size"], sha256=remote["sha256"], progress=report, cancel=job.cancel_event)
+
+    def _notify(self, job: DownloadJob):
+        changed, job.changed = job.changed, asyncio.Event()
+        changed.set()
+
+    async def _save(self, job: DownloadJob):
+        await database.run(database.save_download, job.id, job.repo_id, job.filename, job.status, job.downloaded, job.total, job.error, job.created_at)
@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+if TYPE_CHECKING:
+    import requests
+
+DOWNLOAD_CHUNK_BYTES = 1 << 20
+# Writes are buffered and the resume state is saved once per buffer
+DOWNLOAD_BUFFER_BYTES = 8 << 20
+DOWNLOAD_PARTS = 4
+# Files smaller than two parts of this size are fetched over a single connection
+DOWNLOAD_MIN_PART_BYTES = 64 << 20
+DOWNLOAD_RETRIES = 5
+DOWNLOAD_TIMEOUT = 30
+PART_SUFFIX = ".part"
+STATE_SUFFIX = ".part.json"
+
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class DownloadError(Exception):
+    pass
+
+
+class DownloadCancelled(Exception):
+    """Raised when `cancel` is set; the partial file is kept so the download can resume."""
+
+
+def resolve_hf_file(repo_id: str, filename: str) -> Dict[str, Any]:
+    """Download URL, size and SHA-256 of a file on the Hugging Face Hub. Blocking."""
+    from huggingface_hub import get_hf_file_metadata, hf_hub_url
+
+    metadata = get_hf_file_metadata(hf_hub_url(repo_id=repo_id, filename=filename))
+    # The Hub reports the SHA-256 of LFS files as their ETag
+    etag = (metadata.etag or "").strip('"').lower()
+    return {
+        "url": metadata.location,
+        "size": metadata.size,
+        "sha256": etag if _SHA256_RE.match(etag) else None,
+    }
+
+
+def partial_size(dest: str) -> int:
+    """Bytes already on disk for an interrupted download of `dest`."""
+    try:
+        with open(dest + STATE_SUFFIX) as f:
+            return sum(done for _, _, done in json.load(f)["ranges"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return 0
+
+
+def discard_partial(dest: str):
+    for suffix in (PART_SUFFIX, STATE_SUFFIX):
+        try:
+            os.remove(dest + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def download_file(
+    url: str,
+    dest: str,
+    size: Optional[int] = None,
+    sha256: Optional[str] = None,
+    parts: int = DOWNLOAD_PARTS,
+    progress: Optional[Callable[[int, Optional[int]], None]] = None,
+    cancel: Optional[threading.Event] = None,
+) -> str:
+    """
+    Download `url` to `dest`. Blocking.
+    Data goes to `dest + ".part"` and is only renamed to `dest` once its size and SHA-256 check out,
+    so an interrupted download never shows up as a model. When the server honours `Range`, the file is
+    fetched in up to `parts` byte ranges in parallel, dropped connections are retried from where they
+    stopped, and a later call with the same size/hash resumes from the `.part` file.
+    `progress(downloaded, total)` may be called from several threads.
+    """
+    # Imported on first download rather than at server start
+    import requests
+
+    session = requests.Session()
+    head = session.head(url, allow_redirects=True, timeout=DOWNLOAD_TIMEOUT)
+    head.raise_for_status()
+    url = head.url
+    length = int(head.headers.get("content-length", 0)) or None
+    size = size or length
+    ranged = size is not None and head.headers.get("accept-ranges", "").lower() == "bytes"
+
+    part_path = dest + PART_SUFFIX
+    if ranged:
+        _download_ranges(url, part_path, size, sha256, parts, progress, cancel)
+    else:
+        _download_stream(session, url, part_path, size, progress, cancel)
+
+    actual = os.path.getsize(part_path)
+    if size is not None and actual != size:
+        discard_partial(dest)
+        raise DownloadError(f"Downloaded {actual} bytes, expected {size}.")
+    if sha256 and _file_sha256(part_path, cancel) != sha256.lower():
+        discard_partial(dest)
+        raise DownloadError("SHA-256 mismatch; the downloaded file is corrupt.")
+    os.replace(part_path, dest)
+    try:
+        os.remove(dest + STATE_SUFFIX)
+    except FileNotFoundError:
+        pass
+    return dest
+
+
+def _download_stream(session: "requests.Session", url: str, part_path: str, size: Optional[int], progress, cancel):
+    """Fallback for servers without range support: one pass from the start."""
+    downloaded = 0
+    with session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+        r.raise_for_status()
+        with open(part_path, "wb", buffering=DOWNLOAD_BUFFER_BYTES) as f:
+            for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                if cancel is not None and cancel.is_set():
+                    raise DownloadCancelled()
+                f.write(chunk)
+                downloaded += len(chunk)
+                if progress is not None:
+                    progress(downloaded, size)
+
+
+def _download_ranges(url: str, part_path: str, size: int, sha256: Optional[str], parts: int, progress, cancel):
+    state_path = part_path[:-len(PART_SUFFIX)] + STATE_SUFFIX
+    state = _load_state(state_path, part_path, size, sha256)
+    if state is None:
+        count = max(1, min(parts, size // DOWNLOAD_MIN_PART_BYTES))
+        bounds = [size * i // count for i in range(count + 1)]
+        state = {"size": size, "sha256": sha256, "ranges": [[bounds[i], bounds[i + 1], 0] for i in range(count)]}
+        with open(part_path, "wb") as f:
+            f.truncate(size)
+        _save_state(state_path, state)
+
+    lock = threading.Lock()
+    downloaded = [sum(done for _, _, done in state["ranges"])]
+    if progress is not None:
+        progress(downloaded[0], size)
+
+    def advance(rng: List[int], n: int):
+        with lock:
+            rng[2] += n
+            downloaded[0] += n
+            _save_state(state_path, state)
+            total = downloaded[0]
+        if progress is not None:
+            progress(total, size)
+
+    errors: List[BaseException] = []
+    # A failing range stops the others so the state on disk stays resumable
+    stop = threading.Event()
+
+    def worker(rng: List[int]):
+        try:
+            _fetch_range(url, part_path, rng, advance, cancel, stop)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    threads = [threading.Thread(target=worker, args=(rng,), daemon=True) for rng in state["ranges"] if rng[2] < rng[1] - rng[0]]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise next((e for e in errors if isinstance(e, DownloadCancelled)), errors[0])
+
+
+def _fetch_range(url: str, part_path: str, rng: List[int], advance, cancel, stop: threading.Event):
+    import requests
+
+    start, end = rng[0], rng[1]
+    session = requests.Session()
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        pos = start + rng[2]
+        if pos >= end:
+            return
+        try:
+            headers = {"Range": f"bytes={pos}-{end - 1}"}
+            with session.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise DownloadError("The server ignored the Range header.")
+                with open(part_path, "r+b") as f:
+                    f.seek(pos)
+                    pending = 0
+                    for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                        if (cancel is not None and cancel.is_set()) or stop.is_set():
+                            break
+                        chunk = chunk[:end - pos - pending]
+                        f.write(chunk)
+                        pending += len(chunk)
+                        if pending >= DOWNLOAD_BUFFER_BYTES:
+                            f.flush()
+                            advance(rng, pending)
+                            pos += pending
+                            pending = 0
+                    f.flush()
+                    if pending:
+                        advance(rng, pending)
+            if cancel is not None and cancel.is_set():
+                raise DownloadCancelled()
+            if stop.is_set():
+                return
+            if start + rng[2] < end and attempt < DOWNLOAD_RETRIES:
+                # The response ended early without an error
+                print(f"Download of bytes {start + rng[2]}-{end - 1} came back short, retrying")
+                time.sleep(min(2 ** attempt, 30))
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            if attempt == DOWNLOAD_RETRIES:
+                raise DownloadError(f"Connection lost after {DOWNLOAD_RETRIES} retries: {e}")
+            print(f"Download of bytes {start + rng[2]}-{end - 1} interrupted ({e}), retrying")
+            time.sleep(min(2 ** attempt, 30))
+    # The .part file is already full size, so the size check after the download couldn't catch a missing range
+    if start + rng[2] < end:
+        raise DownloadError(f"Bytes {start + rng[2]}-{end - 1} still missing after {DOWNLOAD_RETRIES} retries.")
+
+
+def _load_state(state_path: str, part_path: str, size: int, sha256: Optional[str]) -> Optional[Dict[str, Any]]:
+    """The saved ranges of an earlier attempt at the same file, if its partial data can be reused."""
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+        if state["size"] != size or state["sha256"] != sha256 or os.path.getsize(part_path) != size:
+            return None
+        return state
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _save_state(state_path: str, state: Dict[str, Any]):
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)
+
+
+def _file_sha256(path: str, cancel: Optional[threading.Event] = None) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(DOWNLOAD_BUFFER_BYTES):
+            if cancel is not None and cancel.is_set():
+                raise DownloadCancelled()
+            digest.update(chunk)
+    return digest.hexdigest()
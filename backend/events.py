@@ -0,0 +1,37 @@
+import asyncio
+from typing import Any, AsyncIterator, Dict, Set
+
+EVENT_QUEUE_SIZE = 256
+HEARTBEAT_SECONDS = 15.0
+
+
+class EventBus:
+    """
+    Fans app events (e.g. a generated session title) out to every connected client.
+    Each subscriber has a bounded queue; one that falls behind loses its oldest events instead of slowing publishers.
+    """
+
+    def __init__(self):
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    def publish(self, event: Dict[str, Any]):
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    async def subscribe(self, heartbeat: float = HEARTBEAT_SECONDS) -> AsyncIterator[Dict[str, Any]]:
+        """Yield events as they are published, and a heartbeat when idle so dead connections are noticed."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield {"event": "heartbeat"}
+        finally:
+            self._subscribers.discard(queue)
+
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
@@ -0,0 +1,169 @@
+import json
+import mmap
+import os
+import struct
+from typing import Any, Dict, List, Optional
+
+import database
+
+GGUF_MAGIC = b"GGUF"
+
+# GGUF metadata value types
+_STRING = 8
+_ARRAY = 9
+_SCALARS = {0: "<B", 1: "<b", 2: "<H", 3: "<h", 4: "<I", 5: "<i", 6: "<f", 7: "<?", 10: "<Q", 11: "<q", 12: "<d"}
+
+# `general.file_type` values (llama_ftype in llama.h)
+FILE_TYPES = {
+    0: "F32", 1: "F16", 2: "Q4_0", 3: "Q4_1", 7: "Q8_0", 8: "Q5_0", 9: "Q5_1", 10: "Q2_K",
+    11: "Q3_K_S", 12: "Q3_K_M", 13: "Q3_K_L", 14: "Q4_K_S", 15: "Q4_K_M", 16: "Q5_K_S", 17: "Q5_K_M",
+    18: "Q6_K", 19: "IQ2_XXS", 20: "IQ2_XS", 21: "Q2_K_S", 22: "IQ3_XS", 23: "IQ3_XXS", 24: "IQ1_S",
+    25: "IQ4_NL", 26: "IQ3_S", 27: "IQ3_M", 28: "IQ2_S", 29: "IQ2_M", 30: "IQ4_XS", 31: "IQ1_M",
+    32: "BF16", 36: "TQ1_0", 37: "TQ2_0",
+}
+
+
+class GGUFError(ValueError):
+    pass
+
+
+class _HeaderReader:
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+
+    def scalar(self, fmt: str):
+        value = struct.unpack_from(fmt, self.buf, self.pos)[0]
+        self.pos += struct.calcsize(fmt)
+        return value
+
+    def string(self) -> str:
+        length = self.scalar("<Q")
+        value = self.buf[self.pos:self.pos + length].decode("utf-8", errors="replace")
+        self.pos += length
+        return value
+
+    def value(self, value_type: int):
+        if value_type == _STRING:
+            return self.string()
+        if value_type in _SCALARS:
+            return self.scalar(_SCALARS[value_type])
+        raise GGUFError(f"Unknown GGUF value type {value_type}")
+
+    def skip_array(self) -> int:
+        """Step over an array value without building it (tokenizer vocabularies run to 100k+ entries)."""
+        item_type, count = self.scalar("<I"), self.scalar("<Q")
+        if item_type == _STRING:
+            for _ in range(count):
+                self.pos += 8 + struct.unpack_from("<Q", self.buf, self.pos)[0]
+        elif item_type == _ARRAY:
+            for _ in range(count):
+                self.skip_array()
+        elif item_type in _SCALARS:
+            self.pos += count * struct.calcsize(_SCALARS[item_type])
+        else:
+            raise GGUFError(f"Unknown GGUF array type {item_type}")
+        return count
+
+
+def read_gguf_header(path: str) -> Dict[str, Any]:
+    """
+    Architecture, quantization, size and template of a GGUF model, read from its header through mmap.
+    Only the metadata and tensor index are touched, so this costs a few page faults, not a model load.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        if buf[:4] != GGUF_MAGIC:
+            raise GGUFError("Not a GGUF file")
+        reader = _HeaderReader(buf)
+        reader.pos = 4
+        version = reader.scalar("<I")
+        if version < 2:
+            raise GGUFError(f"GGUF version {version} is not supported")
+        tensor_count, kv_count = reader.scalar("<Q"), reader.scalar("<Q")
+
+        metadata: Dict[str, Any] = {}
+        array_lengths: Dict[str, int] = {}
+        for _ in range(kv_count):
+            key, value_type = reader.string(), reader.scalar("<I")
+            if value_type == _ARRAY:
+                array_lengths[key] = reader.skip_array()
+            else:
+                metadata[key] = reader.value(value_type)
+
+        parameters = 0
+        for _ in range(tensor_count):
+            reader.string()
+            n_dims = reader.scalar("<I")
+            dims = struct.unpack_from(f"<{n_dims}Q", buf, reader.pos)
+            reader.pos += 8 * n_dims + 4 + 8  # dims, type, offset
+            count = 1
+            for d in dims:
+                count *= d
+            parameters += count
+
+    arch = metadata.get("general.architecture", "llama")
+    chat_template = metadata.pop("tokenizer.chat_template", None)
+    return {
+        "gguf_version": version,
+        "architecture": arch,
+        "name": metadata.get("general.name"),
+        "quantization": FILE_TYPES.get(metadata.get("general.file_type")),
+        "parameters": parameters,
+        "context_length": metadata.get(f"{arch}.context_length"),
+        "block_count": metadata.get(f"{arch}.block_count"),
+        "embedding_length": metadata.get(f"{arch}.embedding_length"),
+        "head_count": metadata.get(f"{arch}.attention.head_count"),
+        "head_count_kv": metadata.get(f"{arch}.attention.head_count_kv"),
+        "vocab_size": array_lengths.get("tokenizer.ggml.tokens"),
+        "chat_template": chat_template,
+        # Same shape as llama_cpp's `Llama.metadata`, so load-time estimates work before a load
+        "metadata": {k: str(v) for k, v in metadata.items()},
+    }
+
+
+class ModelCatalog:
+    """
+    Header details of the GGUF files in `models_dir`, cached in SQLite by path, size and mtime,
+    so only new or changed files are ever parsed. Blocking; run it off the event loop.
+    """
+
+    def __init__(self, models_dir):
+        self.models_dir = models_dir
+
+    def scan(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.models_dir):
+            return []
+        files = [e for e in os.scandir(self.models_dir) if e.name.endswith(".gguf") and e.is_file()]
+        cached = database.get_model_catalog()
+        models, changed = [], []
+        for entry in files:
+            models.append(self._describe(entry.path, entry.name, entry.stat(), cached.get(entry.path), changed))
+        if changed:
+            database.save_model_catalog(changed)
+        gone = set(cached) - {e.path for e in files}
+        if gone:
+            database.delete_model_catalog(list(gone))
+        return sorted(models, key=lambda m: m["filename"])
+
+    def get(self, filename: str) -> Optional[Dict[str, Any]]:
+        path = os.path.join(self.models_dir, filename)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        changed = []
+        model = self._describe(path, filename, stat, database.get_model_catalog(path).get(path), changed)
+        if changed:
+            database.save_model_catalog(changed)
+        return model
+
+    def _describe(self, path: str, filename: str, stat: os.stat_result, row: Optional[Dict[str, Any]], changed: List[tuple]) -> Dict[str, Any]:
+        if row is not None and row["size"] == stat.st_size and row["mtime_ns"] == stat.st_mtime_ns:
+            info = json.loads(row["info"])
+        else:
+            try:
+                info = read_gguf_header(path)
+            except (OSError, ValueError, struct.error) as e:
+                info = {"error": f"Could not read GGUF header: {e}"}
+            changed.append((path, stat.st_size, stat.st_mtime_ns, json.dumps(info)))
+        return {"filename": filename, "size_bytes": stat.st_size, **info}
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import diskcache
+
+import database
+
+HF_CACHE_DIR = database.APP_DIR / "hf_cache"
+HF_CACHE_BYTES = 64 << 20
+SEARCH_TTL_SECONDS = 10 * 60
+FILES_TTL_SECONDS = 60 * 60
+# With the Hub's own offline switch set, only cached results are served
+HF_OFFLINE = os.environ.get("HF_HUB_OFFLINE", "").lower() in ("1", "true", "yes")
+
+
+class CatalogUnavailable(Exception):
+    """Offline mode is on and nothing is cached for the query."""
+
+
+def fetch_search(q: str) -> List[Dict[str, Any]]:
+    from huggingface_hub import list_models
+
+    models = list_models(search=q, filter="gguf", sort="likes", direction=-1, limit=50, task="text-generation")
+    return [
+        {"repo_id": m.id, "author": m.author, "downloads": m.downloads, "likes": m.likes, "last_modified": m.lastModified, "tags": m.tags}
+        for m in models
+    ]
+
+
+def fetch_files(repo_id: str) -> List[Dict[str, Any]]:
+    from huggingface_hub import model_info
+
+    info = model_info(repo_id)
+    files = [{"filename": f.rfilename, "size": f.size} for f in info.siblings if f.rfilename.endswith(".gguf")]
+    return sorted(files, key=lambda f: f["filename"])
+
+
+class HubCatalog:
+    """
+    Hugging Face Hub queries for the model browser, run off the event loop and cached on disk.
+    Entries are fresh for a TTL per kind of query; stale ones are kept (up to `size_limit` bytes, LRU)
+    and served when the Hub is unreachable or `offline` is set. Concurrent identical queries share one call.
+    """
+
+    def __init__(self, directory=HF_CACHE_DIR, size_limit: int = HF_CACHE_BYTES, offline: bool = HF_OFFLINE):
+        self.offline = offline
+        self._cache = diskcache.Cache(str(directory), size_limit=size_limit, eviction_policy="least-recently-used")
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+
+    async def search(self, q: str) -> Dict[str, Any]:
+        return await self._get(f"search::{q.strip().lower()}", SEARCH_TTL_SECONDS, fetch_search, q.strip())
+
+    async def files(self, repo_id: str) -> Dict[str, Any]:
+        return await self._get(f"files::{repo_id}", FILES_TTL_SECONDS, fetch_files, repo_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "offline": self.offline,
+            "entries": len(self._cache),
+            "bytes": self._cache.volume(),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+        }
+
+    def close(self):
+        self._cache.close()
+
+    async def _get(self, key: str, ttl: int, fetch: Callable[[str], Any], arg: str) -> Dict[str, Any]:
+        """Returns {"results": ..., "fetched_at": unix time, "stale": bool}. Hub errors propagate only when nothing is cached."""
+        entry: Optional[Dict[str, Any]] = await asyncio.to_thread(self._cache.get, key)
+        if entry is not None and (self.offline or time.time() - entry["fetched_at"] < ttl):
+            self.hits += 1
+            return {**entry, "stale": time.time() - entry["fetched_at"] >= ttl}
+        if self.offline:
+            raise CatalogUnavailable("Offline mode is on and this query has not been cached yet.")
+
+        self.misses += 1
+        pending = self._inflight.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._refresh(key, fetch, arg))
+            self._inflight[key] = pending
+            pending.add_done_callback(lambda _: self._inflight.pop(key, None))
+        try:
+            return {**await asyncio.shield(pending), "stale": False}
+        except Exception as e:
+            if entry is None:
+                raise
+            print(f"Hugging Face Hub query failed, serving cached results: {e}")
+            self.stale_hits += 1
+            return {**entry, "stale": True}
+
+    async def _refresh(self, key: str, fetch: Callable[[str], Any], arg: str) -> Dict[str, Any]:
+        entry = {"results": await asyncio.to_thread(fetch, arg), "fetched_at": time.time()}
+        await asyncio.to_thread(self._cache.set, key, entry)
+        return entry
@@ -0,0 +1,95 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import diskcache
+
+import database
+
+KV_CACHE_DIR = database.APP_DIR / "kv_cache"
+RAM_BUDGET_BYTES = 2 << 30
+DISK_BUDGET_BYTES = 8 << 30
+
+
+def state_size(llama_state) -> int:
+    return int(llama_state.llama_state_size + llama_state.input_ids.nbytes + llama_state.scores.nbytes)
+
+
+class SessionStateCache:
+    """
+    Two-tier cache of llama_cpp `LlamaState` snapshots keyed by (model, session).
+    Recently used states stay in RAM up to `ram_budget` bytes; states evicted from RAM
+    spill to a size-bounded diskcache store so they survive memory pressure and restarts.
+    """
+
+    def __init__(self, directory=KV_CACHE_DIR, ram_budget: int = RAM_BUDGET_BYTES, disk_budget: int = DISK_BUDGET_BYTES):
+        self.ram_budget = ram_budget
+        self._ram: "OrderedDict[str, object]" = OrderedDict()
+        self._ram_bytes = 0
+        self._disk = diskcache.Cache(str(directory), size_limit=disk_budget, eviction_policy="least-recently-used")
+        self._lock = threading.Lock()
+        self.hits = {"ram": 0, "disk": 0}
+        self.misses = 0
+
+    @staticmethod
+    def _key(model_key: str, session_id: str) -> str:
+        return f"{model_key}::{session_id}"
+
+    def get(self, model_key: str, session_id: str):
+        key = self._key(model_key, session_id)
+        with self._lock:
+            if key in self._ram:
+                self._ram.move_to_end(key)
+                self.hits["ram"] += 1
+                return self._ram[key]
+        llama_state = self._disk.get(key)
+        if llama_state is None:
+            self.misses += 1
+            return None
+        self.hits["disk"] += 1
+        self._put_ram(key, llama_state)
+        return llama_state
+
+    def put(self, model_key: str, session_id: str, llama_state):
+        self._put_ram(self._key(model_key, session_id), llama_state)
+
+    def drop_session(self, session_id: str):
+        suffix = f"::{session_id}"
+        with self._lock:
+            for key in [k for k in self._ram if k.endswith(suffix)]:
+                self._ram_bytes -= state_size(self._ram.pop(key))
+        for key in [k for k in self._disk.iterkeys() if k.endswith(suffix)]:
+            self._disk.delete(key)
+
+    def flush(self):
+        """Spill every RAM entry to disk, e.g. before shutdown."""
+        with self._lock:
+            items = list(self._ram.items())
+        for key, llama_state in items:
+            self._disk.set(key, llama_state)
+
+    def stats(self):
+        with self._lock:
+            ram_entries, ram_bytes = len(self._ram), self._ram_bytes
+        return {
+            "ram_entries": ram_entries,
+            "ram_bytes": ram_bytes,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk.volume(),
+            "hits": dict(self.hits),
+            "misses": self.misses,
+        }
+
+    def _put_ram(self, key: str, llama_state):
+        spilled = []
+        with self._lock:
+            if key in self._ram:
+                self._ram_bytes -= state_size(self._ram.pop(key))
+            self._ram[key] = llama_state
+            self._ram_bytes += state_size(llama_state)
+            while self._ram_bytes > self.ram_budget and len(self._ram) > 1:
+                old_key, old_state = self._ram.popitem(last=False)
+                self._ram_bytes -= state_size(old_state)
+                spilled.append((old_key, old_state))
+        for old_key, old_state in spilled:
+            self._disk.set(old_key, old_state)
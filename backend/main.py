@@ -1,21 +1,42 @@
-from fastapi import FastAPI, HTTPException
+import startup
+# First, so the report covers every import below
+startup_report = startup.StartupReport()
+
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 
-from huggingface_hub import hf_hub_download, list_models, model_info, hf_hub_url
-from huggingface_hub.utils import EntryNotFoundError
 import os
 import json
 import asyncio
-from typing import List, Dict, Any, AsyncIterator, Optional
+from typing import List, Dict, Any, AsyncIterator, Callable, Iterator, Optional, Union
 import uuid
+import threading
+import concurrent.futures
+from collections import Counter
+from contextlib import aclosing, contextmanager
 import time
 from datetime import datetime
-import requests
 import sys
 from pathlib import Path
 import database
+from download_manager import DownloadManager
+from hf_catalog import CatalogUnavailable, HubCatalog
+from events import HEARTBEAT_SECONDS, EventBus
+from chat_streams import TurnRegistry, TurnStream, merge_frames
+from semantic_index import SemanticIndex, SemanticIndexUnavailable
+import scheduler as sched
+import autotune
+import speculative
+from kv_cache import SessionStateCache
+from response_cache import ResponseCache, is_deterministic, response_key
+import context_window
+import summarizer
+import titler
+import metrics
+import thinking
+from thinking import ThinkingStreamParser
 
 # --- 1. Configuration ---
 BASE_DIR = database.APP_DIR
@@ -35,23 +56,48 @@ os.environ["LLAMA_CPP_LIB"] = os.path.join(base_path, "llama_cpp", "lib", "libll
 MODELS_DIR = BASE_DIR / "models"
 MODELS_DIR.mkdir(exist_ok=True)
 
-from llama_cpp import Llama
+from model_pool import ModelPool, PooledModel
+from model_workers import MODEL_WORKERS, WorkerCrashed, WorkerLease, WorkerPool
+from gguf_catalog import ModelCatalog
+
+startup_report.imports_done()
 
 # --- 2. Pydantic Models ---
 # ... (rest of your Pydantic Models code - no changes here)
-class Message(BaseModel): role: str; content: str
-class ChatRequest(BaseModel): session_id: str; prompt: str
-class LoadModelRequest(BaseModel): model_name: str
+class Message(BaseModel): id: Optional[int] = None; role: str; content: str; reasoning: Optional[str] = None
+class ChatRequest(BaseModel): session_id: str; prompt: str; coalesce_ms: float = Field(default=0, ge=0, le=1000); coalesce_tokens: int = Field(default=1, ge=1, le=256)
+class TurnRequest(BaseModel): prompt: str
+class LoadModelRequest(BaseModel):
+    model_name: str
+    n_ctx: Optional[int] = None
+    # llama.cpp load options; unset ones keep llama_cpp's defaults (n_threads defaults to half the CPUs)
+    n_threads: Optional[int] = Field(default=None, ge=1)
+    n_batch: Optional[int] = Field(default=None, ge=1)
+    use_mmap: Optional[bool] = None
+    use_mlock: Optional[bool] = None
+    # Speculative decoding: "prompt_lookup" drafts from n-grams already in the context, a filename drafts with that (small) GGUF
+    draft_model: Optional[str] = None
+    draft_tokens: Optional[int] = Field(default=None, ge=1, le=64)
+
+    def load_options(self) -> Dict[str, Any]:
+        options = {
+            "n_threads": self.n_threads, "n_batch": self.n_batch, "use_mmap": self.use_mmap, "use_mlock": self.use_mlock,
+            "draft_model": self.draft_model, "draft_tokens": self.draft_tokens,
+        }
+        return {k: v for k, v in options.items() if v is not None}
 class DownloadModelRequest(BaseModel): repo_id: str; filename: str
 class HFModelInfo(BaseModel): repo_id: str; author: Optional[str] = None; downloads: int; likes: int; last_modified: Optional[datetime] = None; tags: List[str] = []
 class HFFile(BaseModel): filename: str; size: Optional[int] = None
 class GenerateTitleRequest(BaseModel): session_id: str
-class NewSessionRequest(BaseModel): title: str = "New Chat"
+class NewSessionRequest(BaseModel): title: str = titler.DEFAULT_TITLE
 class Prompt(BaseModel): id: int; title: str; content: str
 class CreatePromptRequest(BaseModel): title: str; content: str
 class UpdatePromptRequest(BaseModel): title: str; content: str
 class SetSessionPromptRequest(BaseModel): prompt_id: Optional[int]
+class SetSessionModelRequest(BaseModel): model_name: Optional[str]
 class UpdateSessionParametersRequest(BaseModel): temperature: float; top_p: float; max_tokens: int; repeat_penalty: float; n_ctx: int
+class SetSessionSummarizationRequest(BaseModel): enabled: bool
+class SetAutoloadRequest(BaseModel): enabled: bool
 
 # --- 3. FastAPI Application Initialization ---
 app = FastAPI(
@@ -61,8 +107,33 @@ app = FastAPI(
 )
 
 @app.on_event("startup")
-def on_startup():
-    database.initialize_database()
+async def on_startup():
+    global generation_scheduler
+    await database.run(database.initialize_database)
+    # One job per worker process at a time, or one at a time on the in-process pool
+    generation_scheduler = sched.GenerationScheduler(slots=MODEL_WORKERS or 1)
+    if model_workers is not None:
+        model_workers.start()
+    await download_manager.restore()
+    # Catch up with messages written while the index was off or behind
+    spawn_background(index_in_background())
+    if await database.run(database.get_setting, AUTOLOAD_SETTING) == "1":
+        # In the background: the server answers (health checks first) while the model loads
+        spawn_background(autoload_last_model())
+    startup_report.ready()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    download_manager.shutdown()
+    # Persist the prompt state of every session so the next start skips re-evaluation too
+    for entry in model_pool.resident():
+        activate_session_state(entry, None)
+    kv_cache.flush()
+    if model_workers is not None:
+        model_workers.shutdown()
+    response_cache.close()
+    hub_catalog.close()
+    database.close_all()
 
 # --- 4. CORS Middleware ---
 origins = ["http://127.0.0.1:3000",
@@ -78,35 +149,291 @@ app.add_middleware(
 )
 
 # --- 5. Global State ---
-state = {"llm": None, "loaded_model_name": None}
+AUTOLOAD_SETTING = "autoload_last_model"
+LAST_MODEL_SETTING = "last_model"
+WARMUP_PROMPT = "Hello"
+# `loaded_model_name` is the model used by sessions that don't pin one; `warmup` tracks loading it on startup
+state = {"loaded_model_name": None, "warmup": "off"}
+kv_cache = SessionStateCache()
+# Greedy replies by model and rendered messages; off unless CHAT_RESPONSE_CACHE is set
+response_cache = ResponseCache()
+model_catalog = ModelCatalog(MODELS_DIR)
+# Evicted models hand their current session's prompt state to the KV cache first
+model_pool = ModelPool(
+    MODELS_DIR, on_evict=lambda entry: activate_session_state(entry, None), catalog=model_catalog,
+    on_load=lambda entry: metrics.MODEL_LOAD.observe(entry.load_seconds, model=entry.name),
+    option_defaults=lambda name: autotune.stored_options(MODELS_DIR, name),
+)
+# With CHAT_MODEL_WORKERS set, generation runs in that many worker processes instead of in model_pool
+model_workers = WorkerPool(
+    MODELS_DIR, MODEL_WORKERS, on_load=lambda lease: metrics.MODEL_LOAD.observe(lease.load_seconds, model=lease.name),
+    option_defaults=lambda name: autotune.stored_options(MODELS_DIR, name),
+) if MODEL_WORKERS > 0 else None
+# Created on startup so its futures belong to the server's event loop
+generation_scheduler: Optional[sched.GenerationScheduler] = None
+
+# Embeddings of every message for search by meaning; off unless CHAT_EMBEDDING_MODEL names a model
+semantic_index = SemanticIndex(MODELS_DIR)
+
+# Pushes background results (e.g. generated titles) to connected clients
+event_bus = EventBus()
+
+# Frames of live and recently finished chat turns, for the NDJSON, WebSocket and SSE transports
+chat_turns = TurnRegistry()
+
+# Strong references to fire-and-forget tasks so they aren't garbage collected mid-flight
+background_tasks = set()
+
+def spawn_background(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(_finish_background)
+    return task
+
+def _finish_background(task: asyncio.Task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Background task failed: {task.exception()}")
+
+# --- 6. Model Downloads and Hub Catalog ---
+def record_download(job):
+    metrics.DOWNLOAD_BYTES.inc(job.run_bytes)
+    if job.run_seconds > 0:
+        metrics.DOWNLOAD_THROUGHPUT.observe(job.run_bytes / job.run_seconds)
+
+download_manager = DownloadManager(MODELS_DIR, on_complete=record_download)
+hub_catalog = HubCatalog()
 
-# --- 6. Helper Function for Threaded Download ---
-def download_worker(queue: asyncio.Queue, repo_id: str, filename: str):
+# --- 7. Helper for Threaded Generation ---
+GENERATION_QUEUE_SIZE = 64
+_STREAM_DONE = object()
+
+class _StreamError:
+    def __init__(self, exc: BaseException): self.exc = exc
+
+async def iterate_in_thread(make_stream: Callable[[], Iterator], maxsize: int = GENERATION_QUEUE_SIZE, cancel: Optional[threading.Event] = None) -> AsyncIterator:
+    """
+    Run a blocking llama_cpp stream in a dedicated worker thread and yield its items on the event loop.
+    The queue is bounded, so the worker blocks when the client reads slower than the model decodes.
+    Closing the returned generator, or setting `cancel`, stops the worker at the next item;
+    closing only returns once the worker has let go of the model.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    cancel = cancel or threading.Event()
+    finished = loop.create_future()
+
+    def put(item) -> bool:
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while not stop.is_set():
+            try:
+                future.result(timeout=0.1)
+                return True
+            except concurrent.futures.TimeoutError:
+                continue
+        future.cancel()
+        return False
+
+    def worker():
+        stream = None
+        try:
+            stream = make_stream()
+            for item in stream:
+                if cancel.is_set() or not put(item):
+                    break
+        except Exception as e:
+            put(_StreamError(e))
+        finally:
+            if hasattr(stream, "close"):
+                stream.close()
+            put(_STREAM_DONE)
+            loop.call_soon_threadsafe(finished.set_result, None)
+
+    threading.Thread(target=worker, name="llm-generation", daemon=True).start()
     try:
-        url = hf_hub_url(repo_id=repo_id, filename=filename)
-        response = requests.head(url, allow_redirects=True)
-        response.raise_for_status()
-        total_size = int(response.headers.get('content-length', 0))
+        while True:
+            item = await queue.get()
+            if item is _STREAM_DONE:
+                break
+            if isinstance(item, _StreamError):
+                raise item.exc
+            yield item
+    finally:
+        stop.set()
+        # The model must not be handed to the next job while this thread still uses it
+        await asyncio.shield(finished)
 
-        local_path = os.path.join(MODELS_DIR, filename)
-        downloaded_size = 0
-        
-        with requests.get(url, stream=True) as r:
-            r.raise_for_status()
-            with open(local_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-                    downloaded_size += len(chunk)
-                    progress = (downloaded_size / total_size) * 100 if total_size > 0 else 0
-                    queue.put_nowait(json.dumps({"status": "downloading", "progress": progress}) + "\n")
-        
-        queue.put_nowait(json.dumps({"status": "complete", "progress": 100}) + "\n")
-    except Exception as e:
-        queue.put_nowait(json.dumps({"status": "error", "message": str(e)}) + "\n")
+async def cancel_on_disconnect(http_request: Request, job: sched.GenerationJob, out: TurnStream, interval: float = 0.5):
+    """Cancel `job` as soon as the HTTP client goes away, even while it is still queued; stops once `out` is done."""
+    while not job.cancelled and not out.done:
+        if await http_request.is_disconnected():
+            generation_scheduler.cancel_job(job)
+            return
+        await asyncio.sleep(interval)
+
+def activate_session_state(entry: Union[PooledModel, WorkerLease], session_id: Optional[str]):
+    """
+    Make `session_id`'s saved prompt state the model's current KV cache, saving the previous occupant first.
+    llama_cpp then reuses the longest matching token prefix, so only the new turn is evaluated.
+    Pass None before one-off prompts (e.g. titles) that should not overwrite a session's state.
+    Must only be called by the job that currently owns the model.
+    """
+    if isinstance(entry, WorkerLease):
+        # Worker processes keep their sessions' prompt states themselves
+        entry.llm.activate_session(session_id)
+        return
+    current = entry.kv_session
+    if current == session_id:
+        return
+    if current is not None:
+        kv_cache.put(entry.key, current, entry.llm.save_state())
+    if session_id is not None:
+        cached = kv_cache.get(entry.key, session_id)
+        if cached is not None:
+            entry.llm.load_state(cached)
+    entry.kv_session = session_id
+
+def checkout_model(name: str, n_ctx: Optional[int], session_id: Optional[str] = None) -> Union[PooledModel, WorkerLease]:
+    """The model for one job: a free worker process (preferring the one holding `session_id`), else the in-process pool. Blocking."""
+    if model_workers is not None:
+        return model_workers.checkout(name, n_ctx or model_pool.default_n_ctx(name), session_id)
+    return model_pool.checkout(name, n_ctx)
+
+def checkin_model(entry: Union[PooledModel, WorkerLease]):
+    if isinstance(entry, WorkerLease):
+        model_workers.checkin(entry)
+    else:
+        model_pool.checkin(entry)
+
+# Sessions with a summarization pass queued or running, so a burst of turns schedules only one
+summarizing_sessions = set()
+
+async def summarize_in_background(session_id: str, model_name: str, n_ctx: Optional[int], max_tokens: int):
+    """
+    Fold a session's older turns into its rolling summary, one chunk per idle-priority job.
+    Any chat request preempts the job; the partial summary is dropped and the next turn tries again.
+    """
+    if session_id in summarizing_sessions:
+        return
+    summarizing_sessions.add(session_id)
+    try:
+        while True:
+            job = generation_scheduler.submit(session_id, sched.PRIORITY_IDLE)
+            async with generation_scheduler.acquire(job):
+                entry = await asyncio.to_thread(checkout_model, model_name, n_ctx)
+                try:
+                    plan = await database.run(
+                        summarizer.plan_update, entry.llm, entry.name, session_id,
+                        min(n_ctx or entry.n_ctx, entry.n_ctx), max_tokens,
+                    )
+                    if plan is None:
+                        return
+                    await asyncio.to_thread(activate_session_state, entry, None)
+                    content = ""
+                    chunks = iterate_in_thread(lambda: entry.llm.create_chat_completion(
+                        messages=summarizer.build_prompt(plan),
+                        max_tokens=summarizer.SUMMARY_MAX_TOKENS,
+                        temperature=0.2,
+                        stream=True,
+                    ), cancel=job.cancel_event)
+                    async with aclosing(chunks):
+                        async for chunk in chunks:
+                            content += chunk["choices"][0]["delta"].get("content") or ""
+                    if job.cancelled or not content.strip():
+                        return
+                    await database.run(summarizer.store, session_id, plan, content.strip())
+                finally:
+                    checkin_model(entry)
+    except sched.GenerationCancelled:
+        pass
+    finally:
+        summarizing_sessions.discard(session_id)
+
+async def generate_title(session_id: str, model_name: str, n_ctx: Optional[int], priority: int) -> Optional[str]:
+    """
+    Title a session from a bounded slice of its opening messages, store it and tell connected clients.
+    Returns None when the session has no reply to title yet; raises GenerationCancelled if preempted.
+    """
+    job = generation_scheduler.submit(session_id, priority)
+    async with generation_scheduler.acquire(job):
+        entry = await asyncio.to_thread(checkout_model, model_name, n_ctx)
+        try:
+            title_prompt = await database.run(titler.build_prompt, entry.llm, session_id)
+            if title_prompt is None:
+                return None
+            await asyncio.to_thread(activate_session_state, entry, None)
+            title = ""
+            outputs = iterate_in_thread(lambda: entry.llm(
+                title_prompt,
+                max_tokens=titler.TITLE_MAX_TOKENS,
+                stop=["\n"],
+                temperature=0.2,
+                echo=False,
+                stream=True,
+            ), cancel=job.cancel_event)
+            async with aclosing(outputs):
+                async for output in outputs:
+                    title += output["choices"][0]["text"]
+        finally:
+            checkin_model(entry)
+    if job.cancelled:
+        raise sched.GenerationCancelled()
+    title = titler.clean(title)
+    if not title:
+        return None
+    await database.run(database.update_session_title, session_id, title)
+    event_bus.publish({"event": "session_title", "session_id": session_id, "title": title})
+    return title
+
+# Sessions with a title job queued or running
+titling_sessions = set()
+
+async def title_in_background(session_id: str, model_name: str, n_ctx: Optional[int]):
+    """Idle-priority titling after a session's first exchange. A preempted job is queued again until a title is stored or the session is gone."""
+    if session_id in titling_sessions:
+        return
+    titling_sessions.add(session_id)
+    try:
+        while True:
+            session = await database.run(database.get_session_details, session_id)
+            if session is None or session['title'] != titler.DEFAULT_TITLE:
+                return
+            try:
+                await generate_title(session_id, model_name, n_ctx, sched.PRIORITY_IDLE)
+                return
+            except sched.GenerationCancelled:
+                continue
     finally:
-        queue.put_nowait(None)
+        titling_sessions.discard(session_id)
+
+# Set while a catch-up pass is queued or running, so new messages schedule only one
+semantic_indexing = {"running": False}
+SEMANTIC_INDEX_JOB = "semantic-index"
+
+async def index_in_background():
+    """Embed messages the semantic index hasn't seen yet, one idle-priority batch per job."""
+    if not semantic_index.available or semantic_indexing["running"]:
+        return
+    semantic_indexing["running"] = True
+    try:
+        while True:
+            job = generation_scheduler.submit(SEMANTIC_INDEX_JOB, sched.PRIORITY_IDLE)
+            async with generation_scheduler.acquire(job):
+                added = await asyncio.to_thread(semantic_index.index_pending)
+            if not added:
+                return
+    except sched.GenerationCancelled:
+        pass
+    finally:
+        semantic_indexing["running"] = False
+
+# --- 8. Helper Functions for Chat Formatting ---
+def emit_segments(out: TurnStream, segments: List[tuple]):
+    """Frames for parsed stream segments: reasoning goes out as `thought_token`, the answer as `token`."""
+    for kind, text in segments:
+        out.emit({"thought_token" if kind == thinking.THOUGHT else "token": text})
 
-# --- 7. Helper Functions for Chat Formatting ---
 def prepare_chat_messages(history: List[Dict], system_prompt: Optional[str] = None, current_user_message: str = ""):
     """
     Convert message history to the standard chat completion format.
@@ -137,36 +464,6 @@ def prepare_chat_messages(history: List[Dict], system_prompt: Optional[str] = No
     
     return messages
 
-def parse_thinking_response(text: str) -> tuple[str, str]:
-    """
-    Parse response text to separate thinking from actual response.
-    Returns (thinking, response) tuple.
-    """
-    # Common thinking patterns for different models
-    thinking_patterns = [
-        # DeepSeek pattern: <think>...</think>
-        (r'<think>(.*?)</think>(.*)', 1, 2),
-        # Alternative thinking pattern: <thinking>...</thinking>
-        (r'<thinking>(.*?)</thinking>(.*)', 1, 2),
-        # OpenAI o1 style: thinking followed by response
-        (r'(.*?)\n\n(?:Response|Answer|Solution):\s*(.*)', 1, 2),
-        # Chain of thought pattern: "Let me think..." followed by content
-        (r'((?:Let me think|I need to think|Thinking).*?)\n\n(.*)', 1, 2),
-    ]
-    
-    import re
-    
-    for pattern, thinking_group, response_group in thinking_patterns:
-        match = re.search(pattern, text, re.DOTALL | re.IGNORECASE)
-        if match:
-            thinking = match.group(thinking_group).strip()
-            response = match.group(response_group).strip()
-            if thinking and response:
-                return thinking, response
-    
-    # If no thinking pattern found, return empty thinking and full text as response
-    return "", text
-
 def fallback_to_manual_formatting(history: List[Dict], system_prompt: Optional[str] = None, current_user_message: str = ""):
     """
     Fallback method using manual prompt construction with a generic template.
@@ -190,40 +487,301 @@ def fallback_to_manual_formatting(history: List[Dict], system_prompt: Optional[s
     
     return full_prompt
 
-# --- 8. API Endpoints ---
+# --- 9. API Endpoints ---
 
 # Model Management
-@app.get("/api/v1/models", response_model=List[str])
-async def list_models_local():
+@app.get("/api/v1/models", response_model=Union[List[str], List[Dict[str, Any]]])
+async def list_models_local(details: bool = False):
+    """Filenames, or with `details=1` the header details of each model (cached, so only new files are parsed)."""
+    if details:
+        return await database.run(model_catalog.scan)
     if not os.path.exists(MODELS_DIR): return []
     return [f for f in os.listdir(MODELS_DIR) if f.endswith(".gguf")]
 
+async def load_default_model(name: str, n_ctx: Optional[int], options: Dict[str, Any]) -> Union[PooledModel, WorkerLease]:
+    """Load `name` and make it the model of sessions that don't pin one; remembered for autoloading on the next start."""
+    if autotune.AUTOTUNE_ON_FIRST_LOAD and not any(k in options for k in autotune.TUNED_KEYS) \
+            and not await database.run(autotune.stored_options, MODELS_DIR, name):
+        try:
+            await start_tuning(name)["task"]
+        except Exception as e:
+            print(f"Calibration of {name} failed, loading with default options: {e}")
+    if model_workers is not None:
+        # Load it in every worker up front, so no chat waits for a load
+        entry = await asyncio.to_thread(model_workers.preload, name, n_ctx or model_pool.default_n_ctx(name), options or None)
+    else:
+        # Hold on to the current default model so it keeps serving, and can't be evicted, while the new one loads
+        previous = state["loaded_model_name"]
+        previous_entry = model_pool.checkout_resident(previous) if previous else None
+        try:
+            # Reuses a resident instance when there is one, so switching back to a model is instant
+            entry = await asyncio.to_thread(model_pool.checkout, name, n_ctx, options or None)
+        finally:
+            if previous_entry is not None:
+                model_pool.checkin(previous_entry)
+        # Checked in after the previous default, so it is the most recently used and the trim below keeps it
+        model_pool.checkin(entry)
+        if previous_entry is not None:
+            # Evicting saves the evicted model's session state, which may spill to disk
+            await asyncio.to_thread(model_pool.trim)
+    state["loaded_model_name"] = name
+    await database.run(database.set_setting, LAST_MODEL_SETTING, json.dumps({"model_name": name, "n_ctx": n_ctx, "options": options}))
+    return entry
+
+async def autoload_last_model():
+    """Load the model loaded last before the previous shutdown, then warm it up."""
+    last = await database.run(database.get_setting, LAST_MODEL_SETTING)
+    if not last:
+        return
+    last = json.loads(last)
+    if not os.path.exists(os.path.join(MODELS_DIR, last["model_name"])):
+        print(f"Not autoloading {last['model_name']}: the file is gone.")
+        return
+    state["warmup"] = "loading"
+    try:
+        entry = await load_default_model(last["model_name"], last["n_ctx"], last["options"])
+        state["warmup"] = "warming"
+        await warm_up_model(entry.name, entry.n_ctx)
+        state["warmup"] = "ready"
+    except Exception as e:
+        state["warmup"] = "error"
+        print(f"Autoloading {last['model_name']} failed: {e}")
+
+async def warm_up_model(name: str, n_ctx: int):
+    """
+    Generate one token on each model instance, so the first chat doesn't pay for paging in the weights
+    and setting up llama.cpp's compute buffers. Idle priority: a chat that arrives meanwhile preempts it.
+    """
+    async def warm_up(slot: int):
+        job = generation_scheduler.submit(f"warmup:{slot}", sched.PRIORITY_IDLE)
+        try:
+            async with generation_scheduler.acquire(job):
+                entry = await asyncio.to_thread(checkout_model, name, n_ctx)
+                try:
+                    await asyncio.to_thread(activate_session_state, entry, None)
+                    chunks = iterate_in_thread(lambda: entry.llm.create_chat_completion(
+                        messages=[{"role": "user", "content": WARMUP_PROMPT}], max_tokens=1, stream=True,
+                    ), cancel=job.cancel_event)
+                    async with aclosing(chunks):
+                        async for _ in chunks:
+                            pass
+                finally:
+                    checkin_model(entry)
+        except sched.GenerationCancelled:
+            pass
+
+    await asyncio.gather(*(warm_up(slot) for slot in range(MODEL_WORKERS or 1)))
+
 @app.post("/api/v1/models/load")
 async def load_model_endpoint(request: LoadModelRequest):
     model_path = os.path.join(MODELS_DIR, request.model_name)
     if not os.path.exists(model_path):
         raise HTTPException(status_code=404, detail="Model file not found.")
-    try:
-        state["llm"] = Llama(model_path=model_path, n_ctx=8192, n_threads=8, n_gpu_layers=0, verbose=False)
-        state["loaded_model_name"] = request.model_name
-        return {"message": f"Model '{request.model_name}' loaded successfully."}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to load model. Error: {str(e)}")
+    if request.draft_model and request.draft_model != speculative.PROMPT_LOOKUP:
+        # The draft must share the model's vocabulary; llama.cpp doesn't check, so a mismatch only shows as a low acceptance rate
+        if ".." in request.draft_model or "/" in request.draft_model or request.draft_model == request.model_name:
+            raise HTTPException(status_code=400, detail="Invalid draft model.")
+        if not os.path.exists(os.path.join(MODELS_DIR, request.draft_model)):
+            raise HTTPException(status_code=404, detail="Draft model file not found.")
+
+    # Runs to completion even if the client stops listening
+    task = spawn_background(load_default_model(request.model_name, request.n_ctx, request.load_options()))
+
+    async def progress_streamer() -> AsyncIterator[str]:
+        started = time.monotonic()
+        while not task.done():
+            tuning = tuning_runs.get(request.model_name)
+            if tuning is not None and not tuning["task"].done():
+                yield json.dumps({"status": "tuning", "model_name": request.model_name, "completed": len(tuning["trials"]),
+                                  "planned": tuning["planned"], "elapsed": round(time.monotonic() - started, 1)}) + "\n"
+            else:
+                yield json.dumps({"status": "loading", "model_name": request.model_name, "elapsed": round(time.monotonic() - started, 1)}) + "\n"
+            await asyncio.wait({task}, timeout=0.5)
+        try:
+            entry = task.result()
+            yield json.dumps({
+                "status": "complete",
+                "message": f"Model '{request.model_name}' loaded successfully.",
+                "n_ctx": entry.n_ctx,
+                "options": entry.options,
+                "load_seconds": round(entry.load_seconds, 2),
+            }) + "\n"
+        except Exception as e:
+            yield json.dumps({"status": "error", "message": f"Failed to load model. Error: {str(e)}"}) + "\n"
+
+    return StreamingResponse(progress_streamer(), media_type="application/x-json-stream")
+
+# Calibration runs by model name, so a second request follows the running calibration instead of starting another
+tuning_runs: Dict[str, Dict[str, Any]] = {}
+tuning_lock = asyncio.Lock()
+
+async def claim_every_slot(owner: str) -> List[sched.GenerationJob]:
+    """
+    One idle-priority job per scheduler slot, returned once all of them run. Idle, so a chat preempts them:
+    if one is preempted while the others still wait, all are given back and queued again behind the chat.
+    """
+    while True:
+        jobs = [generation_scheduler.submit(f"{owner}:{slot}", sched.PRIORITY_IDLE) for slot in range(generation_scheduler.slots)]
+        try:
+            while not all(job.granted.done() for job in jobs) and not any(job.cancelled for job in jobs):
+                # Preemption only sets a running job's cancel event, so it is polled
+                await asyncio.wait([job.granted for job in jobs if not job.granted.done()], timeout=0.1)
+            if all(job.granted.done() and job.granted.exception() is None for job in jobs) and not any(job.cancelled for job in jobs):
+                return jobs
+        except BaseException:
+            for job in jobs:
+                generation_scheduler.release(job)
+            raise
+        for job in jobs:
+            generation_scheduler.release(job)
+
+def start_tuning(name: str) -> Dict[str, Any]:
+    """Calibrate `name`'s thread and batch load options in the background, or return the calibration already running."""
+    run = tuning_runs.get(name)
+    if run is not None and not run["task"].done():
+        return run
+    run = {"trials": [], "planned": None}
+    stop = threading.Event()
+    loop = asyncio.get_running_loop()
+
+    def on_trial(trial: Dict[str, Any], planned: int):
+        run["planned"] = planned
+        run["trials"].append(trial)
+
+    @contextmanager
+    def hold_every_slot() -> Iterator[Callable[[], bool]]:
+        # Each trial holds every scheduler slot like generation jobs: chats on any worker would skew its measurements,
+        # and be slowed down by them. A chat arriving mid-trial preempts it; the trial runs again once the chat is done.
+        jobs = asyncio.run_coroutine_threadsafe(claim_every_slot(f"autotune:{name}"), loop).result()
+        try:
+            # The trial loads happen outside the pool, so evict idle resident models to keep within its budget
+            model_pool.make_room(os.path.getsize(os.path.join(MODELS_DIR, name)))
+            yield lambda: any(job.cancelled for job in jobs)
+        finally:
+            loop.call_soon_threadsafe(lambda: [generation_scheduler.release(job) for job in jobs])
+
+    async def calibrate() -> Dict[str, Any]:
+        # One calibration at a time, so two can't each hold part of the slots and wait on each other
+        async with tuning_lock:
+            try:
+                return await asyncio.to_thread(autotune.calibrate, MODELS_DIR, name, on_trial=on_trial, cancel=stop, hold=hold_every_slot)
+            finally:
+                # e.g. at shutdown: the calibration thread stops at its next check
+                stop.set()
+
+    run["task"] = spawn_background(calibrate())
+    tuning_runs[name] = run
+    return run
+
+@app.post("/api/v1/models/{filename}/tune")
+async def tune_model_endpoint(filename: str):
+    """
+    Benchmark `n_threads`, `n_threads_batch` and `n_batch` candidates for a model on this host and store the fastest;
+    later loads of the model use them unless the load sets them itself. Streams each trial; runs on if the client leaves.
+    """
+    if ".." in filename or "/" in filename:
+        raise HTTPException(status_code=400, detail="Invalid filename.")
+    if not os.path.exists(os.path.join(MODELS_DIR, filename)):
+        raise HTTPException(status_code=404, detail="Model file not found.")
+    run = start_tuning(filename)
+
+    async def progress_streamer() -> AsyncIterator[str]:
+        sent = 0
+        while True:
+            for trial in run["trials"][sent:]:
+                sent += 1
+                yield json.dumps({"status": "tuning", "model_name": filename, "trial": trial, "completed": sent, "planned": run["planned"]}) + "\n"
+            if run["task"].done():
+                break
+            await asyncio.wait({run["task"]}, timeout=0.5)
+        try:
+            yield json.dumps({"status": "complete", **run["task"].result()}) + "\n"
+        except Exception as e:
+            yield json.dumps({"status": "error", "message": f"Calibration failed. Error: {str(e)}"}) + "\n"
+
+    return StreamingResponse(progress_streamer(), media_type="application/x-json-stream")
+
+@app.get("/api/v1/models/{filename}/tune")
+async def get_model_tuning(filename: str):
+    tuning = await database.run(autotune.stored_tuning, MODELS_DIR, filename)
+    if tuning is None:
+        raise HTTPException(status_code=404, detail="Model not tuned on this host.")
+    return tuning
+
+@app.get("/api/v1/health")
+async def health_endpoint():
+    """Answers as soon as the server is up; `warmup` follows the autoloaded model ("off", "loading", "warming", "ready", "error")."""
+    return {"status": "ok", "default_model": state["loaded_model_name"], "warmup": state["warmup"], "startup": startup_report.info()}
+
+@app.get("/api/v1/settings/autoload")
+async def get_autoload_setting():
+    enabled, last = await asyncio.gather(
+        database.run(database.get_setting, AUTOLOAD_SETTING), database.run(database.get_setting, LAST_MODEL_SETTING),
+    )
+    return {"enabled": enabled == "1", "last_model": json.loads(last) if last else None}
+
+@app.put("/api/v1/settings/autoload")
+async def set_autoload_setting(request: SetAutoloadRequest):
+    """With it on, the server loads the last loaded model on start and warms it up in the background."""
+    await database.run(database.set_setting, AUTOLOAD_SETTING, "1" if request.enabled else "0")
+    return {"enabled": request.enabled}
+
+@app.get("/api/v1/models/pool")
+async def model_pool_status():
+    workers = model_workers.stats() if model_workers is not None else {}
+    return {"default_model": state["loaded_model_name"], **model_pool.stats(), **workers}
 
 @app.post("/api/v1/models/download")
 async def download_model_endpoint(request: DownloadModelRequest):
-    queue = asyncio.Queue()
-    loop = asyncio.get_event_loop()
-    loop.run_in_executor(None, download_worker, queue, request.repo_id, request.filename)
+    """Starts (or rejoins) a download job and streams its progress; the job outlives this response."""
+    job = await download_manager.submit(request.repo_id, request.filename)
 
     async def progress_streamer() -> AsyncIterator[str]:
-        while True:
-            item = await queue.get()
-            if item is None: break
-            yield item
-    
+        async for info in download_manager.follow(job.id):
+            yield json.dumps(info) + "\n"
+
     return StreamingResponse(progress_streamer(), media_type="application/x-json-stream")
 
+# Downloads
+@app.post("/api/v1/downloads")
+async def create_download(request: DownloadModelRequest):
+    return (await download_manager.submit(request.repo_id, request.filename)).info()
+
+@app.get("/api/v1/downloads")
+async def list_downloads():
+    return [job.info() for job in download_manager.jobs()]
+
+@app.get("/api/v1/downloads/{download_id}")
+async def get_download(download_id: str, stream: bool = False):
+    if download_manager.get(download_id) is None:
+        raise HTTPException(status_code=404, detail="Download not found.")
+    if not stream:
+        return download_manager.get(download_id).info()
+
+    async def progress_streamer() -> AsyncIterator[str]:
+        async for info in download_manager.follow(download_id):
+            yield json.dumps(info) + "\n"
+
+    return StreamingResponse(progress_streamer(), media_type="application/x-json-stream")
+
+@app.post("/api/v1/downloads/{download_id}/pause")
+async def pause_download(download_id: str):
+    if download_manager.get(download_id) is None:
+        raise HTTPException(status_code=404, detail="Download not found.")
+    return (await download_manager.pause(download_id)).info()
+
+@app.post("/api/v1/downloads/{download_id}/resume")
+async def resume_download(download_id: str):
+    if download_manager.get(download_id) is None:
+        raise HTTPException(status_code=404, detail="Download not found.")
+    return (await download_manager.resume(download_id)).info()
+
+@app.post("/api/v1/downloads/{download_id}/cancel")
+async def cancel_download(download_id: str):
+    if download_manager.get(download_id) is None:
+        raise HTTPException(status_code=404, detail="Download not found.")
+    return (await download_manager.cancel(download_id)).info()
+
 @app.delete("/api/v1/models/{filename}")
 async def delete_model_endpoint(filename: str):
     if ".." in filename or "/" in filename:
@@ -234,62 +792,118 @@ async def delete_model_endpoint(filename: str):
         raise HTTPException(status_code=404, detail="Model file not found.")
     
     try:
+        # Evicting saves the model's session state, which may spill to disk
+        await asyncio.to_thread(model_pool.unload, filename)
+        await database.run(database.delete_load_tuning, filename)
+        if model_workers is not None:
+            await asyncio.to_thread(model_workers.unload, filename)
         os.remove(file_path)
         return {"message": f"Model '{filename}' deleted successfully."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete model: {str(e)}")
 
+def catalog_headers(response: Response, entry: Dict[str, Any]):
+    response.headers["X-Catalog-Fetched-At"] = str(int(entry["fetched_at"]))
+    response.headers["X-Catalog-Stale"] = "1" if entry["stale"] else "0"
+
 @app.get("/api/v1/models/search", response_model=List[HFModelInfo])
-async def search_hf_models(q: str):
+async def search_hf_models(q: str, response: Response):
     try:
-        models = list_models(
-            search=q, filter="gguf", sort="likes",
-            direction=-1, limit=50, task="text-generation"
-        )
-        return [
-            HFModelInfo(
-                repo_id=model.id, author=model.author, downloads=model.downloads,
-                likes=model.likes, last_modified=model.lastModified, tags=model.tags
-            ) for model in models
-        ]
+        entry = await hub_catalog.search(q)
+    except CatalogUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to search Hugging Face Hub: {str(e)}")
+    catalog_headers(response, entry)
+    return [HFModelInfo(**model) for model in entry["results"]]
 
 @app.get("/api/v1/models/files", response_model=List[HFFile])
-async def list_hf_model_files(repo_id: str):
+async def list_hf_model_files(repo_id: str, response: Response):
     try:
-        info = model_info(repo_id)
-        gguf_files = [HFFile(filename=f.rfilename, size=f.size) for f in info.siblings if f.rfilename.endswith(".gguf")]
-        return sorted(gguf_files, key=lambda x: x.filename)
+        entry = await hub_catalog.files(repo_id)
+    except CatalogUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to list files for repo {repo_id}: {str(e)}")
+    catalog_headers(response, entry)
+    return [HFFile(**f) for f in entry["results"]]
+
 
+# Search
+@app.get("/api/v1/search")
+async def search_messages_endpoint(
+    q: str,
+    session_id: Optional[str] = None,
+    limit: int = Query(default=20, ge=1, le=100),
+    offset: int = Query(default=0, ge=0),
+):
+    # One extra row tells whether there is a next page
+    rows = await database.run(database.search_messages, q, session_id, limit + 1, offset)
+    return {"results": rows[:limit], "next_offset": offset + limit if len(rows) > limit else None}
+
+@app.get("/api/v1/search/semantic")
+async def semantic_search_endpoint(q: str, limit: int = Query(default=10, ge=1, le=50)):
+    """Messages closest in meaning to `q` (cosine similarity of embeddings), best first."""
+    if not semantic_index.available:
+        raise HTTPException(status_code=503, detail="Semantic search needs an embedding model; set CHAT_EMBEDDING_MODEL.")
+    try:
+        results = await database.run(semantic_index.search, q, limit)
+    except SemanticIndexUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"results": results, "indexed": semantic_index.count()}
 
 # Session Management
 @app.get("/api/v1/sessions", response_model=List[Dict[str, Any]])
-async def get_all_sessions():
-    return database.get_sessions()
+async def get_all_sessions(
+    before_id: Optional[str] = None,
+    limit: Optional[int] = Query(default=None, ge=1, le=500),
+    summary: bool = False,
+):
+    return await database.run(database.get_sessions, before_id, limit, summary)
 
 @app.post("/api/v1/sessions", response_model=Dict[str, Any])
 async def create_new_session(request: NewSessionRequest):
     session_id = str(uuid.uuid4())
     timestamp = int(time.time())
-    database.add_session(session_id, request.title, timestamp)
-    return database.get_session_details(session_id)
+    await database.run(database.add_session, session_id, request.title, timestamp)
+    return await database.run(database.get_session_details, session_id)
 
 @app.delete("/api/v1/sessions/{session_id}")
 async def delete_chat_session(session_id: str):
-    database.delete_session(session_id)
+    await database.run(database.delete_session, session_id)
+    # Walks every cache key, and may delete spilled states from disk
+    await asyncio.to_thread(kv_cache.drop_session, session_id)
     return {"message": f"Session {session_id} deleted successfully."}
 
 @app.post("/api/v1/sessions/{session_id}/prompt")
 async def set_session_prompt_endpoint(session_id: str, request: SetSessionPromptRequest):
-    database.set_session_prompt(session_id, request.prompt_id)
+    if not await database.run(database.set_session_prompt, session_id, request.prompt_id):
+        raise HTTPException(status_code=404, detail="System prompt not found.")
     return {"message": "System prompt updated for session."}
 
+@app.put("/api/v1/sessions/{session_id}/model")
+async def set_session_model_endpoint(session_id: str, request: SetSessionModelRequest):
+    if request.model_name and not os.path.exists(os.path.join(MODELS_DIR, request.model_name)):
+        raise HTTPException(status_code=404, detail="Model file not found.")
+    await database.run(database.set_session_model, session_id, request.model_name)
+    return {"message": "Model pinned for session." if request.model_name else "Session uses the default model."}
+
+@app.put("/api/v1/sessions/{session_id}/summarization")
+async def set_session_summarization_endpoint(session_id: str, request: SetSessionSummarizationRequest):
+    await database.run(database.set_session_summarization, session_id, request.enabled)
+    return {"message": f"History summarization {'enabled' if request.enabled else 'disabled'} for session."}
+
+@app.get("/api/v1/sessions/{session_id}/summary")
+async def get_session_summary_endpoint(session_id: str):
+    summary = await database.run(database.get_latest_summary, session_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Session has no summary yet.")
+    return summary
+
 @app.put("/api/v1/sessions/{session_id}/parameters")
 async def update_session_parameters_endpoint(session_id: str, request: UpdateSessionParametersRequest):
-    database.update_session_parameters(
+    await database.run(
+        database.update_session_parameters,
         session_id, request.temperature, request.top_p, request.max_tokens, request.repeat_penalty, request.n_ctx
     )
     return {"message": "Session parameters updated successfully."}
@@ -297,175 +911,360 @@ async def update_session_parameters_endpoint(session_id: str, request: UpdateSes
 # Prompt Management
 @app.get("/api/v1/prompts", response_model=List[Prompt])
 async def get_all_prompts():
-    return database.get_prompts()
+    return await database.run(database.get_prompts)
 
 @app.post("/api/v1/prompts", response_model=Prompt)
 async def create_new_prompt(request: CreatePromptRequest):
-    return database.create_prompt(request.title, request.content)
+    return await database.run(database.create_prompt, request.title, request.content)
 
 @app.put("/api/v1/prompts/{prompt_id}", response_model=Prompt)
 async def update_existing_prompt(prompt_id: int, request: UpdatePromptRequest):
-    database.update_prompt(prompt_id, request.title, request.content)
+    await database.run(database.update_prompt, prompt_id, request.title, request.content)
     return {"id": prompt_id, "title": request.title, "content": request.content}
 
 @app.delete("/api/v1/prompts/{prompt_id}")
 async def delete_existing_prompt(prompt_id: int):
-    database.delete_prompt(prompt_id)
+    await database.run(database.delete_prompt, prompt_id)
     return {"message": "Prompt deleted successfully."}
 
 # Chat
 @app.get("/api/v1/sessions/{session_id}/messages", response_model=List[Message])
-async def get_session_messages(session_id: str):
-    return database.get_messages(session_id)
+async def get_session_messages(
+    session_id: str,
+    before_id: Optional[int] = None,
+    limit: Optional[int] = Query(default=None, ge=1, le=500),
+):
+    return await database.run(database.get_messages, session_id, before_id, limit)
 
 # UPDATED: Model-agnostic chat endpoint with thinking support matching frontend expectations
-@app.post("/api/v1/chat/stream")
-async def stream_chat_endpoint(request: ChatRequest):
-    if state.get("llm") is None:
-        raise HTTPException(status_code=503, detail="No model loaded.")
-
-    database.add_message(request.session_id, "user", request.prompt)
-    
-    session_details = database.get_session_details(request.session_id)
+async def start_chat_turn(request: ChatRequest) -> tuple[TurnStream, sched.GenerationJob]:
+    """Store the prompt and start generating the reply in the background; its frames go to the returned stream."""
+    turn = metrics.ChatTurnStats()
+    session_details = await turn.db(database.run(database.get_session_details, request.session_id))
     if not session_details:
         raise HTTPException(status_code=404, detail="Session not found.")
 
+    # A model pinned to the session wins over the globally selected one
+    model_name = session_details.get('model_name') or state["loaded_model_name"]
+    if model_name is None:
+        raise HTTPException(status_code=503, detail="No model loaded.")
+    turn.model_name = model_name
+
+    await turn.db(database.run(database.add_message, request.session_id, "user", request.prompt))
+
     system_prompt_id = session_details.get('system_prompt_id')
     system_prompt = None
     if system_prompt_id:
-        prompt_data = database.get_prompt_by_id(system_prompt_id)
+        prompt_data = await turn.db(database.run(database.get_prompt_by_id, system_prompt_id))
         if prompt_data:
             system_prompt = prompt_data['content']
 
-    history = database.get_messages(request.session_id)
+    job = generation_scheduler.submit(request.session_id, sched.PRIORITY_INTERACTIVE)
+    out = chat_turns.start(request.session_id)
+    spawn_background(run_chat_turn(request, session_details, model_name, system_prompt, turn, job, out))
+    return out, job
 
-    async def event_generator() -> AsyncIterator[str]:
-        full_response = ""
-        current_buffer = ""
-        in_thinking = False
-        
+async def run_chat_turn(request: ChatRequest, session_details: Dict[str, Any], model_name: str, system_prompt: Optional[str],
+                        turn: metrics.ChatTurnStats, job: sched.GenerationJob, out: TurnStream):
+    """
+    Generate one reply and store it. Runs whether or not anyone is reading `out`;
+    it stops early only when `job` is cancelled (stop button, or the NDJSON client going away).
+    """
+    parser = ThinkingStreamParser()
+    stream = None
+    entry = None
+    outcome = "error"
+    submitted = time.monotonic()
+
+    try:
+        if not job.granted.done():
+            out.emit({"status": "queued", "position": generation_scheduler.queue_depth()})
+        await job.granted
+        turn.queue_wait = time.monotonic() - submitted
         try:
+            entry = await asyncio.to_thread(checkout_model, model_name, session_details.get('n_ctx'), request.session_id)
+        except Exception as e:
+            out.emit({"status": "error", "message": f"Failed to load model. Error: {str(e)}"})
+            return
+        llm = entry.llm
+        # Only the recent history that fits the session's context, next to room for the reply
+        history = await turn.db(database.run(
+            context_window.build_history_window, llm, entry.name, request.session_id,
+            min(session_details.get('n_ctx') or entry.n_ctx, entry.n_ctx),
+            session_details.get('max_tokens', 1024), system_prompt,
+            use_summary=bool(session_details.get('summarize_history')),
+        ))
+        messages = prepare_chat_messages(history, system_prompt, request.prompt)
+        sampling = {
+            "max_tokens": session_details.get('max_tokens', 1024),
+            "temperature": session_details.get('temperature', 0.7),
+            "top_p": session_details.get('top_p', 0.95),
+            "repeat_penalty": session_details.get('repeat_penalty', 1.1),
+        }
+        cache_key = None
+        if response_cache.enabled and is_deterministic(sampling["temperature"]):
+            cache_key = response_key(entry.name, os.stat(entry.path).st_mtime_ns, messages, sampling)
+        cached = await asyncio.to_thread(response_cache.get, cache_key) if cache_key else None
+        if cache_key:
+            metrics.RESPONSE_CACHE_LOOKUPS.inc(result="miss" if cached is None else "hit")
+        if cached is not None:
+            # Same model, messages and greedy sampling: replay the stored reply through the same framing
+            turn.start_generation("cache")
+            for token in cached:
+                turn.token()
+                emit_segments(out, parser.feed(token))
+        else:
+            await asyncio.to_thread(activate_session_state, entry, request.session_id)
+            generated: List[str] = []
             # First, try using create_chat_completion (model-agnostic approach)
             try:
-                messages = prepare_chat_messages(history, system_prompt, request.prompt)
-                
-                stream = state["llm"].create_chat_completion(
-                    messages=messages,
-                    max_tokens=session_details.get('max_tokens', 1024),
-                    temperature=session_details.get('temperature', 0.7),
-                    top_p=session_details.get('top_p', 0.95),
-                    repeat_penalty=session_details.get('repeat_penalty', 1.1),
-                    stream=True,
-                )
-                
-                for chunk in stream:
-                    if chunk["choices"][0]["delta"].get("content"):
-                        token = chunk["choices"][0]["delta"]["content"]
-                        full_response += token
-                        current_buffer += token
-                        
-                        # Check for thinking start
-                        if not in_thinking and ("<think>" in current_buffer or "<thinking>" in current_buffer):
-                            in_thinking = True
-                            # Send the token as thinking
-                            yield json.dumps({"thought_token": token}) + "\n"
-                        # Check for thinking end
-                        elif in_thinking and ("</think>" in current_buffer or "</thinking>" in current_buffer):
-                            # Send the closing token as thinking
-                            yield json.dumps({"thought_token": token}) + "\n"
-                            in_thinking = False
-                            current_buffer = ""  # Reset buffer after thinking ends
-                        elif in_thinking:
-                            # We're inside thinking tags
-                            yield json.dumps({"thought_token": token}) + "\n"
-                        else:
-                            # We're outside thinking tags - regular response
-                            yield json.dumps({"token": token}) + "\n"
-                        
-                        await asyncio.sleep(0.01)
-                        
+                turn.start_generation("chat")
+                speculative.reset(llm)
+                stream = iterate_in_thread(lambda: llm.create_chat_completion(messages=messages, stream=True, **sampling), cancel=job.cancel_event)
+
+                async for chunk in stream:
+                    token = chunk["choices"][0]["delta"].get("content")
+                    if token:
+                        generated.append(token)
+                        turn.token()
+                        emit_segments(out, parser.feed(token))
+                if cache_key and not job.cancelled:
+                    await asyncio.to_thread(response_cache.put, cache_key, generated)
+
+            except WorkerCrashed:
+                raise
             except Exception as e:
                 # Fallback to manual formatting if chat completion fails
                 print(f"Chat completion failed, using fallback: {e}")
-                full_response = ""
-                current_buffer = ""
-                in_thinking = False
-                
+                parser = ThinkingStreamParser()
+
                 prompt = fallback_to_manual_formatting(history, system_prompt, request.prompt)
-                
-                stream = state["llm"](
-                    prompt=prompt,
-                    max_tokens=session_details.get('max_tokens', 1024),
-                    temperature=session_details.get('temperature', 0.7),
-                    top_p=session_details.get('top_p', 0.95),
-                    repeat_penalty=session_details.get('repeat_penalty', 1.1),
-                    stream=True,
-                )
-                
-                for output in stream:
+                turn.start_generation("fallback")
+                speculative.reset(llm)
+                stream = iterate_in_thread(lambda: llm(prompt=prompt, stream=True, **sampling), cancel=job.cancel_event)
+
+                async for output in stream:
                     token = output["choices"][0]["text"]
                     if token:
-                        full_response += token
-                        current_buffer += token
-                        
-                        # Same thinking detection logic for fallback
-                        if not in_thinking and ("<think>" in current_buffer or "<thinking>" in current_buffer):
-                            in_thinking = True
-                            yield json.dumps({"thought_token": token}) + "\n"
-                        elif in_thinking and ("</think>" in current_buffer or "</thinking>" in current_buffer):
-                            yield json.dumps({"thought_token": token}) + "\n"
-                            in_thinking = False
-                            current_buffer = ""
-                        elif in_thinking:
-                            yield json.dumps({"thought_token": token}) + "\n"
-                        else:
-                            yield json.dumps({"token": token}) + "\n"
-                        
-                        await asyncio.sleep(0.01)
-                        
+                        turn.token()
+                        emit_segments(out, parser.feed(token))
+        emit_segments(out, parser.finish())
+        # The context now holds the rendered prompt plus the reply
+        n_tokens = getattr(llm, "n_tokens", None)
+        if n_tokens is not None and turn.path != "cache":
+            turn.prompt_tokens = max(n_tokens - turn.completion_tokens, 0)
+        if turn.path != "cache":
+            turn.speculation = speculative.results(llm)
+        outcome = "cancelled" if job.cancelled else "ok"
+        out.emit({"stats": turn.summary()})
+    except sched.GenerationCancelled:
+        outcome = "cancelled"
+    except Exception as e:
+        # e.g. the model worker serving the turn crashed; the health check restarts it
+        out.emit({"status": "error", "message": f"Generation failed. Error: {str(e)}"})
+    finally:
+        try:
+            if stream is not None:
+                # Stops the generation thread if the turn is torn down mid-stream
+                await stream.aclose()
+            parser.finish()
+            reasoning, final_content = parser.thinking.strip(), parser.content.strip()
+            if final_content or reasoning:
+                # Shielded so the reply is stored even when the turn is torn down by a shutdown
+                await asyncio.shield(turn.db(database.run(
+                    lambda: database.add_message(
+                        request.session_id, "assistant", final_content,
+                        context_window.count_tokens(llm, final_content), entry.name, reasoning or None,
+                    )
+                )))
+        finally:
+            # The reply is stored before the model is released: its token count needs the tokenizer
+            if entry is not None:
+                checkin_model(entry)
+            generation_scheduler.release(job)
+            chat_turns.finish(out)
+            turn.record("cancelled" if job.cancelled and outcome == "error" else outcome)
+            if parser.content and session_details.get('summarize_history'):
+                spawn_background(summarize_in_background(
+                    request.session_id, model_name, session_details.get('n_ctx'), session_details.get('max_tokens', 1024),
+                ))
+            if parser.content and session_details.get('title') == titler.DEFAULT_TITLE:
+                spawn_background(title_in_background(request.session_id, model_name, session_details.get('n_ctx')))
+            spawn_background(index_in_background())
+
+@app.post("/api/v1/chat/stream")
+async def stream_chat_endpoint(request: ChatRequest, http_request: Request):
+    """
+    NDJSON reply stream. With `coalesce_ms`/`coalesce_tokens`, tokens are sent in batches instead of one line each.
+    The turn is cancelled when this client goes away; use the session socket to follow turns across reconnects.
+    """
+    out, job = await start_chat_turn(request)
+    # Started here rather than in the generator, which never runs if the client is gone before the response starts
+    watcher = spawn_background(cancel_on_disconnect(http_request, job, out))
+
+    async def event_generator() -> AsyncIterator[str]:
+        try:
+            async for batch in out.follow(0, request.coalesce_ms, request.coalesce_tokens):
+                yield "".join(json.dumps(frame) + "\n" for _, frame in merge_frames(batch))
         finally:
-            if full_response:
-                # Parse the final response to separate thinking from content for storage
-                thinking, response_content = parse_thinking_response(full_response.strip())
-                
-                # Store only the response content (without thinking tags)
-                final_content = response_content if response_content else full_response.strip()
-                
-                # Clean up any remaining thinking tags from the final content
-                import re
-                final_content = re.sub(r'</?think>', '', final_content)
-                final_content = re.sub(r'</?thinking>', '', final_content)
-                final_content = final_content.strip()
-                
-                if final_content:
-                    database.add_message(request.session_id, "assistant", final_content)
-
-    return StreamingResponse(event_generator(), media_type="application/x-json-stream")
+            watcher.cancel()
+            if not out.done:
+                generation_scheduler.cancel_job(job)
+
+    return StreamingResponse(event_generator(), media_type="application/x-json-stream", headers={"X-Turn-Id": out.id})
+
+@app.post("/api/v1/sessions/{session_id}/turns")
+async def start_turn_endpoint(session_id: str, request: TurnRequest):
+    """Start a turn without waiting for it; follow it on the session's socket or SSE stream."""
+    out, _ = await start_chat_turn(ChatRequest(session_id=session_id, prompt=request.prompt))
+    return {"turn_id": out.id}
+
+@app.websocket("/api/v1/sessions/{session_id}/ws")
+async def session_socket(websocket: WebSocket, session_id: str, turn_id: Optional[str] = None, offset: int = 0,
+                         coalesce_ms: float = 0, coalesce_tokens: int = 1):
+    """
+    One connection per session, for prompts and replies. Send {"type": "prompt", "prompt": ...} or {"type": "stop"};
+    receive every frame of the session's turns tagged with `turn_id` and `offset`.
+    Turns keep running while the socket is away; reconnect with the last `turn_id` and `offset` to resume.
+    """
+    if not await database.run(database.get_session_details, session_id):
+        await websocket.close(code=4404, reason="Session not found.")
+        return
+    await websocket.accept()
+
+    async def send_frames():
+        async for frame in follow_turns(session_id, turn_id, offset, coalesce_ms, coalesce_tokens):
+            await websocket.send_text(json.dumps(frame))
+
+    sender = asyncio.create_task(send_frames())
+    try:
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+            except ValueError:
+                message = None
+            if not isinstance(message, dict):
+                await websocket.send_text(json.dumps({"status": "error", "message": "Messages must be JSON objects."}))
+            elif message.get("type") == "prompt" and isinstance(message.get("prompt"), str):
+                try:
+                    await start_chat_turn(ChatRequest(session_id=session_id, prompt=message["prompt"]))
+                except HTTPException as e:
+                    await websocket.send_text(json.dumps({"status": "error", "message": e.detail}))
+            elif message.get("type") == "stop":
+                generation_scheduler.cancel_session(session_id)
+            else:
+                await websocket.send_text(json.dumps({"status": "error", "message": "Expected a prompt or stop message."}))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+
+@app.get("/api/v1/sessions/{session_id}/stream")
+async def session_event_stream(session_id: str, http_request: Request, turn_id: Optional[str] = None, offset: int = 0,
+                               coalesce_ms: float = 0, coalesce_tokens: int = 1):
+    """
+    Server-sent events with the frames of the session's turns; start turns with POST .../turns.
+    Each event id is `turn_id:offset`, so a reconnecting EventSource resumes through Last-Event-ID.
+    """
+    if not await database.run(database.get_session_details, session_id):
+        raise HTTPException(status_code=404, detail="Session not found.")
+    last_event_id = http_request.headers.get("last-event-id", "")
+    if ":" in last_event_id:
+        turn_id, _, last_offset = last_event_id.rpartition(":")
+        offset = int(last_offset) if last_offset.isdigit() else 0
+
+    async def sse_streamer() -> AsyncIterator[str]:
+        async for frame in with_heartbeat(follow_turns(session_id, turn_id, offset, coalesce_ms, coalesce_tokens)):
+            if frame is None:
+                yield ": heartbeat\n\n"
+            else:
+                yield f"id: {frame['turn_id']}:{frame['offset']}\ndata: {json.dumps(frame)}\n\n"
+
+    return StreamingResponse(sse_streamer(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+def follow_turns(session_id: str, turn_id: Optional[str], offset: int, coalesce_ms: float, coalesce_tokens: int) -> AsyncIterator[Dict[str, Any]]:
+    return chat_turns.follow_session(session_id, turn_id, max(offset, 0), min(max(coalesce_ms, 0), 1000), min(max(coalesce_tokens, 1), 256))
+
+async def with_heartbeat(frames: AsyncIterator[Dict[str, Any]], interval: float = HEARTBEAT_SECONDS) -> AsyncIterator[Optional[Dict[str, Any]]]:
+    """Yield `frames`, and None whenever none arrived for `interval` seconds, so dead connections are noticed."""
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        async for frame in frames:
+            await queue.put(frame)
+
+    pumping = asyncio.create_task(pump())
+    try:
+        while True:
+            try:
+                yield await asyncio.wait_for(queue.get(), interval)
+            except asyncio.TimeoutError:
+                yield None
+    finally:
+        pumping.cancel()
 
 
 @app.post("/api/v1/generate-title")
 async def generate_title_endpoint(request: GenerateTitleRequest):
-    if state.get("llm") is None:
+    """Regenerate a title on demand; new sessions are titled automatically after their first exchange."""
+    session_details = await database.run(database.get_session_details, request.session_id)
+    if not session_details:
+        raise HTTPException(status_code=404, detail="Session not found.")
+    model_name = session_details.get('model_name') or state["loaded_model_name"]
+    if model_name is None:
         raise HTTPException(status_code=503, detail="No model loaded.")
-    
-    messages = database.get_messages(request.session_id)
-    context = "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages])
-
-    title_prompt = f"Based on this conversation, create a short, concise title (3-5 words):\n\n{context}\n\nTitle:"
     try:
-        output = state["llm"](
-            title_prompt, 
-            max_tokens=20, 
-            stop=["\n"], 
-            temperature=0.2, 
-            echo=False
-        )
-        title = output["choices"][0]["text"].strip()
-        database.update_session_title(request.session_id, title)
-        return {"title": title}
+        title = await generate_title(request.session_id, model_name, session_details.get('n_ctx'), sched.PRIORITY_BACKGROUND)
+    except sched.GenerationCancelled:
+        raise HTTPException(status_code=409, detail="Title generation was cancelled.")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate title. Error: {str(e)}")
+    if title is None:
+        raise HTTPException(status_code=409, detail="The session has no reply to title yet.")
+    return {"title": title}
+
+@app.get("/api/v1/events")
+async def events_endpoint():
+    """NDJSON feed of background results, e.g. {"event": "session_title", "session_id": ..., "title": ...}."""
+    async def event_streamer() -> AsyncIterator[str]:
+        async for event in event_bus.subscribe():
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(event_streamer(), media_type="application/x-json-stream")
+
+# Read at scrape time
+metrics.Gauge("generation_queue_depth", "Generation jobs waiting for the model.", lambda: generation_scheduler.queue_depth())
+metrics.Gauge("model_pool_used_bytes", "Estimated RAM held by resident models.", model_pool.used_bytes)
+metrics.Gauge("model_pool_budget_bytes", "RAM budget of the model pool.", lambda: model_pool.budget_bytes)
+metrics.Gauge("model_pool_models", "Resident model instances.", lambda: len(model_pool.resident()))
+metrics.Gauge("downloads", "Download jobs by status.", lambda: Counter(job.status for job in download_manager.jobs()), label="status")
+metrics.Gauge("semantic_index_vectors", "Messages in the semantic search index.", semantic_index.count)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/api/v1/chat/{session_id}/stop")
+async def stop_generation_endpoint(session_id: str):
+    cancelled = generation_scheduler.cancel_session(session_id)
+    return {"message": f"Stopped {cancelled} generation(s) for session {session_id}.", "cancelled": cancelled}
+
+@app.get("/api/v1/chat/cache")
+async def response_cache_status():
+    return response_cache.stats()
+
+@app.delete("/api/v1/chat/cache")
+async def clear_response_cache():
+    await asyncio.to_thread(response_cache.clear)
+    return {"message": "Response cache cleared."}
+
+@app.get("/api/v1/chat/queue")
+async def generation_queue_status():
+    return generation_scheduler.stats()
     
 if __name__ == "__main__":
+    # Model workers are spawned processes; a frozen build must hand them over to their entry point
+    import multiprocessing
+    multiprocessing.freeze_support()
     import uvicorn
     uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
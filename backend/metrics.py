@@ -0,0 +1,221 @@
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Prometheus text exposition without the client library: counters, histograms and gauges read at scrape time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+LOAD_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 131072)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 250, 500)
+THROUGHPUT_BUCKETS = (1 << 20, 5 << 20, 10 << 20, 25 << 20, 50 << 20, 100 << 20, 250 << 20, 500 << 20, 1 << 30)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+_registry: List["_Metric"] = []
+
+
+def _labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_labels(k)} {_number(v)}" for k, v in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = buckets
+        # Per label set: per-bucket counts (not cumulative), sum, count
+        self._values: Dict[LabelKey, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: Optional[float], **labels):
+        if value is None:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, totals = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0, 0]))
+            counts[next((i for i, b in enumerate(self.buckets) if value <= b), len(self.buckets))] += 1
+            totals[0] += value
+            totals[1] += 1
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, (total, count)) in self._values.items():
+                cumulative = 0
+                for bound, n in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else _number(bound)
+                    lines.append(f"{self.name}_bucket{_labels(key, ('le', le))} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(key)} {_number(total)}")
+                lines.append(f"{self.name}_count{_labels(key)} {int(count)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Read from `read` at scrape time; it returns a value, or {label value: value} for one label."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, read: Callable[[], object], label: Optional[str] = None):
+        super().__init__(name, help)
+        self.read = read
+        self.label = label
+
+    def _samples(self) -> List[str]:
+        try:
+            value = self.read()
+        except Exception:
+            return []
+        if self.label is None:
+            return [f"{self.name} {_number(value)}"]
+        return [f"{self.name}{_labels(((self.label, k),))} {_number(v)}" for k, v in value.items()]
+
+
+def render() -> str:
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+CHAT_REQUESTS = Counter("chat_requests_total", "Chat turns by model, generation path (chat or fallback prompt) and outcome.")
+CHAT_QUEUE_WAIT = Histogram("chat_queue_wait_seconds", "Time a chat turn waited for the generation scheduler.")
+CHAT_PROMPT_TOKENS = Histogram("chat_prompt_tokens", "Tokens in the context when generation finished, minus the reply.", TOKEN_BUCKETS)
+CHAT_COMPLETION_TOKENS = Counter("chat_completion_tokens_total", "Tokens generated for chat replies.")
+CHAT_PROMPT_EVAL = Histogram("chat_prompt_eval_seconds", "From the generation call to the first token, i.e. prompt evaluation.")
+CHAT_TTFT = Histogram("chat_time_to_first_token_seconds", "From receiving the request to the first token.")
+CHAT_DECODE_RATE = Histogram("chat_decode_tokens_per_second", "Reply tokens per second after the first one.", RATE_BUCKETS)
+CHAT_LATENCY = Histogram("chat_latency_seconds", "From receiving the request to the end of the reply.", LOAD_BUCKETS)
+CHAT_DB = Histogram("chat_db_seconds", "SQLite time per chat turn, including building the history window.")
+SPECULATIVE_TOKENS = Counter("speculative_draft_tokens_total", "Draft tokens proposed for chat replies, by model and result (accepted or rejected).")
+RESPONSE_CACHE_LOOKUPS = Counter("response_cache_lookups_total", "Response cache lookups for greedy chat turns, by result (hit or miss).")
+MODEL_LOAD = Histogram("model_load_seconds", "Time to load a model into the pool.", LOAD_BUCKETS)
+DOWNLOAD_BYTES = Counter("download_bytes_total", "Bytes fetched by completed model downloads.")
+DOWNLOAD_THROUGHPUT = Histogram("download_throughput_bytes_per_second", "Average speed of each completed download run.", THROUGHPUT_BUCKETS)
+
+
+class ChatTurnStats:
+    """Timings of one chat turn; sent as the stream's final `stats` line and recorded in the histograms above."""
+
+    def __init__(self, model_name: Optional[str] = None):
+        self.model_name = model_name
+        self.path = "chat"
+        self.started = time.monotonic()
+        self.queue_wait: Optional[float] = None
+        self.db_seconds = 0.0
+        self.generation_started: Optional[float] = None
+        self.first_token: Optional[float] = None
+        self.last_token: Optional[float] = None
+        self.completion_tokens = 0
+        self.prompt_tokens: Optional[int] = None
+        # Draft tokens proposed and accepted, when the model was loaded with speculative decoding
+        self.speculation: Optional[Dict[str, Any]] = None
+
+    async def db(self, awaitable):
+        started = time.monotonic()
+        try:
+            return await awaitable
+        finally:
+            self.db_seconds += time.monotonic() - started
+
+    def start_generation(self, path: str):
+        """`path` is "chat", "fallback" or "cache"; a fallback after a failed chat call starts the token timings over."""
+        self.path = path
+        self.generation_started = time.monotonic()
+        self.first_token = self.last_token = None
+        self.completion_tokens = 0
+
+    def token(self):
+        self.last_token = time.monotonic()
+        if self.first_token is None:
+            self.first_token = self.last_token
+        self.completion_tokens += 1
+
+    def summary(self) -> Dict[str, object]:
+        decode_rate = None
+        if self.completion_tokens > 1 and self.last_token > self.first_token:
+            decode_rate = (self.completion_tokens - 1) / (self.last_token - self.first_token)
+
+        def since(start: Optional[float], end: Optional[float]) -> Optional[float]:
+            return round(end - start, 4) if start is not None and end is not None else None
+
+        return {
+            "model_name": self.model_name,
+            "path": self.path,
+            "queue_wait_seconds": None if self.queue_wait is None else round(self.queue_wait, 4),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "prompt_eval_seconds": since(self.generation_started, self.first_token),
+            "time_to_first_token_seconds": since(self.started, self.first_token),
+            "decode_tokens_per_second": None if decode_rate is None else round(decode_rate, 2),
+            "total_seconds": round(time.monotonic() - self.started, 4),
+            "db_seconds": round(self.db_seconds, 4),
+            **({"speculative": self.speculative_summary()} if self.speculation else {}),
+        }
+
+    def speculative_summary(self) -> Dict[str, object]:
+        drafted, accepted = self.speculation["drafted"], self.speculation["accepted"]
+        return {
+            "kind": self.speculation["kind"],
+            "draft_tokens": drafted,
+            "accepted_tokens": accepted,
+            "acceptance_rate": round(accepted / drafted, 4) if drafted else None,
+        }
+
+    def record(self, outcome: str):
+        stats = self.summary()
+        model = self.model_name
+        CHAT_REQUESTS.inc(model=model, path=self.path, outcome=outcome)
+        CHAT_QUEUE_WAIT.observe(stats["queue_wait_seconds"], model=model)
+        CHAT_PROMPT_TOKENS.observe(stats["prompt_tokens"], model=model)
+        CHAT_COMPLETION_TOKENS.inc(self.completion_tokens, model=model)
+        CHAT_PROMPT_EVAL.observe(stats["prompt_eval_seconds"], model=model)
+        CHAT_TTFT.observe(stats["time_to_first_token_seconds"], model=model)
+        CHAT_DECODE_RATE.observe(stats["decode_tokens_per_second"], model=model)
+        CHAT_LATENCY.observe(stats["total_seconds"], model=model)
+        CHAT_DB.observe(stats["db_seconds"], model=model)
+        if self.speculation:
+            SPECULATIVE_TOKENS.inc(self.speculation["accepted"], model=model, result="accepted")
+            SPECULATIVE_TOKENS.inc(self.speculation["drafted"] - self.speculation["accepted"], model=model, result="rejected")
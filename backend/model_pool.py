@@ -0,0 +1,249 @@
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+import speculative
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama
+
+# Used when a model's header can't be read
+DEFAULT_N_CTX = 8192
+# Upper bound for the default context; longer contexts must be asked for explicitly
+MAX_DEFAULT_N_CTX = 32768
+MIN_N_CTX = 512
+# llama.cpp runs best on physical cores; half the logical CPUs is its own default
+DEFAULT_N_THREADS = max((os.cpu_count() or 2) // 2, 1)
+# Total RAM the resident models may use (weights + KV cache), overridable in MB via the environment
+MODEL_POOL_BUDGET_BYTES = int(os.environ.get("CHAT_MODEL_POOL_BUDGET_MB", 8192)) << 20
+
+
+def estimate_kv_bytes(metadata: Dict[str, str], n_ctx: int) -> int:
+    """Size of an f16 KV cache for `n_ctx` tokens, from the GGUF metadata llama_cpp exposes."""
+    arch = metadata.get("general.architecture", "llama")
+    try:
+        n_layer = int(metadata[f"{arch}.block_count"])
+        n_embd = int(metadata[f"{arch}.embedding_length"])
+        n_head = int(metadata[f"{arch}.attention.head_count"])
+        n_head_kv = int(metadata.get(f"{arch}.attention.head_count_kv", n_head))
+    except (KeyError, ValueError, ZeroDivisionError):
+        return 0
+    return 2 * n_layer * n_ctx * (n_embd * n_head_kv // n_head) * 2
+
+
+class PooledModel:
+    def __init__(self, name: str, path: str, n_ctx: int, llm: "Llama", size_bytes: int, options: Dict[str, Any]):
+        self.name = name
+        self.path = path
+        self.n_ctx = n_ctx
+        self.llm = llm
+        self.size_bytes = size_bytes
+        self.options = options
+        # Of the file the weights were loaded from; part of `key`, so saved prompt states never outlive the weights
+        self.mtime_ns = os.stat(path).st_mtime_ns
+        self.load_seconds = 0.0
+        self.last_used = time.monotonic()
+        self.in_use = 0
+        # Session whose prompt state currently sits in this instance's KV cache
+        self.kv_session: Optional[str] = None
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}@{self.n_ctx}#{self.mtime_ns}"
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "model_name": self.name,
+            "n_ctx": self.n_ctx,
+            "size_bytes": self.size_bytes,
+            "options": self.options,
+            "load_seconds": round(self.load_seconds, 2),
+            "in_use": self.in_use,
+            "idle_seconds": round(time.monotonic() - self.last_used, 1),
+        }
+
+
+class ModelPool:
+    """
+    Keeps several GGUF models resident up to `budget_bytes` and evicts the least recently used idle one.
+    A loaded instance is reused for any request whose `n_ctx` fits in its context.
+    Load options (`use_mmap`, `use_mlock`, `n_batch`, `n_threads`, `draft_model`, `draft_tokens`) given for a model are remembered
+    and reused when it has to be reloaded after an eviction.
+    With a `catalog`, the default context and the memory needed for a load come from the model's GGUF header.
+    `on_load` is called with each newly loaded instance, `on_evict` with an instance right before it is dropped;
+    by then it is out of the pool, and the hook runs without the pool's lock held.
+    `option_defaults(name)` gives load options (e.g. tuned thread counts) that options given for the model override.
+    """
+
+    def __init__(self, models_dir, budget_bytes: int = MODEL_POOL_BUDGET_BYTES, on_evict: Optional[Callable[[PooledModel], None]] = None, catalog=None,
+                 on_load: Optional[Callable[[PooledModel], None]] = None, option_defaults: Optional[Callable[[str], Dict[str, Any]]] = None):
+        self.models_dir = models_dir
+        self.option_defaults = option_defaults
+        self.catalog = catalog
+        self.budget_bytes = budget_bytes
+        self.on_evict = on_evict
+        self.on_load = on_load
+        self._models: List[PooledModel] = []
+        self._options: Dict[str, Dict[str, Any]] = {}
+        # `_lock` guards the bookkeeping and is never held across a load; `_load_lock` serializes loads
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def checkout(self, name: str, n_ctx: Optional[int] = None, options: Optional[Dict[str, Any]] = None) -> PooledModel:
+        """
+        Return a resident instance of `name` with at least `n_ctx` context, loading it if needed. Blocking.
+        With `options`, only an instance loaded with exactly those options is reused.
+        """
+        n_ctx = n_ctx or self.default_n_ctx(name)
+        wanted = {**self._defaults(name), **options} if options is not None else None
+        # A resident instance is handed out at once, even while another model is loading
+        entry = self._reserve(name, n_ctx, wanted)
+        if entry is not None:
+            return entry
+        with self._load_lock:
+            # Another caller may have loaded it while this one waited for the lock
+            entry = self._reserve(name, n_ctx, wanted)
+            if entry is not None:
+                return entry
+            entry = self._load(name, n_ctx, wanted or self._options.get(name) or self._defaults(name))
+            # Remembered only once they loaded, so a failed load (e.g. a bad draft model) doesn't stick
+            if wanted is not None:
+                self._options[name] = wanted
+            if self.on_load is not None:
+                self.on_load(entry)
+            with self._lock:
+                self._models.append(entry)
+                entry.in_use += 1
+                # Now that the real KV size is known, trim the pool around the new instance
+                evicted = self._make_room(0)
+            self._drop(evicted)
+            return entry
+
+    def default_n_ctx(self, name: str) -> int:
+        """The trained context length, capped at MAX_DEFAULT_N_CTX and at what the pool budget leaves for the KV cache."""
+        info = self.catalog.get(name) if self.catalog is not None else None
+        if not info or not info.get("context_length"):
+            return DEFAULT_N_CTX
+        n_ctx = min(info["context_length"], MAX_DEFAULT_N_CTX)
+        per_token = estimate_kv_bytes(info["metadata"], 1)
+        room = self.budget_bytes - info["size_bytes"]
+        if per_token and room > 0:
+            n_ctx = min(n_ctx, room // per_token)
+        return max(n_ctx // 256 * 256, MIN_N_CTX)
+
+    def checkin(self, entry: PooledModel):
+        with self._lock:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+
+    def checkout_resident(self, name: str) -> Optional[PooledModel]:
+        """Like `checkout`, but never loads: returns a resident instance of `name` or None."""
+        with self._lock:
+            entry = self._find(name, 0)
+            if entry is not None:
+                entry.in_use += 1
+                entry.last_used = time.monotonic()
+            return entry
+
+    def is_loaded(self, name: str, n_ctx: Optional[int] = None) -> bool:
+        return self._find(name, n_ctx or 0) is not None
+
+    def trim(self):
+        """Evict idle instances until the pool fits its budget again."""
+        with self._lock:
+            evicted = self._make_room(0)
+        self._drop(evicted)
+
+    def make_room(self, needed: int):
+        """Evict idle instances until `needed` more bytes fit the budget, e.g. for a model loaded outside the pool."""
+        with self._lock:
+            evicted = self._make_room(needed)
+        self._drop(evicted)
+
+    def unload(self, name: str):
+        with self._lock:
+            evicted = [e for e in self._models if e.name == name and e.in_use == 0]
+            for entry in evicted:
+                self._models.remove(entry)
+        self._drop(evicted)
+
+    def resident(self) -> List[PooledModel]:
+        return list(self._models)
+
+    def used_bytes(self) -> int:
+        return sum(e.size_bytes for e in self._models)
+
+    def stats(self) -> Dict[str, Any]:
+        models = list(self._models)
+        return {
+            "budget_bytes": self.budget_bytes,
+            "used_bytes": sum(e.size_bytes for e in models),
+            "models": [e.info() for e in sorted(models, key=lambda e: e.last_used, reverse=True)],
+        }
+
+    def _reserve(self, name: str, n_ctx: int, options: Optional[Dict[str, Any]]) -> Optional[PooledModel]:
+        with self._lock:
+            entry = self._find(name, n_ctx, options)
+            if entry is not None:
+                entry.in_use += 1
+                entry.last_used = time.monotonic()
+            return entry
+
+    def _defaults(self, name: str) -> Dict[str, Any]:
+        tuned = self.option_defaults(name) if self.option_defaults is not None else {}
+        return {"n_threads": DEFAULT_N_THREADS, **tuned}
+
+    def _find(self, name: str, n_ctx: int, options: Optional[Dict[str, Any]] = None) -> Optional[PooledModel]:
+        # Smallest instance that is big enough, so large contexts stay free for sessions that need them
+        candidates = [
+            e for e in self._models
+            if e.name == name and e.n_ctx >= n_ctx and (options is None or e.options == options)
+        ]
+        return min(candidates, key=lambda e: e.n_ctx, default=None)
+
+    def _load(self, name: str, n_ctx: int, options: Dict[str, Any]) -> PooledModel:
+        path = os.path.join(self.models_dir, name)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Model file '{name}' not found.")
+        # Free room up front; without a catalog the KV cache size is only known once the model is loaded
+        info = self.catalog.get(name) if self.catalog is not None else None
+        kv_bytes = estimate_kv_bytes(info.get("metadata", {}), n_ctx) if info else 0
+        draft = speculative.draft_path(self.models_dir, options)
+        # A draft model is counted by its file size; its KV cache is small next to the main model's
+        draft_bytes = os.path.getsize(draft) if draft and os.path.exists(draft) else 0
+        with self._lock:
+            evicted = self._make_room(os.path.getsize(path) + kv_bytes + draft_bytes)
+        self._drop(evicted)
+        # Imported on first load, so the server starts without loading llama.cpp's shared library
+        from llama_cpp import Llama
+
+        started = time.monotonic()
+        llm = Llama(model_path=path, n_ctx=n_ctx, n_gpu_layers=0, verbose=False, **speculative.llama_kwargs(self.models_dir, n_ctx, options))
+        size = os.path.getsize(path) + estimate_kv_bytes(llm.metadata or {}, n_ctx) + draft_bytes
+        entry = PooledModel(name, path, n_ctx, llm, size, dict(options))
+        entry.load_seconds = time.monotonic() - started
+        return entry
+
+    def _make_room(self, needed: int) -> List[PooledModel]:
+        """Take idle instances out of the pool until `needed` more bytes fit; the caller drops them after releasing `_lock`."""
+        idle = sorted((e for e in self._models if e.in_use == 0), key=lambda e: e.last_used)
+        evicted = []
+        while idle and self.used_bytes() + needed > self.budget_bytes:
+            evicted.append(idle.pop(0))
+            self._models.remove(evicted[-1])
+        return evicted
+
+    def _drop(self, evicted: List[PooledModel]):
+        # Out of the pool, so no one else can check them out: saving their session state (and spilling it
+        # to disk) doesn't hold up checkouts of the other models
+        for entry in evicted:
+            if self.on_evict is not None:
+                try:
+                    self.on_evict(entry)
+                except Exception as e:
+                    print(f"Eviction hook failed for model {entry.key}: {e}")
+            speculative.close(entry.llm)
+            if hasattr(entry.llm, "close"):
+                entry.llm.close()
+            entry.llm = None
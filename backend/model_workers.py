@@ -0,0 +1,534 @@
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import speculative
+
+# Generate in this many worker processes instead of in the server process; 0 keeps the in-process model pool
+MODEL_WORKERS = int(os.environ.get("CHAT_MODEL_WORKERS", 0))
+HEALTH_INTERVAL = 5.0
+# A worker that hasn't answered a ping for this long is presumed hung and restarted
+PING_TIMEOUT = 30.0
+SHUTDOWN_TIMEOUT = 5.0
+# How often a caller waiting for a reply checks that the process it asked is still the one running
+REPLY_POLL_SECONDS = 1.0
+# Saved prompt states each worker keeps for the sessions it served, so a session routed back to it skips re-evaluation
+WORKER_STATE_BUDGET_BYTES = int(os.environ.get("CHAT_WORKER_STATE_MB", 1024)) << 20
+# Sessions remembered per worker for routing; only a hint, the worker's own state cache is authoritative
+AFFINITY_SESSIONS = 256
+
+
+class WorkerCrashed(RuntimeError):
+    pass
+
+
+# --- Worker process ---
+class _WorkerModel:
+    """The model inside a worker process, and the prompt states of the sessions it served."""
+
+    def __init__(self, n_threads: int, llama_factory: Callable):
+        self.n_threads = n_threads
+        self.llama_factory = llama_factory
+        self.llm = None
+        self.loaded = None
+        self.session: Optional[str] = None
+        self.states: "OrderedDict[str, Any]" = OrderedDict()
+        self.state_bytes = 0
+
+    def load(self, path: str, n_ctx: int, options: Dict[str, Any]) -> Dict[str, Any]:
+        options = {"n_threads": self.n_threads, **options}
+        key = (path, n_ctx, sorted(options.items()))
+        started = time.monotonic()
+        if self.loaded != key:
+            self.unload()
+            llama_options = speculative.llama_kwargs(os.path.dirname(path), n_ctx, options)
+            self.llm = self.llama_factory(model_path=path, n_ctx=n_ctx, n_gpu_layers=0, verbose=False, **llama_options)
+            self.loaded = key
+        return {"metadata": dict(self.llm.metadata or {}), "options": options, "load_seconds": time.monotonic() - started}
+
+    def unload(self) -> None:
+        if self.llm is not None:
+            speculative.close(self.llm)
+        if self.llm is not None and hasattr(self.llm, "close"):
+            self.llm.close()
+        self.llm = self.loaded = self.session = None
+        self.states.clear()
+        self.state_bytes = 0
+
+    def activate(self, session_id: Optional[str]) -> None:
+        """Same as the server's `activate_session_state`, against this worker's own state cache."""
+        if self.session == session_id:
+            return
+        if self.session is not None:
+            self._keep(self.session, self.llm.save_state())
+        if session_id is not None and session_id in self.states:
+            state = self.states.pop(session_id)
+            self.state_bytes -= _state_size(state)
+            self.llm.load_state(state)
+        self.session = session_id
+
+    def tokenize(self, text: bytes, add_bos: bool, special: bool) -> List[int]:
+        return list(self.llm.tokenize(text, add_bos=add_bos, special=special))
+
+    def detokenize(self, tokens: List[int]) -> bytes:
+        return self.llm.detokenize(tokens)
+
+    def generate(self, op: str, args: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        speculative.reset(self.llm)
+        if op == "chat":
+            return self.llm.create_chat_completion(stream=True, **args)
+        return self.llm(stream=True, **args)
+
+    def _keep(self, session_id: str, state):
+        self.states[session_id] = state
+        self.state_bytes += _state_size(state)
+        while self.state_bytes > WORKER_STATE_BUDGET_BYTES and len(self.states) > 1:
+            _, old = self.states.popitem(last=False)
+            self.state_bytes -= _state_size(old)
+
+
+def _state_size(llama_state) -> int:
+    return int(llama_state.llama_state_size + llama_state.input_ids.nbytes + llama_state.scores.nbytes)
+
+
+def _worker_main(conn, n_threads: int, llama_factory: Optional[Callable]):
+    """Worker process entry point: a reader thread answers pings and cancels at once, the main thread runs requests in order."""
+    if llama_factory is None:
+        from llama_cpp import Llama as llama_factory
+    requests: queue.Queue = queue.Queue()
+    cancelled = set()
+    send_lock = threading.Lock()
+
+    def send(kind: str, request_id: int, payload=None):
+        with send_lock:
+            conn.send((kind, request_id, payload))
+
+    def read():
+        try:
+            while True:
+                op, request_id, args = conn.recv()
+                if op == "ping":
+                    send("pong", request_id)
+                elif op == "cancel":
+                    cancelled.add(request_id)
+                else:
+                    requests.put((op, request_id, args))
+        except (EOFError, OSError):
+            # The server closed the pipe or went away
+            requests.put(None)
+
+    threading.Thread(target=read, name="worker-reader", daemon=True).start()
+    model = _WorkerModel(n_threads, llama_factory)
+    while True:
+        message = requests.get()
+        if message is None:
+            model.unload()
+            return
+        op, request_id, args = message
+        try:
+            if op in ("chat", "complete"):
+                stream = model.generate(op, args)
+                try:
+                    for chunk in stream:
+                        if request_id in cancelled:
+                            break
+                        send("chunk", request_id, chunk)
+                finally:
+                    if hasattr(stream, "close"):
+                        stream.close()
+                send("end", request_id, {"n_tokens": model.llm.n_tokens, "speculation": speculative.results(model.llm)})
+            else:
+                send("result", request_id, getattr(model, op)(**args))
+        except Exception as e:
+            send("error", request_id, f"{type(e).__name__}: {e}")
+        finally:
+            cancelled.discard(request_id)
+
+
+# --- Server side ---
+class ModelWorker:
+    """One worker process and the pipe to it. Calls block, and may come from any thread."""
+
+    def __init__(self, index: int, n_threads: int, llama_factory: Optional[Callable]):
+        self.index = index
+        self.n_threads = n_threads
+        self.llama_factory = llama_factory
+        self.process = None
+        self.conn = None
+        self.alive = False
+        self.leased = False
+        self.restarts = 0
+        self.started_at = 0.0
+        self.last_pong = 0.0
+        self.last_used = 0.0
+        # (name, n_ctx, options) of the loaded model, and what its load reported
+        self.loaded: Optional[tuple] = None
+        self.load_info: Dict[str, Any] = {}
+        self.n_tokens = 0
+        # Draft tokens proposed and accepted during the last generation, when the model speculates
+        self.speculation: Optional[Dict[str, Any]] = None
+        self.sessions: "OrderedDict[str, None]" = OrderedDict()
+        self._pending: Dict[int, queue.Queue] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def start(self):
+        context = multiprocessing.get_context("spawn")
+        conn, child_conn = context.Pipe()
+        process = context.Process(
+            target=_worker_main, args=(child_conn, self.n_threads, self.llama_factory), name=f"model-worker-{self.index}", daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        with self._lock:
+            self.process, self.conn, self.alive = process, conn, True
+            self.loaded, self.load_info, self.n_tokens = None, {}, 0
+            self.sessions.clear()
+            self.started_at = self.last_pong = time.monotonic()
+        threading.Thread(target=self._read, args=(conn,), name=f"model-worker-{self.index}-reader", daemon=True).start()
+
+    def stop(self, timeout: float = SHUTDOWN_TIMEOUT):
+        with self._lock:
+            process, conn, self.alive = self.process, self.conn, False
+        if conn is not None:
+            conn.close()
+        if process is not None:
+            process.join(timeout)
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+    def restart(self):
+        self.stop(0)
+        self.restarts += 1
+        self.start()
+
+    def ping(self):
+        self._send("ping", next(self._ids), None)
+
+    def call(self, op: str, **args) -> Any:
+        request_id, replies, process = self._submit(op, args)
+        try:
+            kind, payload = self._reply(replies, process)
+        finally:
+            self._pending.pop(request_id, None)
+        if kind == "crashed":
+            raise WorkerCrashed(payload)
+        if kind == "error":
+            raise RuntimeError(payload)
+        return payload
+
+    def stream(self, op: str, **args) -> Iterator[Dict[str, Any]]:
+        request_id, replies, process = self._submit(op, args)
+        finished = False
+        try:
+            while True:
+                kind, payload = self._reply(replies, process)
+                if kind == "chunk":
+                    yield payload
+                    continue
+                finished = True
+                if kind == "end":
+                    self.n_tokens = payload["n_tokens"]
+                    self.speculation = payload["speculation"]
+                    return
+                raise (WorkerCrashed if kind == "crashed" else RuntimeError)(payload)
+        finally:
+            if not finished:
+                # Stopped early: tell the worker, and only return once it has let go of the model
+                try:
+                    self._send("cancel", request_id, None)
+                    while self._reply(replies, process)[0] not in ("end", "error", "crashed"):
+                        pass
+                except WorkerCrashed:
+                    pass
+            self._pending.pop(request_id, None)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "index": self.index,
+            "pid": self.process.pid if self.process is not None else None,
+            "alive": self.alive,
+            "busy": self.leased,
+            "model_name": self.loaded[0] if self.loaded else None,
+            "n_ctx": self.loaded[1] if self.loaded else None,
+            "n_threads": self.n_threads,
+            "sessions": len(self.sessions),
+            "restarts": self.restarts,
+            "uptime_seconds": round(time.monotonic() - self.started_at, 1) if self.alive else 0.0,
+        }
+
+    def _submit(self, op: str, args: Dict[str, Any]):
+        request_id, replies = next(self._ids), queue.Queue()
+        self._pending[request_id] = replies
+        try:
+            process = self._send(op, request_id, args)
+        except WorkerCrashed:
+            self._pending.pop(request_id, None)
+            raise
+        return request_id, replies, process
+
+    def _send(self, op: str, request_id: int, args):
+        """Returns the process the message went to."""
+        with self._lock:
+            if not self.alive:
+                raise WorkerCrashed(f"Model worker {self.index} is not running.")
+            try:
+                self.conn.send((op, request_id, args))
+            except (OSError, ValueError) as e:
+                raise WorkerCrashed(f"Model worker {self.index} went away: {e}")
+            return self.process
+
+    def _reply(self, replies: queue.Queue, process) -> tuple:
+        """
+        The next reply to a request sent to `process`. The reader thread reports a crash, but not when the
+        health check restarted the worker first; then the request's process is gone, and that counts as a crash.
+        """
+        while True:
+            try:
+                return replies.get(timeout=REPLY_POLL_SECONDS)
+            except queue.Empty:
+                if process is not self.process or not process.is_alive():
+                    return "crashed", f"Model worker {self.index} crashed."
+
+    def _read(self, conn):
+        try:
+            while True:
+                kind, request_id, payload = conn.recv()
+                if kind == "pong":
+                    self.last_pong = time.monotonic()
+                    continue
+                replies = self._pending.get(request_id)
+                if replies is not None:
+                    replies.put((kind, payload))
+        except (EOFError, OSError):
+            pass
+        with self._lock:
+            if conn is not self.conn:
+                return
+            self.alive = False
+        for replies in list(self._pending.values()):
+            replies.put(("crashed", f"Model worker {self.index} crashed."))
+
+
+class RemoteLlama:
+    """The parts of llama_cpp's `Llama` the server uses, run in a worker process. Blocking."""
+
+    def __init__(self, worker: ModelWorker):
+        self.worker = worker
+        self.metadata = worker.load_info.get("metadata", {})
+
+    @property
+    def n_tokens(self) -> int:
+        return self.worker.n_tokens
+
+    @property
+    def draft_model(self):
+        # The worker counts per generation itself; this only hands its last count to `speculative.results`
+        return _RemoteDraft(self.worker) if dict(self.worker.loaded[2] if self.worker.loaded else ()).get("draft_model") else None
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        return self.worker.call("tokenize", text=text, add_bos=add_bos, special=special)
+
+    def detokenize(self, tokens: List[int]) -> bytes:
+        return self.worker.call("detokenize", tokens=list(tokens))
+
+    def create_chat_completion(self, messages, stream: bool = False, **kwargs):
+        chunks = self.worker.stream("chat", messages=messages, **kwargs)
+        if stream:
+            return chunks
+        content = "".join(c["choices"][0]["delta"].get("content") or "" for c in chunks)
+        return {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": None}]}
+
+    def __call__(self, prompt: str, stream: bool = False, **kwargs):
+        outputs = self.worker.stream("complete", prompt=prompt, **kwargs)
+        if stream:
+            return outputs
+        return {"choices": [{"index": 0, "text": "".join(o["choices"][0]["text"] for o in outputs), "finish_reason": None}]}
+
+    def activate_session(self, session_id: Optional[str]):
+        self.worker.call("activate", session_id=session_id)
+        if session_id is not None:
+            sessions = self.worker.sessions
+            sessions[session_id] = None
+            sessions.move_to_end(session_id)
+            while len(sessions) > AFFINITY_SESSIONS:
+                sessions.popitem(last=False)
+
+
+class _RemoteDraft:
+    def __init__(self, worker: ModelWorker):
+        self.worker = worker
+
+    def snapshot(self) -> Optional[Dict[str, Any]]:
+        return self.worker.speculation
+
+
+class WorkerLease:
+    """A worker checked out for one job, shaped like the model pool's `PooledModel` where the server needs it."""
+
+    def __init__(self, worker: ModelWorker, name: str, path: str):
+        self.worker = worker
+        self.name = name
+        self.path = path
+        self.n_ctx = worker.loaded[1]
+        self.options = worker.load_info.get("options", {})
+        self.load_seconds = worker.load_info.get("load_seconds", 0.0)
+        self.llm = RemoteLlama(worker)
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}@{self.n_ctx}#worker{self.worker.index}"
+
+
+class WorkerPool:
+    """
+    `n_workers` model worker processes, each with its own `Llama` over the same GGUF file
+    (mmapped, so the weights are shared through the page cache) and an equal share of the cores.
+    A job goes to a free worker, preferring one that already holds the session's prompt state,
+    then one with the model loaded. A health check thread restarts workers that crash or stop answering.
+    `on_load` is called with the lease of each worker that loaded a model. `option_defaults(name)` gives load options
+    (e.g. tuned thread counts, capped at each worker's share of the cores) that options given for the model override.
+    """
+
+    def __init__(self, models_dir, n_workers: int, n_threads: Optional[int] = None, llama_factory: Optional[Callable] = None,
+                 on_load: Optional[Callable[[WorkerLease], None]] = None, health_interval: float = HEALTH_INTERVAL,
+                 option_defaults: Optional[Callable[[str], Dict[str, Any]]] = None):
+        self.models_dir = models_dir
+        self.option_defaults = option_defaults
+        self.n_threads = n_threads or max((os.cpu_count() or 2) // 2 // n_workers, 1)
+        self.llama_factory = llama_factory
+        self.on_load = on_load
+        self.health_interval = health_interval
+        self.workers = [ModelWorker(i, self.n_threads, llama_factory) for i in range(n_workers)]
+        self._options: Dict[str, Dict[str, Any]] = {}
+        self._free = threading.Condition()
+        self._stopped = threading.Event()
+
+    def start(self):
+        for worker in self.workers:
+            worker.llama_factory = self.llama_factory
+            worker.start()
+        threading.Thread(target=self._health_loop, name="model-worker-health", daemon=True).start()
+
+    def shutdown(self):
+        self._stopped.set()
+        for worker in self.workers:
+            worker.stop()
+
+    def checkout(self, name: str, n_ctx: int, session_id: Optional[str] = None, options: Optional[Dict[str, Any]] = None) -> WorkerLease:
+        """A free worker with `name` loaded with at least `n_ctx` context, waiting for one to free up. Blocking."""
+        with self._free:
+            while True:
+                free = [w for w in self.workers if w.alive and not w.leased]
+                if free:
+                    break
+                self._free.wait()
+            worker = max(free, key=lambda w: (
+                session_id is not None and session_id in w.sessions,
+                self._fits(w, name, n_ctx, options),
+                -w.last_used,
+            ))
+            worker.leased = True
+        try:
+            return self._load(worker, name, n_ctx, options)
+        except BaseException:
+            self._release(worker)
+            raise
+
+    def checkin(self, lease: WorkerLease):
+        self._release(lease.worker)
+
+    def preload(self, name: str, n_ctx: int, options: Optional[Dict[str, Any]] = None) -> WorkerLease:
+        """Load `name` in every worker, so any of them can take the next job. Returns the slowest worker's (released) lease."""
+
+        def load(worker: ModelWorker) -> WorkerLease:
+            with self._free:
+                while worker.leased or not worker.alive:
+                    self._free.wait()
+                worker.leased = True
+            try:
+                return self._load(worker, name, n_ctx, options)
+            finally:
+                self._release(worker)
+
+        with concurrent.futures.ThreadPoolExecutor(len(self.workers)) as executor:
+            leases = list(executor.map(load, self.workers))
+        return max(leases, key=lambda lease: lease.load_seconds)
+
+    def unload(self, name: str):
+        """Drop `name` from every worker that isn't generating with it."""
+        for worker in self.workers:
+            with self._free:
+                if worker.leased or not worker.loaded or worker.loaded[0] != name:
+                    continue
+                worker.leased = True
+            try:
+                worker.call("unload")
+                worker.loaded, worker.load_info = None, {}
+                worker.sessions.clear()
+            except (RuntimeError, WorkerCrashed) as e:
+                print(f"Could not unload {name} from model worker {worker.index}: {e}")
+            finally:
+                self._release(worker)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"workers": [w.info() for w in self.workers]}
+
+    def _fits(self, worker: ModelWorker, name: str, n_ctx: int, options: Optional[Dict[str, Any]]) -> bool:
+        if worker.loaded is None:
+            return False
+        loaded_name, loaded_n_ctx, loaded_options = worker.loaded
+        if options is not None and loaded_options != tuple(sorted(self._wanted(name, options).items())):
+            return False
+        return loaded_name == name and loaded_n_ctx >= n_ctx
+
+    def _load(self, worker: ModelWorker, name: str, n_ctx: int, options: Optional[Dict[str, Any]]) -> WorkerLease:
+        path = os.path.join(self.models_dir, name)
+        if self._fits(worker, name, n_ctx, options):
+            return WorkerLease(worker, name, path)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Model file '{name}' not found.")
+        wanted = (self._options.get(name) or self._wanted(name, {})) if options is None else self._wanted(name, options)
+        worker.load_info = worker.call("load", path=path, n_ctx=n_ctx, options=wanted)
+        worker.loaded = (name, n_ctx, tuple(sorted(wanted.items())))
+        # Remembered only once they loaded, so a failed load (e.g. a bad draft model) doesn't stick
+        self._options[name] = wanted
+        worker.sessions.clear()
+        lease = WorkerLease(worker, name, path)
+        if self.on_load is not None:
+            self.on_load(lease)
+        return lease
+
+    def _wanted(self, name: str, options: Dict[str, Any]) -> Dict[str, Any]:
+        tuned = self.option_defaults(name) if self.option_defaults is not None else {}
+        # Tuned for the whole host; each worker only gets its share of the cores
+        tuned = {k: min(v, self.n_threads) if k in ("n_threads", "n_threads_batch") else v for k, v in tuned.items()}
+        return {**tuned, **options}
+
+    def _release(self, worker: ModelWorker):
+        with self._free:
+            worker.leased = False
+            worker.last_used = time.monotonic()
+            self._free.notify_all()
+
+    def _health_loop(self):
+        while not self._stopped.wait(self.health_interval):
+            for worker in self.workers:
+                hung = worker.alive and time.monotonic() - worker.last_pong > PING_TIMEOUT
+                if worker.alive and worker.process.is_alive() and not hung:
+                    try:
+                        worker.ping()
+                    except WorkerCrashed:
+                        pass
+                    continue
+                print(f"Model worker {worker.index} {'stopped responding' if hung else 'crashed'}; restarting it.")
+                worker.restart()
+                with self._free:
+                    self._free.notify_all()
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import diskcache
+
+import database
+
+RESPONSE_CACHE_DIR = database.APP_DIR / "response_cache"
+# Opt-in: with it on, asking a greedy (temperature 0) chat the same thing again replays the stored answer
+RESPONSE_CACHE_ENABLED = os.environ.get("CHAT_RESPONSE_CACHE", "").lower() in ("1", "true", "yes")
+RAM_BUDGET_BYTES = 32 << 20
+DISK_BUDGET_BYTES = 512 << 20
+
+
+def is_deterministic(temperature: Optional[float]) -> bool:
+    """llama.cpp samples greedily at temperature <= 0; at any other temperature it draws from a fresh random seed."""
+    return temperature is not None and temperature <= 0
+
+
+def response_key(model_name: str, model_mtime_ns: int, messages: List[Dict[str, str]], sampling: Dict[str, Any]) -> str:
+    """Hash of everything that decides a greedy reply: the model file, the rendered messages and the sampling parameters."""
+    payload = json.dumps([model_name, model_mtime_ns, messages, sampling], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _size(tokens: List[str]) -> int:
+    return sum(len(t) for t in tokens) + 64 * len(tokens)
+
+
+class ResponseCache:
+    """
+    Replies (the model's raw token chunks, so a replay frames them exactly like the original stream)
+    by `response_key`. The most recently used stay in RAM up to `ram_budget` bytes; every reply is also
+    written to a size-bounded diskcache store, so they survive restarts. Blocking on a disk hit or write.
+    """
+
+    def __init__(self, directory=RESPONSE_CACHE_DIR, enabled: bool = RESPONSE_CACHE_ENABLED,
+                 ram_budget: int = RAM_BUDGET_BYTES, disk_budget: int = DISK_BUDGET_BYTES):
+        self.enabled = enabled
+        self.ram_budget = ram_budget
+        self._ram: "OrderedDict[str, List[str]]" = OrderedDict()
+        self._ram_bytes = 0
+        # Nothing is created on disk unless the cache is switched on
+        self._disk = diskcache.Cache(str(directory), size_limit=disk_budget, eviction_policy="least-recently-used") if enabled else None
+        self._lock = threading.Lock()
+        self.hits = {"ram": 0, "disk": 0}
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[List[str]]:
+        with self._lock:
+            if key in self._ram:
+                self._ram.move_to_end(key)
+                self.hits["ram"] += 1
+                return self._ram[key]
+        tokens = self._disk.get(key) if self._disk is not None else None
+        if tokens is None:
+            self.misses += 1
+            return None
+        self.hits["disk"] += 1
+        self._put_ram(key, tokens)
+        return tokens
+
+    def put(self, key: str, tokens: List[str]):
+        if self._disk is not None:
+            self._disk.set(key, tokens)
+        self._put_ram(key, tokens)
+
+    def clear(self):
+        with self._lock:
+            self._ram.clear()
+            self._ram_bytes = 0
+        if self._disk is not None:
+            self._disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            ram_entries, ram_bytes = len(self._ram), self._ram_bytes
+        return {
+            "enabled": self.enabled,
+            "ram_entries": ram_entries,
+            "ram_bytes": ram_bytes,
+            "disk_entries": len(self._disk) if self._disk is not None else 0,
+            "disk_bytes": self._disk.volume() if self._disk is not None else 0,
+            "hits": dict(self.hits),
+            "misses": self.misses,
+        }
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+
+    def _put_ram(self, key: str, tokens: List[str]):
+        with self._lock:
+            if key in self._ram:
+                self._ram_bytes -= _size(self._ram.pop(key))
+            self._ram[key] = tokens
+            self._ram_bytes += _size(tokens)
+            while self._ram_bytes > self.ram_budget and len(self._ram) > 1:
+                _, old_tokens = self._ram.popitem(last=False)
+                self._ram_bytes -= _size(old_tokens)
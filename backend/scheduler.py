@@ -0,0 +1,176 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, List, Optional
+
+# Lower value = served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+# Idle jobs only use the model when nothing else wants it and are preempted by anything more urgent
+PRIORITY_IDLE = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background", PRIORITY_IDLE: "idle"}
+
+
+class GenerationCancelled(Exception):
+    """Raised when a job is cancelled before it got access to the model."""
+
+
+class GenerationJob:
+    def __init__(self, session_id: str, priority: int):
+        self.session_id = session_id
+        self.priority = priority
+        # Polled by the generation thread between tokens
+        self.cancel_event = threading.Event()
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.granted: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    @property
+    def wait_time(self) -> float:
+        return (self.started_at or time.monotonic()) - self.enqueued_at
+
+
+class GenerationScheduler:
+    """
+    Serializes access to the model: at most `slots` jobs run at once (one per model worker process, or one in-process).
+    Jobs are served by priority, then round-robin across sessions, then FIFO within a session,
+    so one chatty session cannot starve the others and title generation never delays a chat.
+    All methods must be called from the event loop thread.
+    """
+
+    def __init__(self, wait_history: int = 100, slots: int = 1):
+        # priority -> session_id -> queued jobs; session order is the round-robin order
+        self._queues: Dict[int, "OrderedDict[str, Deque[GenerationJob]]"] = {}
+        self.slots = slots
+        self.running: List[GenerationJob] = []
+        self._wait_times: Deque[float] = deque(maxlen=wait_history)
+        self.completed = 0
+        self.cancelled = 0
+        self.preempted = 0
+
+    def submit(self, session_id: str, priority: int = PRIORITY_INTERACTIVE) -> GenerationJob:
+        job = GenerationJob(session_id, priority)
+        self._queues.setdefault(priority, OrderedDict()).setdefault(session_id, deque()).append(job)
+        if priority < PRIORITY_IDLE:
+            idle = [r for r in self.running if r.priority >= PRIORITY_IDLE]
+            # Take a slot back from an idle job: the one holding this session, else any when every slot is busy
+            victim = next((r for r in idle if r.session_id == session_id), None)
+            if victim is None and len(self.running) >= self.slots and idle and not any(r.cancelled for r in idle):
+                victim = idle[0]
+            if victim is not None and not victim.cancelled:
+                victim.cancel_event.set()
+                self.preempted += 1
+        self._dispatch()
+        return job
+
+    @asynccontextmanager
+    async def acquire(self, job: GenerationJob):
+        """Wait until `job` owns the model and release it on exit, whatever happens."""
+        try:
+            await job.granted
+            yield job
+        finally:
+            self.release(job)
+
+    def release(self, job: GenerationJob):
+        if job in self.running:
+            self.running.remove(job)
+            self.completed += 1
+        else:
+            self._remove_queued(job)
+        self._dispatch()
+
+    def cancel_job(self, job: GenerationJob):
+        if job.cancelled:
+            return
+        job.cancel_event.set()
+        self.cancelled += 1
+        if self._remove_queued(job) and not job.granted.done():
+            job.granted.set_exception(GenerationCancelled())
+
+    def cancel_session(self, session_id: str) -> int:
+        """Cancel the running and all queued jobs of a session. Returns how many were cancelled."""
+        targets = [job for by_session in self._queues.values() for job in by_session.get(session_id, ())]
+        targets += [job for job in self.running if job.session_id == session_id]
+        for job in targets:
+            self.cancel_job(job)
+        return len(targets)
+
+    def queue_depth(self) -> int:
+        return sum(len(q) for by_session in self._queues.values() for q in by_session.values())
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        queued = [job for by_session in self._queues.values() for q in by_session.values() for job in q]
+        waits = list(self._wait_times)
+        running = [
+            {
+                "session_id": job.session_id,
+                "priority": PRIORITY_NAMES.get(job.priority, job.priority),
+                "running_seconds": round(now - job.started_at, 3),
+            }
+            for job in self.running
+        ]
+        return {
+            "slots": self.slots,
+            "running": running,
+            "queue_depth": len(queued),
+            "queued_by_priority": {
+                PRIORITY_NAMES.get(p, p): sum(len(q) for q in by_session.values()) for p, by_session in self._queues.items()
+            },
+            "oldest_wait_seconds": round(max((now - job.enqueued_at for job in queued), default=0.0), 3),
+            "avg_wait_seconds": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            "max_wait_seconds": round(max(waits), 3) if waits else 0.0,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "preempted": self.preempted,
+        }
+
+    def _remove_queued(self, job: GenerationJob) -> bool:
+        by_session = self._queues.get(job.priority)
+        if not by_session or job.session_id not in by_session:
+            return False
+        queue = by_session[job.session_id]
+        try:
+            queue.remove(job)
+        except ValueError:
+            return False
+        if not queue:
+            del by_session[job.session_id]
+        return True
+
+    def _dispatch(self):
+        while len(self.running) < self.slots:
+            job = self._pop_next()
+            if job is None:
+                return
+            if job.granted.done():
+                # The waiting task went away before it was granted the model
+                continue
+            job.started_at = time.monotonic()
+            self._wait_times.append(job.wait_time)
+            self.running.append(job)
+            job.granted.set_result(None)
+
+    def _pop_next(self) -> Optional[GenerationJob]:
+        busy = {job.session_id for job in self.running}
+        for priority in sorted(self._queues):
+            by_session = self._queues[priority]
+            # A session's jobs run one at a time and in order, even when other slots are free
+            session_id = next((s for s in by_session if s not in busy), None)
+            if session_id is None:
+                continue
+            queue = by_session[session_id]
+            job = queue.popleft()
+            if queue:
+                by_session.move_to_end(session_id)
+            else:
+                del by_session[session_id]
+            return job
+        return None
@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+if TYPE_CHECKING:
+    import numpy as np
+
+import database
+
+# GGUF embedding model (a filename in MODELS_DIR); semantic search is off without one
+EMBEDDING_MODEL = os.environ.get("CHAT_EMBEDDING_MODEL")
+EMBEDDING_N_CTX = 512
+EMBED_BATCH = 16
+# Longer messages are embedded by their opening, which is what the context window would truncate to anyway
+EMBED_MAX_CHARS = 4000
+# Rows scored per matrix product, so a query never materializes more than this many scores at once
+SEARCH_BLOCK_ROWS = 1 << 16
+
+INDEX_VECTORS = "embeddings.f32"
+INDEX_IDS = "embeddings.ids"
+INDEX_META = "embeddings.json"
+
+
+class SemanticIndexUnavailable(Exception):
+    pass
+
+
+class SemanticIndex:
+    """
+    Message embeddings in an append-only float32 matrix (`embeddings.f32`, one L2-normalized row per message)
+    with the matching message ids in `embeddings.ids`, next to chat_history.db.
+    Both files are memory-mapped for queries, so cosine top-k is one NumPy product per block of rows.
+    Rows are appended in id order, so the last indexed id is where catching up resumes.
+    Vectors are written before their ids; a crash between the two leaves only unreferenced rows, trimmed on open.
+    """
+
+    def __init__(self, models_dir, model_name: Optional[str] = EMBEDDING_MODEL, directory=database.APP_DIR):
+        self.models_dir = models_dir
+        self.model_name = model_name
+        self.vectors_path = os.path.join(directory, INDEX_VECTORS)
+        self.ids_path = os.path.join(directory, INDEX_IDS)
+        self.meta_path = os.path.join(directory, INDEX_META)
+        self.dim: Optional[int] = None
+        self._llm = None
+        self._load_lock = threading.Lock()
+        # llama_cpp contexts aren't thread-safe; queries and indexing share the one embedding model
+        self._embed_lock = threading.Lock()
+        self._open()
+
+    @property
+    def available(self) -> bool:
+        return bool(self.model_name) and os.path.exists(os.path.join(self.models_dir, self.model_name))
+
+    def count(self) -> int:
+        try:
+            return os.path.getsize(self.ids_path) // 8
+        except FileNotFoundError:
+            return 0
+
+    def last_id(self) -> int:
+        import numpy as np
+
+        n = self.count()
+        if n == 0:
+            return 0
+        return int(np.memmap(self.ids_path, dtype=np.int64, mode="r", offset=(n - 1) * 8, shape=(1,))[0])
+
+    def embed(self, texts: List[str]) -> "np.ndarray":
+        """L2-normalized float32 embeddings, one row per text. Blocking."""
+        # Imported on first use, like the embedding model, to keep it off the server's startup path
+        import numpy as np
+
+        llm = self._model()
+        with self._embed_lock:
+            vectors = np.asarray(llm.embed([t[:EMBED_MAX_CHARS] for t in texts], normalize=False, truncate=True), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def index_pending(self, batch: int = EMBED_BATCH) -> int:
+        """Embed and append the next batch of messages not indexed yet. Returns how many were added. Blocking."""
+        import numpy as np
+
+        messages = database.get_messages_after(self.last_id(), batch)
+        if not messages:
+            return 0
+        vectors = self.embed([m["content"] for m in messages])
+        self._append(np.array([m["id"] for m in messages], dtype=np.int64), vectors)
+        return len(messages)
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Messages closest in meaning to `query`, best first, with their cosine similarity. Blocking."""
+        import numpy as np
+
+        n = self.count()
+        if n == 0:
+            return []
+        q = self.embed([query])[0]
+        matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(n, self.dim))
+        # Deleted messages keep their rows, so take extra candidates to fill the page after dropping them
+        k = min(limit * 2, n)
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, n, SEARCH_BLOCK_ROWS):
+            scores = matrix[start:start + SEARCH_BLOCK_ROWS] @ q
+            top = np.argpartition(scores, -min(k, len(scores)))[-k:]
+            best_rows = np.concatenate([best_rows, top + start])
+            best_scores = np.concatenate([best_scores, scores[top]])
+            if len(best_rows) > k:
+                keep = np.argpartition(best_scores, -k)[-k:]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+        order = np.argsort(-best_scores)
+        ids = np.memmap(self.ids_path, dtype=np.int64, mode="r", shape=(n,))[best_rows[order]]
+        scores = {int(i): float(s) for i, s in zip(ids, best_scores[order])}
+        rows = database.get_messages_by_ids(list(scores))
+        for row in rows:
+            row["score"] = scores[row["message_id"]]
+        return sorted(rows, key=lambda r: r["score"], reverse=True)[:limit]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name, "available": self.available, "dim": self.dim, "vectors": self.count()}
+
+    def _model(self):
+        if not self.available:
+            raise SemanticIndexUnavailable("No embedding model configured; set CHAT_EMBEDDING_MODEL to a GGUF file in the models folder.")
+        with self._load_lock:
+            if self._llm is None:
+                from llama_cpp import Llama
+
+                self._llm = Llama(
+                    model_path=os.path.join(self.models_dir, self.model_name),
+                    embedding=True, n_ctx=EMBEDDING_N_CTX, n_gpu_layers=0, verbose=False,
+                )
+            return self._llm
+
+    def _open(self):
+        try:
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+        if not self.model_name:
+            return
+        if meta.get("model_name") != self.model_name or not all(map(os.path.exists, (self.vectors_path, self.ids_path))):
+            # Vectors from another model live in a different space; start over
+            self._reset()
+            return
+        self.dim = meta.get("dim")
+        if not self.dim:
+            return
+        n = min(os.path.getsize(self.vectors_path) // (4 * self.dim), self.count())
+        for path, row_bytes in ((self.vectors_path, 4 * self.dim), (self.ids_path, 8)):
+            with open(path, "r+b") as f:
+                f.truncate(n * row_bytes)
+
+    def _reset(self):
+        for path in (self.vectors_path, self.ids_path):
+            with open(path, "wb"):
+                pass
+        self.dim = None
+        self._write_meta()
+
+    def _write_meta(self):
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"model_name": self.model_name, "dim": self.dim}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def _append(self, ids: "np.ndarray", vectors: "np.ndarray"):
+        import numpy as np
+
+        if self.dim is None:
+            self.dim = int(vectors.shape[1])
+            self._write_meta()
+        with open(self.vectors_path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self.ids_path, "ab") as f:
+            f.write(ids.tobytes())
@@ -0,0 +1,123 @@
+import os
+from typing import Any, Dict, Optional
+
+# `draft_model` load option: this value drafts from n-grams already in the prompt; anything else names a small GGUF in MODELS_DIR
+PROMPT_LOOKUP = "prompt_lookup"
+# Tokens proposed per step, unless the load asks for `draft_tokens`; a draft model is wrong sooner than a verbatim quote
+DEFAULT_PROMPT_LOOKUP_TOKENS = 10
+DEFAULT_DRAFT_MODEL_TOKENS = 5
+PROMPT_LOOKUP_NGRAM = 2
+
+
+class GGUFDraft:
+    """
+    A small model that shares the main model's vocabulary, drafting greedily. It keeps its own context,
+    and llama_cpp reuses the longest matching prefix, so each step only evaluates the tokens accepted since the last one.
+    """
+
+    def __init__(self, path: str, n_ctx: int, num_pred_tokens: int, n_threads: Optional[int] = None):
+        from llama_cpp import Llama
+
+        options = {"n_threads": n_threads} if n_threads else {}
+        self.llm = Llama(model_path=path, n_ctx=n_ctx, n_gpu_layers=0, verbose=False, **options)
+        self.num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids, /, **kwargs):
+        import numpy as np
+
+        drafted = []
+        for token in self.llm.generate(input_ids.tolist(), temp=0.0):
+            drafted.append(token)
+            if len(drafted) >= self.num_pred_tokens:
+                break
+        return np.array(drafted, dtype=np.intc)
+
+    def close(self):
+        self.llm.close()
+
+
+class CountingDraft:
+    """
+    Wraps a llama_cpp draft model and counts how many of its tokens the main model accepted.
+    llama_cpp asks for a draft after every verification step with the whole context so far, so the
+    tokens it kept since the previous step are the previous draft's accepted ones plus one it sampled itself.
+    The last step of a reply is never verified against a next call, so it isn't counted.
+    """
+
+    def __init__(self, draft, kind: str):
+        self.draft = draft
+        self.kind = kind
+        self.reset()
+
+    def reset(self):
+        self.drafted = 0
+        self.accepted = 0
+        self._last_length: Optional[int] = None
+        self._last_drafted = 0
+
+    def __call__(self, input_ids, /, **kwargs):
+        length = len(input_ids)
+        if self._last_length is not None and length > self._last_length:
+            self.drafted += self._last_drafted
+            self.accepted += min(length - self._last_length - 1, self._last_drafted)
+        proposal = self.draft(input_ids, **kwargs)
+        self._last_length, self._last_drafted = length, len(proposal)
+        return proposal
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"kind": self.kind, "drafted": self.drafted, "accepted": self.accepted}
+
+    def close(self):
+        if hasattr(self.draft, "close"):
+            self.draft.close()
+
+
+def draft_path(models_dir, options: Dict[str, Any]) -> Optional[str]:
+    """The draft GGUF named by the load options, if any."""
+    draft = options.get("draft_model")
+    if not draft or draft == PROMPT_LOOKUP:
+        return None
+    return os.path.join(models_dir, draft)
+
+
+def llama_kwargs(models_dir, n_ctx: int, options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The `Llama` keyword arguments for a model's load options: `draft_model` and `draft_tokens`
+    become a llama_cpp draft model, the rest pass through. Options themselves stay plain values,
+    so they can be compared, remembered for reloads and sent to model worker processes.
+    """
+    kwargs = {k: v for k, v in options.items() if k not in ("draft_model", "draft_tokens")}
+    draft = options.get("draft_model")
+    if not draft:
+        return kwargs
+    if draft == PROMPT_LOOKUP:
+        from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+
+        n = options.get("draft_tokens") or DEFAULT_PROMPT_LOOKUP_TOKENS
+        kwargs["draft_model"] = CountingDraft(LlamaPromptLookupDecoding(max_ngram_size=PROMPT_LOOKUP_NGRAM, num_pred_tokens=n), PROMPT_LOOKUP)
+    else:
+        path = draft_path(models_dir, options)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Draft model file '{draft}' not found.")
+        n = options.get("draft_tokens") or DEFAULT_DRAFT_MODEL_TOKENS
+        kwargs["draft_model"] = CountingDraft(GGUFDraft(path, n_ctx, n, options.get("n_threads")), "model")
+    return kwargs
+
+
+def reset(llm):
+    """Start counting for a new reply."""
+    draft = getattr(llm, "draft_model", None)
+    if isinstance(draft, CountingDraft):
+        draft.reset()
+
+
+def results(llm) -> Optional[Dict[str, Any]]:
+    """What the draft proposed and the model accepted since `reset`, or None when the model doesn't speculate."""
+    draft = getattr(llm, "draft_model", None)
+    return draft.snapshot() if draft is not None and hasattr(draft, "snapshot") else None
+
+
+def close(llm):
+    draft = getattr(llm, "draft_model", None)
+    if isinstance(draft, CountingDraft):
+        draft.close()
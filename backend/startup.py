@@ -0,0 +1,88 @@
+import builtins
+import importlib.util
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+# Time every module the server imports and print the slowest at startup (like `python -X importtime`, which a frozen app can't take)
+PROFILE_IMPORTS = os.environ.get("CHAT_PROFILE_IMPORTS", "").lower() in ("1", "true", "yes")
+REPORT_TOP = 15
+
+
+class ImportProfiler:
+    """Wraps `__import__` while active. Cumulative time includes a module's own imports; self time excludes them."""
+
+    def __init__(self):
+        self.modules: Dict[str, Dict[str, float]] = {}
+        self._stack: List[float] = []
+        self._original = None
+
+    def start(self):
+        self._original = builtins.__import__
+        builtins.__import__ = self._import
+
+    def stop(self):
+        if self._original is not None:
+            builtins.__import__ = self._original
+            self._original = None
+
+    def slowest(self, top: int = REPORT_TOP) -> List[Dict[str, Any]]:
+        ranked = sorted(self.modules.items(), key=lambda item: item[1]["self"], reverse=True)[:top]
+        return [{"module": name, "self_ms": round(t["self"] * 1000, 1), "cumulative_ms": round(t["cumulative"] * 1000, 1)} for name, t in ranked]
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level == 0 and name in sys.modules:
+            return self._original(name, globals, locals, fromlist, level)
+        started = time.perf_counter()
+        self._stack.append(0.0)
+        try:
+            return self._original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - started
+            children = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            entry = self.modules.setdefault(_absolute_name(name, globals, level), {"self": 0.0, "cumulative": 0.0})
+            entry["self"] += elapsed - children
+            entry["cumulative"] += elapsed
+
+
+def _absolute_name(name: str, globals, level: int) -> str:
+    if level == 0:
+        return name
+    try:
+        return importlib.util.resolve_name("." * level + name, (globals or {}).get("__package__") or "")
+    except (ImportError, ValueError):
+        return name
+
+
+class StartupReport:
+    """How long the server took to import and to start answering, and the import profile when enabled."""
+
+    def __init__(self, profile: bool = PROFILE_IMPORTS):
+        self.started = time.perf_counter()
+        self.imports_seconds: Optional[float] = None
+        self.ready_seconds: Optional[float] = None
+        self.profiler = ImportProfiler() if profile else None
+        if self.profiler is not None:
+            self.profiler.start()
+
+    def imports_done(self):
+        self.imports_seconds = time.perf_counter() - self.started
+        if self.profiler is not None:
+            self.profiler.stop()
+
+    def ready(self):
+        self.ready_seconds = time.perf_counter() - self.started
+        print(f"Server ready in {self.ready_seconds * 1000:.0f} ms (imports {self.imports_seconds * 1000:.0f} ms)")
+        if self.profiler is not None:
+            for entry in self.profiler.slowest():
+                print(f"  import {entry['module']}: {entry['self_ms']} ms self, {entry['cumulative_ms']} ms cumulative")
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "imports_ms": None if self.imports_seconds is None else round(self.imports_seconds * 1000, 1),
+            "ready_ms": None if self.ready_seconds is None else round(self.ready_seconds * 1000, 1),
+            "slowest_imports": self.profiler.slowest() if self.profiler is not None else None,
+        }
@@ -0,0 +1,59 @@
+from typing import Any, Dict, List, Optional
+
+import context_window
+import database
+import titler
+
+# Share of the history budget kept as raw recent turns; older turns are folded into the summary
+SUMMARY_KEEP_RATIO = 0.5
+# Don't bother re-summarizing until at least this much older history has piled up
+SUMMARY_MIN_CHUNK_TOKENS = 512
+SUMMARY_MAX_CHUNK_TOKENS = 2048
+SUMMARY_MAX_TOKENS = 384
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and an AI assistant. "
+    "Merge the new messages into the existing summary. Keep facts, decisions, names, numbers, code identifiers "
+    "and open questions; drop pleasantries. Reply with the updated summary only, in at most a few short paragraphs."
+)
+
+
+def plan_update(llm, token_model: str, session_id: str, n_ctx: int, max_tokens: int) -> Optional[Dict[str, Any]]:
+    """
+    Decide whether the older part of a session has grown enough to fold into its summary.
+    Returns {"summary": previous summary row or None, "messages": messages to fold} or None. Blocking.
+    """
+    context_window.fill_token_counts(llm, token_model, session_id)
+    keep_budget = int(context_window.history_budget(n_ctx, max_tokens) * SUMMARY_KEEP_RATIO)
+    recent = database.get_recent_messages_within(session_id, keep_budget, context_window.MESSAGE_OVERHEAD_TOKENS)
+    if not recent:
+        return None
+    summary = database.get_latest_summary(session_id)
+    after_id = summary["end_message_id"] if summary else 0
+    # The prompt carries the previous summary, the chunk and the reply, so the chunk gets what is left
+    chunk_budget = min(SUMMARY_MAX_CHUNK_TOKENS, n_ctx - 2 * SUMMARY_MAX_TOKENS - context_window.PROMPT_OVERHEAD_TOKENS)
+    if chunk_budget < SUMMARY_MIN_CHUNK_TOKENS:
+        return None
+    messages = database.get_messages_between(session_id, after_id, recent[0]["id"], chunk_budget)
+    if messages and (messages[0]["token_count"] or 0) > chunk_budget:
+        # A single message bigger than the chunk (e.g. a large paste): fold in its head, so the prompt
+        # still fits the context and the summary moves past it instead of failing on every turn
+        messages[0]["content"], messages[0]["token_count"] = titler.clip(llm, messages[0]["content"], chunk_budget)
+    if sum(m["token_count"] or 0 for m in messages) < SUMMARY_MIN_CHUNK_TOKENS:
+        return None
+    return {"summary": summary, "messages": messages}
+
+
+def build_prompt(plan: Dict[str, Any]) -> List[Dict[str, str]]:
+    previous = plan["summary"]["content"] if plan["summary"] else "(none yet)"
+    transcript = "\n".join(f"{m['role'].title()}: {m['content']}" for m in plan["messages"])
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+        {"role": "user", "content": f"Existing summary:\n{previous}\n\nNew messages:\n{transcript}\n\nUpdated summary:"},
+    ]
+
+
+def store(session_id: str, plan: Dict[str, Any], content: str) -> int:
+    """The new summary covers everything the previous one did plus the folded messages."""
+    start_id = plan["summary"]["start_message_id"] if plan["summary"] else plan["messages"][0]["id"]
+    return database.add_summary(session_id, start_id, plan["messages"][-1]["id"], content)
@@ -0,0 +1,66 @@
+from typing import List, Tuple
+
+OPEN_TAGS = ("<think>", "<thinking>")
+CLOSE_TAGS = ("</think>", "</thinking>")
+
+THOUGHT = "thought"
+CONTENT = "content"
+
+
+class ThinkingStreamParser:
+    """
+    Splits a token stream into reasoning and answer text as it arrives.
+    Each token is scanned once; only a possible partial tag at the end of a token (at most a few
+    characters) is held back until the next one, so tags split across tokens are still recognized
+    and the whole response costs O(n). The tags themselves are dropped from both outputs.
+    """
+
+    def __init__(self):
+        self.in_thinking = False
+        self._pending = ""
+        self._parts = {THOUGHT: [], CONTENT: []}
+
+    @property
+    def thinking(self) -> str:
+        return "".join(self._parts[THOUGHT])
+
+    @property
+    def content(self) -> str:
+        return "".join(self._parts[CONTENT])
+
+    def feed(self, token: str) -> List[Tuple[str, str]]:
+        """Returns the (kind, text) segments that can be emitted after this token."""
+        text = self._pending + token
+        self._pending = ""
+        segments = []
+        start = 0
+        pos = text.find("<")
+        while pos != -1:
+            tags = CLOSE_TAGS if self.in_thinking else OPEN_TAGS
+            rest = text[pos:pos + max(map(len, tags))]
+            tag = next((t for t in tags if rest.startswith(t)), None)
+            if tag is not None:
+                self._emit(segments, text[start:pos])
+                self.in_thinking = not self.in_thinking
+                start = pos + len(tag)
+            elif len(rest) < max(map(len, tags)) and any(t.startswith(rest) for t in tags) and pos + len(rest) == len(text):
+                # Could be the first half of a tag; decide once the next token arrives
+                self._emit(segments, text[start:pos])
+                self._pending = text[pos:]
+                return segments
+            pos = text.find("<", max(pos + 1, start))
+        self._emit(segments, text[start:])
+        return segments
+
+    def finish(self) -> List[Tuple[str, str]]:
+        """Flush a held-back partial tag at the end of the stream as plain text."""
+        segments = []
+        self._emit(segments, self._pending)
+        self._pending = ""
+        return segments
+
+    def _emit(self, segments: List[Tuple[str, str]], text: str):
+        if text:
+            kind = THOUGHT if self.in_thinking else CONTENT
+            self._parts[kind].append(text)
+            segments.append((kind, text))
@@ -0,0 +1,50 @@
+from typing import List, Optional, Tuple
+
+import database
+
+# The title comes from the opening of the conversation; this bounds the prefill however long the chat gets
+TITLE_CONTEXT_TOKENS = 384
+# No single message (e.g. a pasted file) may take more than this share of the context
+TITLE_MESSAGE_TOKENS = 160
+TITLE_MAX_MESSAGES = 6
+TITLE_MAX_TOKENS = 20
+TITLE_MAX_CHARS = 80
+# Sessions still carrying this title get one generated after their first exchange
+DEFAULT_TITLE = "New Chat"
+
+
+def clip(llm, text: str, max_tokens: int) -> Tuple[str, int]:
+    """`text` cut to at most `max_tokens` tokens, and its token count."""
+    # Tokens rarely span more than a few characters, so a huge paste is never tokenized whole
+    head = text[:max_tokens * 16]
+    tokens = llm.tokenize(head.encode("utf-8"), add_bos=False, special=True)
+    if len(tokens) <= max_tokens:
+        return head, len(tokens)
+    return llm.detokenize(tokens[:max_tokens]).decode("utf-8", errors="ignore") + " ...", max_tokens
+
+
+def build_prompt(llm, session_id: str) -> Optional[str]:
+    """
+    Title prompt over the session's first messages, at most TITLE_CONTEXT_TOKENS of them.
+    Returns None until the session has a reply to title. Blocking.
+    """
+    messages = database.get_first_messages(session_id, TITLE_MAX_MESSAGES)
+    if not any(m["role"] == "assistant" for m in messages):
+        return None
+    lines: List[str] = []
+    budget = TITLE_CONTEXT_TOKENS
+    for m in messages:
+        text, used = clip(llm, m["content"], min(TITLE_MESSAGE_TOKENS, budget))
+        budget -= used
+        lines.append(f"{m['role']}: {text}")
+        if budget <= 0:
+            break
+    context = "\n".join(lines)
+    return f"Based on this conversation, create a short, concise title (3-5 words):\n\n{context}\n\nTitle:"
+
+
+def clean(title: str) -> str:
+    title = title.strip().strip("\"'*#").strip()
+    if len(title) > TITLE_MAX_CHARS:
+        title = title[:TITLE_MAX_CHARS].rsplit(" ", 1)[0]
+    return title.rstrip(".:")
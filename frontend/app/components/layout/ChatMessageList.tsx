@@ -13,6 +13,7 @@ export interface Message {
   role: "user" | "assistant";
   content: string;
   thought?: string;
+  error?: string;
 }
 
 interface ChatMessageListProps {
@@ -197,6 +198,10 @@ export function ChatMessageList({ messages, isLoading, onRegenerate }: ChatMessa
                       <div dangerouslySetInnerHTML={{ __html: renderedHTML as string }} />
                     </div>
 
+                    {message.error && (
+                      <p className="mt-2 text-sm text-destructive">Reply failed: {message.error}</p>
+                    )}
+
                     {!isLoading && index === messages.length - 1 && (
                       <>
                         <Separator className="my-4" />
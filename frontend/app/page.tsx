@@ -101,6 +101,41 @@ export default function Home() {
   // eslint-disable-next-line react-hooks/exhaustive-deps
   }, []);
 
+  // Titles are generated in the background after a chat's first exchange and pushed over the event feed
+  useEffect(() => {
+    const controller = new AbortController();
+    const listen = async () => {
+      while (!controller.signal.aborted) {
+        try {
+          const response = await fetch("http://localhost:8000/api/v1/events", { signal: controller.signal });
+          if (!response.body) throw new Error("Event feed unavailable");
+          const reader = response.body.getReader();
+          const decoder = new TextDecoder();
+          let buffer = "";
+          while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop() ?? "";
+            for (const line of lines.filter(l => l)) {
+              const event = JSON.parse(line);
+              if (event.event === 'session_title') {
+                setSessions(prev => prev.map(s => s.id === event.session_id ? { ...s, title: event.title } : s));
+              }
+            }
+          }
+        } catch (error) {
+          if (controller.signal.aborted) return;
+        }
+        // Reconnect after the backend restarts
+        await new Promise(resolve => setTimeout(resolve, 3000));
+      }
+    };
+    listen();
+    return () => controller.abort();
+  }, []);
+
   useEffect(() => {
     if (activeChat) {
       setTemperature(activeChat.temperature);
@@ -137,7 +172,9 @@ export default function Home() {
         try {
           const response = await fetch(`http://localhost:8000/api/v1/sessions/${activeChatId}/messages`);
           if (!response.ok) throw new Error("Failed to fetch messages");
-          setActiveMessages(await response.json());
+          // Stored reasoning comes back as `reasoning`; the message list renders it as `thought`
+          const messages = await response.json();
+          setActiveMessages(messages.map((m: { reasoning?: string | null }) => ({ ...m, thought: m.reasoning ?? undefined })));
         } catch (error) {
           toast.error(`Could not load messages for this chat.`);
           setActiveMessages([]);
@@ -172,7 +209,26 @@ export default function Home() {
         method: "POST", headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ model_name: modelName }),
       });
-      if (!response.ok) throw new Error("Failed to load model");
+      if (!response.ok || !response.body) throw new Error("Failed to load model");
+
+      // The backend streams NDJSON status lines until the model is swapped in
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffered = "";
+      let loaded = false;
+      while (!loaded) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        // A line can be split across reads; keep the incomplete tail for the next one
+        const lines = (buffered + decoder.decode(value, { stream: true })).split('\n');
+        buffered = lines.pop() ?? "";
+        for (const line of lines.filter(s => s)) {
+          const json = JSON.parse(line);
+          if (json.status === 'error') throw new Error(json.message);
+          if (json.status === 'complete') loaded = true;
+        }
+      }
+      if (!loaded) throw new Error("Model loading was interrupted");
       setSelectedModel(modelName);
       toast.success(`Model "${modelName}" loaded successfully!`, { id: toastId });
       if (!activeChatId) { handleNewChat(); }
@@ -188,8 +244,7 @@ export default function Home() {
     if (!activeChatId) { toast.error("Please start a new chat first."); return; }
     
     setIsLoading(true);
-    const shouldGenerateTitle = activeMessages.length === 0 && !isRegeneration;
-    
+
     if (!isRegeneration) {
         setActiveMessages(prev => [...prev, { role: "user", content: prompt }]);
     }
@@ -197,7 +252,8 @@ export default function Home() {
     try {
       const response = await fetch("http://localhost:8000/api/v1/chat/stream", {
         method: "POST", headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ session_id: activeChatId, prompt }),
+        // Tokens arrive in batches every 30 ms rather than one line (and one re-render) each
+        body: JSON.stringify({ session_id: activeChatId, prompt, coalesce_ms: 30 }),
       });
       if (!response.body) throw new Error("Response body is null");
 
@@ -205,14 +261,18 @@ export default function Home() {
       
       const reader = response.body.getReader();
       const decoder = new TextDecoder();
+      let buffered = "";
       while (true) {
         const { value, done } = await reader.read();
         if (done) break;
-        const chunk = decoder.decode(value, { stream: true });
-        const jsonStrings = chunk.split('\n').filter(s => s);
+        // A line can be split across reads; keep the incomplete tail for the next one
+        const lines = (buffered + decoder.decode(value, { stream: true })).split('\n');
+        buffered = lines.pop() ?? "";
+        const jsonStrings = lines.filter(s => s);
         for (const jsonString of jsonStrings) {
           try {
             const json = JSON.parse(jsonString);
+            if (json.status === "error" || json.error) { toast.error(json.message || json.error); }
             setActiveMessages(prev => {
                 const lastMsg = prev[prev.length - 1];
                 if (!lastMsg) return prev;
@@ -223,20 +283,16 @@ export default function Home() {
                 if (json.token) {
                     updatedLastMsg.content += json.token;
                 }
+                if (json.status === "error" || json.error) {
+                    // The reply stopped early: keep what arrived, but flag it rather than show it as complete
+                    updatedLastMsg.error = json.message || json.error;
+                }
                 return [...prev.slice(0, -1), updatedLastMsg];
             });
           } catch (e) { console.error("Failed to parse JSON chunk:", jsonString); }
         }
       }
       
-      if (shouldGenerateTitle) {
-        await fetch("http://localhost:8000/api/v1/generate-title", {
-            method: "POST", headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ session_id: activeChatId }),
-        });
-        await fetchSessions();
-      }
-
     } catch (error) {
       toast.error("An error occurred while communicating with the model.");
       setActiveMessages(prev => prev.slice(0, -1));